@@ -0,0 +1,239 @@
+# archive.py
+import glob
+import os
+import sqlite3
+import zlib
+from typing import Dict, List, Sequence, Tuple
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+# An archived message: (id, conversation_id, sender, receiver, content, timestamp)
+ArchivedMessage = Tuple[int, int, str, str, str, str]
+
+_PARTITION_PREFIX = "messages-"
+_PARTITION_SUFFIX = ".db"
+# Which partitions hold each conversation, so a page opens only those
+_INDEX_FILE = "index.db"
+
+
+def partition_name(timestamp: str) -> str:
+    """
+    Returns the monthly partition a message belongs to, e.g. "2024-01".
+
+    Args:
+        timestamp (str): The message's ISO 8601 timestamp.
+
+    Returns:
+        str: The partition name.
+    """
+    return timestamp[:7]
+
+
+def _partition_path(partition: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{_PARTITION_PREFIX}{partition}{_PARTITION_SUFFIX}")
+
+
+def list_partitions() -> List[str]:
+    """
+    Lists the archive partitions on disk, newest first.
+
+    Returns:
+        List[str]: Partition names.
+    """
+    pattern = os.path.join(ARCHIVE_DIR, f"{_PARTITION_PREFIX}*{_PARTITION_SUFFIX}")
+    names = [
+        os.path.basename(path)[len(_PARTITION_PREFIX) : -len(_PARTITION_SUFFIX)]
+        for path in glob.glob(pattern)
+    ]
+    return sorted(names, reverse=True)
+
+
+def _connect(partition: str) -> sqlite3.Connection:
+    """
+    Opens a partition, creating it if needed. Content is stored
+    zlib-compressed; archived rows are written once and rarely read.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(_partition_path(partition))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archived_messages (
+            id INTEGER PRIMARY KEY,
+            conversation_id INTEGER,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            content BLOB NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_archived_conversation "
+        "ON archived_messages (conversation_id, id)"
+    )
+    return conn
+
+
+def _connect_index() -> sqlite3.Connection:
+    """
+    Opens the conversation index, building it from the partitions on disk
+    when an archive that predates it is first opened.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(ARCHIVE_DIR, _INDEX_FILE))
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_partitions'"
+    ).fetchone()
+    if not exists:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_partitions (
+                conversation_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                min_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL,
+                PRIMARY KEY (conversation_id, month)
+            ) WITHOUT ROWID
+        """
+        )
+        for partition in list_partitions():
+            source = sqlite3.connect(_partition_path(partition))
+            try:
+                ranges = source.execute(
+                    "SELECT conversation_id, MIN(id), MAX(id) FROM archived_messages "
+                    "GROUP BY conversation_id"
+                ).fetchall()
+            finally:
+                source.close()
+            _index_partition(conn, partition, ranges)
+        conn.commit()
+    return conn
+
+
+def _index_partition(
+    conn: sqlite3.Connection, partition: str, ranges: Sequence[Tuple[int, int, int]]
+) -> None:
+    """
+    Records that a partition holds messages of some conversations, given as
+    (conversation_id, min_id, max_id) ranges merged with any already known.
+    """
+    conn.executemany(
+        """
+        INSERT INTO conversation_partitions (conversation_id, month, min_id, max_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (conversation_id, month) DO UPDATE SET
+            min_id = MIN(min_id, excluded.min_id),
+            max_id = MAX(max_id, excluded.max_id)
+    """,
+        [(conversation_id, partition, min_id, max_id) for conversation_id, min_id, max_id in ranges],
+    )
+
+
+def write_messages(messages: Sequence[ArchivedMessage]) -> None:
+    """
+    Writes messages to their monthly partitions. Writing a message twice is
+    harmless, so a copy interrupted before the source rows were deleted can
+    simply be repeated.
+
+    Args:
+        messages (Sequence[ArchivedMessage]): The messages to archive.
+
+    Returns:
+        None
+    """
+    by_partition: Dict[str, List[ArchivedMessage]] = {}
+    for message in messages:
+        by_partition.setdefault(partition_name(message[5]), []).append(message)
+
+    # Indexed first: an entry whose rows were never written only costs a lookup
+    index = _connect_index()
+    try:
+        for partition, rows in by_partition.items():
+            ranges: Dict[int, Tuple[int, int]] = {}
+            for id, conversation_id, *_ in rows:
+                low, high = ranges.get(conversation_id, (id, id))
+                ranges[conversation_id] = (min(low, id), max(high, id))
+            _index_partition(
+                index, partition, [(c, low, high) for c, (low, high) in ranges.items()]
+            )
+        index.commit()
+    finally:
+        index.close()
+
+    for partition, rows in by_partition.items():
+        conn = _connect(partition)
+        try:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO archived_messages
+                    (id, conversation_id, sender, receiver, content, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                [
+                    (id, conversation_id, sender, receiver, zlib.compress(content.encode("utf-8")), timestamp)
+                    for id, conversation_id, sender, receiver, content, timestamp in rows
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def get_conversation_messages(
+    conversation_id: int, before_id: int, limit: int
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Retrieves a page of archived messages of one conversation, walking the
+    partitions that hold it from newest to oldest.
+
+    Args:
+        conversation_id (int): The conversation.
+        before_id (int): Only return messages with an ID lower than this.
+        limit (int): The maximum number of messages to retrieve.
+
+    Returns:
+        List[Tuple[int, str, str, str]]: Tuples of (id, sender, content,
+            timestamp), sorted from oldest to newest.
+    """
+    index = _connect_index()
+    try:
+        partitions = [
+            row[0]
+            for row in index.execute(
+                """
+                SELECT month FROM conversation_partitions
+                WHERE conversation_id = ? AND min_id < ?
+                ORDER BY month DESC
+            """,
+                (conversation_id, before_id),
+            )
+        ]
+    finally:
+        index.close()
+
+    rows: List[Tuple[int, str, str, str]] = []
+    for partition in partitions:
+        if len(rows) >= limit:
+            break
+        conn = sqlite3.connect(_partition_path(partition))
+        try:
+            found = conn.execute(
+                """
+                SELECT id, sender, content, timestamp
+                FROM archived_messages
+                WHERE conversation_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            """,
+                (conversation_id, before_id, limit - len(rows)),
+            ).fetchall()
+        finally:
+            conn.close()
+        rows.extend(
+            (id, sender, zlib.decompress(content).decode("utf-8"), timestamp)
+            for id, sender, content, timestamp in found
+        )
+        if found:
+            before_id = found[-1][0]
+    # Partitions are walked newest first; return oldest first like the live table
+    return rows[::-1]
@@ -0,0 +1,379 @@
+# async_client.py
+import asyncio
+import base64
+import itertools
+import logging
+import os
+import random
+import struct
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from utils import (
+    WS_CLOSE_NORMAL,
+    WS_CLOSE_PROTOCOL_ERROR,
+    WebSocketUtil,
+    apply_mask,
+    generate_accept_key,
+)
+
+CONNECT_TIMEOUT = 5.0  # Seconds for the TCP connect and handshake
+REQUEST_TIMEOUT = 10.0  # Default seconds to wait for a reply to request()
+RECONNECT_INITIAL_DELAY = 0.1  # First reconnect backoff, in seconds
+RECONNECT_MAX_DELAY = 10.0  # Backoff cap, in seconds
+MAX_HANDSHAKE_RESPONSE = 8192  # Bytes of HTTP response accepted before giving up
+
+# One codec per mode for the whole process; it holds no connection state
+_codecs: Dict[str, WebSocketUtil] = {}
+
+
+def shared_codec(mode: Optional[str] = None) -> WebSocketUtil:
+    """
+    Returns the process-wide encoder/decoder for a mode, so thousands of
+    clients share one loaded protocol instead of parsing it per session.
+
+    Args:
+        mode (Optional[str]): "json" or "custom"; defaults to the MODE variable.
+
+    Returns:
+        WebSocketUtil: The shared codec and framer.
+    """
+    mode = mode or os.environ.get("MODE", "json")
+    codec = _codecs.get(mode)
+    if codec is None:
+        codec = _codecs[mode] = WebSocketUtil(mode=mode)
+    return codec
+
+
+class AsyncWebSocketClient:
+    """
+    asyncio counterpart of WebSocketClient with the same surface: connect,
+    send, receive, request and close.
+
+    A background task reads every frame. Replies to request() resolve their
+    futures by 'req_id'; everything else is queued for receive(). When the
+    connection drops, pending requests fail with ConnectionError and, if
+    reconnect is enabled, the client reconnects with exponential backoff and
+    runs on_reconnect (e.g. to log in again) before resuming.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: int = 8000,
+        mode: Optional[str] = None,
+        reconnect: bool = True,
+        on_reconnect: Optional[Callable[["AsyncWebSocketClient"], Awaitable[None]]] = None,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        request_timeout: float = REQUEST_TIMEOUT,
+    ) -> None:
+        """
+        Initializes the AsyncWebSocketClient object.
+
+        :param host: The server host; defaults to the HOST variable or localhost.
+        :param port: The server port.
+        :param mode: The codec, "json" or "custom".
+        :param reconnect: Whether to reconnect after the connection drops.
+        :param on_reconnect: Coroutine function run after each reconnect.
+        :param connect_timeout: Seconds allowed for connecting and the handshake.
+        :param request_timeout: Default seconds request() waits for a reply.
+        """
+        self.host = host or os.environ.get("HOST", "localhost")
+        self.port = port
+        self.websocket = shared_codec(mode)
+        self.reconnect = reconnect
+        self.on_reconnect = on_reconnect
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.connected = False
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._inbox: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._req_ids = itertools.count(1)
+        self._closed = False
+
+    async def connect(self, timeout: Optional[float] = None) -> bool:
+        """
+        Connects, performs the WebSocket handshake and starts the reader task.
+
+        Args:
+            timeout (Optional[float]): Seconds allowed; defaults to connect_timeout.
+
+        Returns:
+            bool: True if connected, False otherwise.
+        """
+        try:
+            await asyncio.wait_for(self._open(), timeout or self.connect_timeout)
+        except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+            logging.info(f"Connection to {self.host}:{self.port} failed: {e}")
+            return False
+        self._closed = False
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(self._run_reader())
+        return True
+
+    async def _open(self) -> None:
+        """
+        Opens the TCP connection and completes the handshake.
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        writer.write(
+            (
+                "GET / HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "\r\n"
+            ).encode()
+        )
+        await writer.drain()
+        try:
+            # Read exactly the response headers; any frame bytes the server
+            # sent right after them stay buffered in the reader
+            response = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            writer.close()
+            raise ConnectionError(f"Handshake failed: {e}")
+        if len(response) > MAX_HANDSHAKE_RESPONSE or not response.startswith(
+            b"HTTP/1.1 101"
+        ):
+            writer.close()
+            raise ConnectionError("Handshake failed")
+        if generate_accept_key(key).encode() not in response:
+            writer.close()
+            raise ConnectionError("Handshake failed: bad Sec-WebSocket-Accept")
+        self._reader, self._writer = reader, writer
+        self.connected = True
+
+    async def send(self, message: Union[Dict, str]) -> None:
+        """
+        Sends a message to the server.
+
+        Args:
+            message (Union[dict, str]): A dict is sent as is; a str is wrapped
+                as {"message": message}.
+
+        Raises:
+            ConnectionError: If the client is not connected.
+        """
+        if not self.connected or self._writer is None:
+            raise ConnectionError("Not connected.")
+        if not isinstance(message, dict):
+            message = {"message": message}
+        payload = self.websocket.encode_payload(message)
+        # One synchronous write per message, so concurrent senders never interleave
+        self._writer.writelines(self.websocket.frame_buffers(payload))
+        await self._writer.drain()
+
+    async def request(
+        self, message: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Sends a request tagged with a fresh 'req_id' and waits for its reply.
+        Any number of requests may be in flight at once.
+
+        Args:
+            message (Dict[str, Any]): The request. It is copied, not modified.
+            timeout (Optional[float]): Seconds to wait; defaults to request_timeout.
+
+        Returns:
+            Dict[str, Any]: The reply, error replies included.
+
+        Raises:
+            asyncio.TimeoutError: If no reply arrives in time.
+            ConnectionError: If the connection drops first.
+        """
+        req_id = next(self._req_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = future
+        try:
+            await self.send({**message, "req_id": req_id})
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def receive(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the next push or untagged reply.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait, or None to wait forever.
+
+        Returns:
+            Optional[Dict[str, Any]]: The message, or None once the client is
+                closed and every queued message was received.
+
+        Raises:
+            asyncio.TimeoutError: If nothing arrives in time.
+        """
+        if self._closed and self._inbox.empty():
+            return None
+        return await asyncio.wait_for(self._inbox.get(), timeout)
+
+    async def close(self) -> None:
+        """
+        Closes the connection and stops the reader task without reconnecting.
+        """
+        self._closed = True
+        task, self._reader_task = self._reader_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            try:
+                self._writer.write(self.websocket.build_close_frame(WS_CLOSE_NORMAL))
+                await self._writer.drain()
+            except OSError:
+                pass
+        self._drop_connection()
+        self._fail_pending(ConnectionError("Connection closed."))
+        self._inbox.put_nowait(None)
+
+    def _drop_connection(self) -> None:
+        self.connected = False
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    def _fail_pending(self, error: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run_reader(self) -> None:
+        """
+        Reads frames until closed, reconnecting after drops if enabled.
+        """
+        while not self._closed:
+            try:
+                while True:
+                    message = await self._read_message()
+                    if message is None:
+                        break
+                    future = self._pending.pop(message.get("req_id"), None)
+                    if future is None or future.done():
+                        self._inbox.put_nowait(message)
+                    else:
+                        future.set_result(message)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                logging.info(f"Connection to {self.host}:{self.port} lost: {e}")
+            except ValueError as e:
+                logging.error(f"Protocol error from {self.host}:{self.port}: {e}")
+                if self._writer is not None:
+                    self._writer.write(
+                        self.websocket.build_close_frame(
+                            getattr(e, "code", WS_CLOSE_PROTOCOL_ERROR), str(e)
+                        )
+                    )
+
+            self._drop_connection()
+            self._fail_pending(ConnectionError("Connection lost."))
+            if self._closed or not self.reconnect or not await self._reconnect():
+                break
+
+        self._closed = True
+        self._inbox.put_nowait(None)
+
+    async def _reconnect(self) -> bool:
+        """
+        Reconnects with exponential backoff and jitter until it succeeds or
+        the client is closed, then runs on_reconnect.
+
+        Returns:
+            bool: True once reconnected, False if closed meanwhile.
+        """
+        delay = RECONNECT_INITIAL_DELAY
+        while not self._closed:
+            # Jitter spreads out many clients reconnecting after one outage
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            try:
+                await asyncio.wait_for(self._open(), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+                logging.info(f"Reconnect to {self.host}:{self.port} failed: {e}")
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            if self.on_reconnect is not None:
+                # Runs as its own task: it may await request(), whose reply
+                # only this reader task can deliver
+                asyncio.create_task(self.on_reconnect(self))
+            return True
+        return False
+
+    async def _read_message(self) -> Optional[Dict[str, Any]]:
+        """
+        Reads and decodes one message, reassembling fragments and skipping
+        control frames, with the same limits as WebSocketUtil.read_message.
+
+        Returns:
+            Optional[Dict[str, Any]]: The message, or None on a close frame.
+        """
+        reader = self._reader
+        util = self.websocket
+        while True:
+            chunks = []
+            length = 0
+            message_opcode = None
+            while True:
+                b1, b2 = await reader.readexactly(2)
+                fin = b1 & util.WS_FIN_BIT
+                opcode = b1 & util.WS_OPCODE_MASK
+                payload_len = b2 & util.WS_PAYLOAD_LEN_MASK
+                if payload_len == util.WS_PAYLOAD_LEN_16BIT:
+                    (payload_len,) = struct.unpack(
+                        util.WS_16BIT_LEN_FORMAT, await reader.readexactly(2)
+                    )
+                elif payload_len == util.WS_PAYLOAD_LEN_64BIT:
+                    (payload_len,) = struct.unpack(
+                        util.WS_64BIT_LEN_FORMAT, await reader.readexactly(8)
+                    )
+                masked = b2 & util.WS_MASK_BIT
+                masking_key = await reader.readexactly(4) if masked else None
+
+                if opcode >= util.WS_CONTROL_OPCODE_MIN:
+                    # Control frames are never fragmented and may arrive mid-message
+                    control_payload = await reader.readexactly(payload_len)
+                    if masking_key is not None and control_payload:
+                        control_payload = apply_mask(control_payload, masking_key)
+                    if opcode == util.WS_OPCODE_CLOSE:
+                        # Echo the status; the server then closes the connection
+                        code, _ = util.parse_close_payload(control_payload)
+                        self._writer.write(util.build_close_frame(code))
+                        return None
+                    if opcode == util.WS_OPCODE_PING:
+                        # Answer heartbeats so an idle client is not reaped
+                        self._writer.write(
+                            util.build_control_frame(util.WS_OPCODE_PONG, control_payload)
+                        )
+                    continue
+
+                if opcode == util.WS_OPCODE_CONTINUATION:
+                    if message_opcode is None:
+                        raise ValueError("Continuation frame without a message start.")
+                elif message_opcode is not None:
+                    raise ValueError("New message started before previous one finished.")
+                else:
+                    message_opcode = opcode
+                length += payload_len
+                if length > util.max_message_size:
+                    raise ValueError(
+                        f"Message exceeds max size of {util.max_message_size} bytes."
+                    )
+
+                chunk = await reader.readexactly(payload_len)
+                if masking_key is not None:
+                    chunk = apply_mask(chunk, masking_key)
+                chunks.append(chunk)
+                if fin:
+                    break
+
+            # For simplicity, ignore binary messages
+            if message_opcode == util.WS_OPCODE_TEXT:
+                return util.decode_payload(b"".join(chunks))
@@ -0,0 +1,470 @@
+# cache.py
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import metrics
+
+# A cached message: (id, sender, receiver, content, timestamp)
+CachedMessage = Tuple[int, str, str, str, str]
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024  # Global memory budget (32 MiB)
+DEFAULT_TAIL_SIZE = 100  # Messages kept per user and list
+MESSAGE_OVERHEAD_BYTES = 120  # Approximate cost of the tuple and its objects
+VERSION_STRIPES = 1024  # Write-version slots, shared by hashing usernames
+
+
+def _message_size(message: CachedMessage) -> int:
+    """
+    Estimates the memory used by a cached message.
+
+    Args:
+        message (CachedMessage): The cached message.
+
+    Returns:
+        int: The approximate size in bytes.
+    """
+    _, sender, receiver, content, timestamp = message
+    return MESSAGE_OVERHEAD_BYTES + len(sender) + len(receiver) + len(content) + len(timestamp)
+
+
+class _UserEntry:
+    """
+    The cached tail of one user's messages.
+
+    recent holds the newest read messages involving the user and unread the
+    oldest unread messages sent to them, both sorted by ID. A list is None
+    until it has been loaded. A list that is not *_complete may be missing
+    messages beyond its end, so it can only serve requests it fully covers.
+    """
+
+    __slots__ = ("recent", "recent_complete", "unread", "unread_complete", "size")
+
+    def __init__(self) -> None:
+        self.recent: Optional[List[CachedMessage]] = None
+        self.recent_complete = False
+        self.unread: Optional[List[CachedMessage]] = None
+        self.unread_complete = False
+        self.size = 0
+
+    def compute_size(self) -> int:
+        """
+        Estimates the memory held by this entry's messages.
+        """
+        total = 0
+        for messages in (self.recent, self.unread):
+            if messages:
+                total += sum(_message_size(m) for m in messages)
+        return total
+
+
+class MessageCache:
+    """
+    Bounded LRU cache of each user's recent and unread messages.
+
+    The database layer reads through it and updates it write-through on
+    inserts, reads and deletes. Entries are evicted least recently used
+    first once the estimated size of all entries exceeds max_bytes.
+    """
+
+    def __init__(
+        self, max_bytes: int = DEFAULT_CACHE_BYTES, tail_size: int = DEFAULT_TAIL_SIZE
+    ) -> None:
+        """
+        Initializes the MessageCache object.
+
+        :param max_bytes: The global memory budget; 0 disables the cache.
+        :type max_bytes: int
+        :param tail_size: The maximum number of messages kept per user and list.
+        :type tail_size: int
+        """
+        self.max_bytes = max_bytes
+        self.tail_size = tail_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _UserEntry]" = OrderedDict()
+        self._bytes = 0
+        self._versions = [0] * VERSION_STRIPES
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def version(self, username: str) -> int:
+        """
+        Returns the write version of a user. Take it before reading from the
+        database and pass it to the fill methods, so a fill that raced with a
+        write is discarded instead of caching stale rows.
+
+        Args:
+            username (str): The user.
+
+        Returns:
+            int: An opaque version number.
+        """
+        with self._lock:
+            return self._versions[hash(username) % VERSION_STRIPES]
+
+    def get_recent(self, username: str, limit: int) -> Optional[List[CachedMessage]]:
+        """
+        Returns the newest 'limit' read messages of a user, oldest first,
+        or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry.recent is not None:
+                if entry.recent_complete or len(entry.recent) >= limit:
+                    self._entries.move_to_end(username)
+                    self._record(hit=True)
+                    return entry.recent[-limit:] if limit else []
+            self._record(hit=False)
+            return None
+
+    def get_unread(self, username: str, limit: int) -> Optional[List[CachedMessage]]:
+        """
+        Returns the oldest 'limit' unread messages of a user, oldest first,
+        or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry.unread is not None:
+                if entry.unread_complete or len(entry.unread) >= limit:
+                    self._entries.move_to_end(username)
+                    self._record(hit=True)
+                    return entry.unread[:limit]
+            self._record(hit=False)
+            return None
+
+    def fill_recent(
+        self, username: str, version: int, messages: List[CachedMessage], limit: int
+    ) -> None:
+        """
+        Caches a user's recent messages as loaded from the database.
+
+        Args:
+            username (str): The user.
+            version (int): The version returned by version() before the load.
+            messages (List[CachedMessage]): The newest read messages, oldest first.
+            limit (int): The limit the load used; fewer rows means the list is complete.
+        """
+        self._fill(username, version, messages, limit, unread=False)
+
+    def fill_unread(
+        self, username: str, version: int, messages: List[CachedMessage], limit: int
+    ) -> None:
+        """
+        Caches a user's unread messages as loaded from the database.
+
+        Args:
+            username (str): The user.
+            version (int): The version returned by version() before the load.
+            messages (List[CachedMessage]): The oldest unread messages, oldest first.
+            limit (int): The limit the load used; fewer rows means the list is complete.
+        """
+        self._fill(username, version, messages, limit, unread=True)
+
+    def on_insert(self, message: CachedMessage) -> None:
+        """
+        Write-through for a newly inserted, unread message.
+        """
+        _, _, receiver, _, _ = message
+        with self._lock:
+            self._bump(receiver)
+            entry = self._entries.get(receiver)
+            if entry is None or entry.unread is None or not entry.unread_complete:
+                # An incomplete unread list is the oldest tail; new messages sort after it
+                return
+            # Senders on other threads can write through out of ID order
+            index = bisect.bisect_left(entry.unread, (message[0],))
+            if index < len(entry.unread) and entry.unread[index][0] == message[0]:
+                return  # Already picked up by a concurrent fill
+            entry.unread.insert(index, message)
+            if len(entry.unread) > self.tail_size:
+                del entry.unread[self.tail_size :]
+                entry.unread_complete = False
+            self._resize(receiver, entry)
+
+    def on_read(
+        self,
+        receiver: str,
+        sender: str,
+        message_ids: Optional[Iterable[int]] = None,
+        up_to_id: Optional[int] = None,
+    ) -> None:
+        """
+        Write-through for messages from sender to receiver becoming read,
+        given either as exact IDs or as everything up to an ID.
+        """
+        ids = set(message_ids) if message_ids is not None else None
+        with self._lock:
+            self._bump(receiver)
+            self._bump(sender)
+            entry = self._entries.get(receiver)
+            if entry is None or entry.unread is None or not entry.unread_complete:
+                # Which messages became read is unknown; drop what could be stale
+                self._invalidate(receiver)
+                self._invalidate(sender)
+                return
+
+            def became_read(message: CachedMessage) -> bool:
+                if message[1] != sender:
+                    return False
+                if ids is not None:
+                    return message[0] in ids
+                return message[0] <= up_to_id
+
+            moved = [m for m in entry.unread if became_read(m)]
+            if not moved:
+                return
+            entry.unread = [m for m in entry.unread if not became_read(m)]
+            for username in {receiver, sender}:
+                user_entry = self._entries.get(username)
+                if user_entry is None or user_entry.recent is None:
+                    continue
+                for message in moved:
+                    index = bisect.bisect_left(user_entry.recent, message)
+                    if index == len(user_entry.recent) or user_entry.recent[index] != message:
+                        user_entry.recent.insert(index, message)
+                if len(user_entry.recent) > self.tail_size:
+                    del user_entry.recent[: len(user_entry.recent) - self.tail_size]
+                    user_entry.recent_complete = False
+                self._resize(username, user_entry)
+
+    def on_delete(self, message_id: int, sender: str, receiver: str) -> None:
+        """
+        Write-through for a deleted message.
+        """
+        with self._lock:
+            for username in {sender, receiver}:
+                self._bump(username)
+                entry = self._entries.get(username)
+                if entry is None:
+                    continue
+                for messages in (entry.recent, entry.unread):
+                    if messages:
+                        messages[:] = [m for m in messages if m[0] != message_id]
+                self._resize(username, entry)
+
+    def invalidate(self, username: str) -> None:
+        """
+        Drops a user's entry, e.g. after a change the cache cannot mirror.
+        """
+        with self._lock:
+            self._bump(username)
+            self._invalidate(username)
+
+    def clear(self) -> None:
+        """
+        Drops every entry and resets the hit statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._versions = [v + 1 for v in self._versions]
+            self.hits = 0
+            self.misses = 0
+            metrics.set_gauge("message_cache.bytes", 0)
+
+    def hit_ratio(self) -> float:
+        """
+        Returns the fraction of lookups served from the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def _fill(
+        self,
+        username: str,
+        version: int,
+        messages: List[CachedMessage],
+        limit: int,
+        unread: bool,
+    ) -> None:
+        """
+        Stores one of a user's lists unless a write happened since version.
+        """
+        if not self.enabled or limit > self.tail_size:
+            return
+        with self._lock:
+            if self._versions[hash(username) % VERSION_STRIPES] != version:
+                return  # A write raced with the load
+            entry = self._entries.get(username)
+            if entry is None:
+                entry = self._entries[username] = _UserEntry()
+            complete = len(messages) < limit
+            if unread:
+                entry.unread, entry.unread_complete = list(messages), complete
+            else:
+                entry.recent, entry.recent_complete = list(messages), complete
+            self._entries.move_to_end(username)
+            self._resize(username, entry)
+
+    def _resize(self, username: str, entry: _UserEntry) -> None:
+        """
+        Updates size accounting after an entry changed and evicts least
+        recently used entries while over budget. Caller holds the lock.
+        """
+        new_size = entry.compute_size()
+        self._bytes += new_size - entry.size
+        entry.size = new_size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            metrics.increment("message_cache.evictions")
+        metrics.set_gauge("message_cache.bytes", self._bytes)
+
+    def _invalidate(self, username: str) -> None:
+        """
+        Drops a user's entry. Caller holds the lock.
+        """
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            metrics.set_gauge("message_cache.bytes", self._bytes)
+
+    def _bump(self, username: str) -> None:
+        """
+        Marks a write for a user so in-flight fills are discarded. Caller holds the lock.
+        """
+        self._versions[hash(username) % VERSION_STRIPES] += 1
+
+    def _record(self, hit: bool) -> None:
+        """
+        Counts a lookup and publishes the hit ratio. Caller holds the lock.
+        """
+        if hit:
+            self.hits += 1
+            metrics.increment("message_cache.hits")
+        else:
+            self.misses += 1
+            metrics.increment("message_cache.misses")
+        metrics.set_gauge("message_cache.hit_ratio", self.hits / (self.hits + self.misses))
+
+
+class UserDirectory:
+    """
+    Versioned in-memory copy of all usernames, kept sorted for prefix search.
+
+    The directory is loaded lazily through a loader callable and kept current
+    by add() and remove(). Each change bumps the version, which clients can
+    compare to tell whether a list they fetched earlier is stale.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the UserDirectory object.
+        """
+        self._usernames: Optional[List[str]] = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def load(self, loader: Callable[[], Iterable[str]]) -> Tuple[List[str], int]:
+        """
+        Returns the sorted usernames and the directory version, calling loader
+        to read them from storage if they are not in memory.
+
+        Args:
+            loader (Callable[[], Iterable[str]]): Reads all usernames from storage.
+
+        Returns:
+            Tuple[List[str], int]: The sorted usernames (do not modify) and the version.
+        """
+        with self._lock:
+            if self._usernames is not None:
+                return self._usernames, self._version
+            version = self._version
+        usernames = sorted(loader())
+        with self._lock:
+            if self._version == version:
+                # Nothing changed during the load, so it can be kept
+                self._usernames = usernames
+            return usernames, version
+
+    def search(
+        self,
+        loader: Callable[[], Iterable[str]],
+        prefix: str,
+        limit: int,
+        exclude: Optional[str] = None,
+    ) -> Tuple[List[str], int]:
+        """
+        Finds up to 'limit' usernames starting with 'prefix', in sorted order.
+
+        Args:
+            loader (Callable[[], Iterable[str]]): Reads all usernames from storage.
+            prefix (str): The prefix to match; empty matches everyone.
+            limit (int): The maximum number of usernames returned.
+            exclude (Optional[str]): A username to leave out, usually the caller's.
+
+        Returns:
+            Tuple[List[str], int]: The matching usernames and the directory version.
+        """
+        usernames, version = self.load(loader)
+        matches = []
+        index = bisect.bisect_left(usernames, prefix)
+        while index < len(usernames) and len(matches) < limit:
+            username = usernames[index]
+            if not username.startswith(prefix):
+                break
+            if username != exclude:
+                matches.append(username)
+            index += 1
+        return matches, version
+
+    def add(self, username: str) -> None:
+        """
+        Records a newly registered user.
+        """
+        with self._lock:
+            self._version += 1
+            if self._usernames is None:
+                return
+            index = bisect.bisect_left(self._usernames, username)
+            if index == len(self._usernames) or self._usernames[index] != username:
+                # Copy so lists already handed out stay unchanged
+                self._usernames = (
+                    self._usernames[:index] + [username] + self._usernames[index:]
+                )
+
+    def remove(self, username: str) -> None:
+        """
+        Records a deleted user.
+        """
+        with self._lock:
+            self._version += 1
+            if self._usernames is None:
+                return
+            index = bisect.bisect_left(self._usernames, username)
+            if index < len(self._usernames) and self._usernames[index] == username:
+                self._usernames = self._usernames[:index] + self._usernames[index + 1 :]
+
+    def invalidate(self) -> None:
+        """
+        Drops the in-memory copy so the next lookup reloads it.
+        """
+        with self._lock:
+            self._version += 1
+            self._usernames = None
+
+
+message_cache = MessageCache(
+    max_bytes=int(os.environ.get("MESSAGE_CACHE_BYTES", DEFAULT_CACHE_BYTES)),
+    tail_size=int(os.environ.get("MESSAGE_CACHE_TAIL", DEFAULT_TAIL_SIZE)),
+)
+user_directory = UserDirectory()
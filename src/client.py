@@ -1,12 +1,41 @@
 import socket
 import json
-from utils import perform_handshake, WebSocketUtil
-from typing import Union, Dict, Any
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from utils import (
+    generate_accept_key,
+    parse_http_head,
+    perform_handshake,
+    read_http_head,
+    WebSocketUtil,
+    WebSocketError,
+    RECV_CHUNK_SIZE,
+    WS_CLOSE_NORMAL,
+    WS_CLOSE_TIMEOUT,
+)
+from typing import Union, Dict, Any, Iterable, List, Optional
 import os
 
+# Acknowledgements are sent once this many IDs are pending...
+ACK_BATCH_SIZE = 50
+# ...or this many seconds after the first pending one, whichever comes first
+ACK_FLUSH_INTERVAL = 0.2
+
+# Sends this many seconds apart are coalesced into one 'batch' frame when
+# auto-batching is on; long enough to catch a burst, short enough to be unnoticed
+DEFAULT_BATCH_WINDOW = 0.005
+# Most requests per batch frame; matches the server's limit
+BATCH_MAX_REQUESTS = 50
+
+# Seconds the server has to answer the handshake
+HANDSHAKE_TIMEOUT = 5.0
+HANDSHAKE_KEY = "dGhlIHNhbXBsZSBub25jZQ=="  # Example key
+
 
 class WebSocketClient:
-    def __init__(self, host=None, port=8000, mode=None):
+    def __init__(self, host=None, port=8000, mode=None, batch_window: float = 0.0):
         if not host:
             host = os.environ.get("HOST", "localhost")
         self.host = host
@@ -14,12 +43,30 @@ class WebSocketClient:
         self.socket = None
         self.websocket = WebSocketUtil(mode=mode)
         # self.running = False
+        self._pending_acks: List[int] = []
+        self._ack_lock = threading.Lock()
+        self._ack_timer: Optional[threading.Timer] = None
+        # Requests awaiting their reply, keyed by req_id
+        self._pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        # Set once our close frame went out; nothing may be sent after it
+        self._close_sent = False
+        # Auto-batching: sends queued within batch_window go out as one frame
+        self.batch_window = batch_window
+        self._outbox: List[Dict[str, Any]] = []
+        self._batch_lock = threading.Lock()
+        self._batch_timer: Optional[threading.Timer] = None
+        # Replies unpacked from a batch response, not yet returned by receive()
+        self._inbox: deque = deque()
 
     def connect(self):
         """Establish connection and perform WebSocket handshake"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self._close_sent = False
 
             # Send WebSocket handshake request
             handshake_request = (
@@ -27,16 +74,21 @@ class WebSocketClient:
                 f"Host: {self.host}:{self.port}\r\n"
                 "Upgrade: websocket\r\n"
                 "Connection: Upgrade\r\n"
-                "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"  # Example key
+                f"Sec-WebSocket-Key: {HANDSHAKE_KEY}\r\n"
                 "Sec-WebSocket-Version: 13\r\n"
                 "\r\n"
             )
-            self.socket.send(handshake_request.encode())
+            self.socket.sendall(handshake_request.encode())
 
-            # Receive and verify handshake response
-            response = self.socket.recv(1024).decode()
-            if "101 Switching Protocols" not in response:
-                raise Exception("Handshake failed")
+            # Receive and verify handshake response; frames the server sent
+            # right after it stay in the socket for receive()
+            status_line, headers = parse_http_head(
+                read_http_head(self.socket, timeout=HANDSHAKE_TIMEOUT)
+            )
+            if status_line.split(" ")[1:2] != ["101"]:
+                raise Exception(f"Handshake failed: {status_line}")
+            if headers.get("sec-websocket-accept") != generate_accept_key(HANDSHAKE_KEY):
+                raise Exception("Handshake failed: bad Sec-WebSocket-Accept")
             self.connected = True
             return True
 
@@ -47,23 +99,188 @@ class WebSocketClient:
     def send(self, message: Union[Dict, str]) -> None:
         """Send a message to the server
 
+        With a positive batch_window, messages sent within the window of the
+        first one are queued and sent together as one 'batch' frame.
+
         Args:
             message (Union[dict, str]): The message to send. If a dict, it will be sent as a JSON-encoded text frame. If a str, it will be sent as a text frame with the string as the payload.
         """
-        if isinstance(message, dict):
+        if not isinstance(message, dict):
+            message = {"message": message}
+        if self.batch_window <= 0:
+            self._write([message])
+            return
+        with self._batch_lock:
+            self._outbox.append(message)
+            if len(self._outbox) < BATCH_MAX_REQUESTS:
+                if self._batch_timer is None:
+                    self._batch_timer = threading.Timer(self.batch_window, self.flush)
+                    self._batch_timer.daemon = True
+                    self._batch_timer.start()
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        """Send every message queued by auto-batching now"""
+        with self._batch_lock:
+            messages, self._outbox = self._outbox, []
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+        for start in range(0, len(messages), BATCH_MAX_REQUESTS):
+            self._write(messages[start : start + BATCH_MAX_REQUESTS])
+
+    def _write(self, messages: List[Dict[str, Any]]) -> None:
+        """Send one message as is, or several as one 'batch' frame"""
+        if not messages:
+            return
+        message = messages[0] if len(messages) == 1 else {"action": "batch", "requests": messages}
+        # Frames from the UI, request, batch and ack threads must not interleave
+        with self._send_lock:
             self.websocket.send_ws_frame(self.socket, message)
-        else:
-            self.websocket.send_ws_frame(self.socket, {"message": message})
+
+    def request(self, message: Dict[str, Any]) -> Future:
+        """Send a request and return a future for its reply
+
+        The request is tagged with a fresh 'req_id', which the server echoes on
+        its reply, so any number of requests can be in flight on the connection
+        at once. The future is resolved by whichever thread calls receive(),
+        usually a listener loop; use future.result(timeout) to wait for it.
+
+        Args:
+            message (Dict[str, Any]): The request. It is copied, not modified.
+
+        Returns:
+            Future: Resolves to the reply dict, error replies included, or fails
+                with ConnectionError if the connection closes first.
+        """
+        req_id = next(self._req_ids)
+        future: Future = Future()
+        with self._pending_lock:
+            self._pending[req_id] = future
+        try:
+            self.send({**message, "req_id": req_id})
+        except Exception as e:
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
+            future.set_exception(e)
+        return future
 
     def receive(self):
-        """Receive a message from the server"""
+        """Receive a message from the server
+
+        Replies to request() resolve their futures and are not returned; this
+        returns the next pushed message or reply to a plain send(), or None once
+        the connection is closed. Replies arriving in a 'batch_response' are
+        returned one at a time.
+        """
+        while True:
+            if self._inbox:
+                message = self._inbox.popleft()
+            else:
+                try:
+                    message = self.websocket.read_ws_frame(
+                        self.socket, on_control=self._on_control
+                    )
+                except WebSocketError as e:
+                    print(f"[-] Protocol error from server: {e}")
+                    self._send_close(e.code, str(e))
+                    message = None
+                except OSError as e:
+                    print(f"[-] Connection lost: {e}")
+                    message = None
+                if message is None:
+                    self._fail_pending(ConnectionError("Connection closed."))
+                    return None
+                if message.get("action") == "batch_response":
+                    # Hand out the replies one by one, as if sent separately
+                    self._inbox.extend(message.get("responses", []))
+                    if message.get("req_id") is None:
+                        continue
+            with self._pending_lock:
+                future = self._pending.pop(message.get("req_id"), None)
+            if future is None:
+                return message
+            future.set_result(message)
+
+    def _on_control(self, opcode: int, payload: bytes) -> None:
+        """Answer the server's heartbeat pings, so an idle client is not reaped,
+        and echo its close frame to complete the closing handshake"""
+        if opcode == self.websocket.WS_OPCODE_PING:
+            frame = self.websocket.build_control_frame(self.websocket.WS_OPCODE_PONG, payload)
+            with self._send_lock:
+                if not self._close_sent:
+                    self.socket.sendall(frame)
+        elif opcode == self.websocket.WS_OPCODE_CLOSE:
+            code, _ = self.websocket.parse_close_payload(payload)
+            self._send_close(code)
+
+    def _send_close(self, code: int, reason: str = "") -> None:
+        """Send a close frame, unless one was sent already"""
+        with self._send_lock:
+            if self._close_sent:
+                return
+            self._close_sent = True
+            try:
+                self.socket.sendall(self.websocket.build_close_frame(code, reason))
+            except OSError:
+                pass  # The connection is gone anyway
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Fail every request still waiting for a reply"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def ack(self, message_ids: Iterable[int]) -> None:
+        """Acknowledge received messages so the server stops replaying them
 
-        return self.websocket.read_ws_frame(self.socket)
+        IDs are batched into one 'ack_delivered' frame per ACK_BATCH_SIZE IDs or
+        ACK_FLUSH_INTERVAL seconds. Until then the messages stay undelivered on
+        the server, so a crash in between means they are replayed, never lost.
+
+        Args:
+            message_ids (Iterable[int]): The IDs of the messages received.
+        """
+        with self._ack_lock:
+            self._pending_acks.extend(message_ids)
+            if len(self._pending_acks) < ACK_BATCH_SIZE:
+                if self._pending_acks and self._ack_timer is None:
+                    self._ack_timer = threading.Timer(ACK_FLUSH_INTERVAL, self.flush_acks)
+                    self._ack_timer.daemon = True
+                    self._ack_timer.start()
+                return
+        self.flush_acks()
+
+    def flush_acks(self) -> None:
+        """Send every pending acknowledgement now"""
+        with self._ack_lock:
+            ids, self._pending_acks = self._pending_acks, []
+            if self._ack_timer is not None:
+                self._ack_timer.cancel()
+                self._ack_timer = None
+        for start in range(0, len(ids), ACK_BATCH_SIZE):
+            self.send({"action": "ack_delivered", "ids": ids[start : start + ACK_BATCH_SIZE]})
 
     def close(self):
-        """Close the WebSocket connection"""
+        """Close the WebSocket connection
+
+        Sends a close frame and waits up to WS_CLOSE_TIMEOUT seconds for the
+        server to close its side first, as RFC 6455 asks of clients.
+        """
         if self.socket:
+            self.flush_acks()
+            self.flush()
+            self._fail_pending(ConnectionError("Connection closed."))
             print("Closing connection...")
+            self._send_close(WS_CLOSE_NORMAL)
+            try:
+                self.socket.settimeout(WS_CLOSE_TIMEOUT)
+                while self.socket.recv(RECV_CHUNK_SIZE):
+                    pass  # Skip whatever the server sent before closing
+            except OSError:
+                pass
             self.socket.close()
 
 
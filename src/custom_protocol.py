@@ -4,8 +4,23 @@ import struct
 import logging
 import os
 
-from typing import Dict, Any, List, Optional, Tuple
+from collections.abc import Mapping, Sequence
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
+# Optional correlation ID accepted on every message. It is not part of any
+# schema: when present it is appended after the schema fields as a 4-byte
+# unsigned integer, so decoders that predate it simply ignore it.
+REQ_ID_FIELD = "req_id"
+
+# Encoded sizes of the field types whose size does not depend on the value
+FIXED_SIZES = {"int": 4}
+
+
+class MessageDecodeError(ValueError):
+    """
+    Raised when a field of a lazily decoded message turns out to be
+    malformed on access, see Decoder.decode_view.
+    """
 
 # undo hardcode
 def load_protocols(
@@ -79,6 +94,8 @@ class Encoder:
 
                 where "<action_name>" is the name of the action, and "<field_name_i>" and
                 "<field_value_i>" are the name and value of the i-th field, respectively.
+                Fields marked "optional" in the schema may be left out. An
+                optional "req_id" is encoded after the fields.
 
         Returns:
             bytes: The encoded message as a sequence of bytes.
@@ -105,7 +122,12 @@ class Encoder:
         # Encode each field based on the schema
         for field_name, field_spec in self.messages[message_type]["fields"].items():
             field_value = message_obj.get(field_name)
-            if field_value is None:
+            if field_spec.get("optional"):
+                # A presence byte, then the value only if present
+                encoded += struct.pack("!B", field_value is not None)
+                if field_value is None:
+                    continue
+            elif field_value is None:
                 raise ValueError(
                     f"Missing field '{field_name}' in message '{message_type}'."
                 )
@@ -122,6 +144,12 @@ class Encoder:
             else:
                 raise NotImplementedError(f"Unsupported field type: {field_type}")
 
+        req_id = message_obj.get(REQ_ID_FIELD)
+        if req_id is not None:
+            if not 0 <= req_id <= 0xFFFFFFFF:
+                raise ValueError(f"'{REQ_ID_FIELD}' must fit in 4 unsigned bytes.")
+            encoded += struct.pack("!I", req_id)
+
         return encoded
 
     @staticmethod
@@ -189,12 +217,27 @@ class Encoder:
                         "Missing 'items' specification for object in list."
                     )
                 encoded += self.encode_object(item, items_spec["fields"])
+            elif element_type == "message":
+                encoded += self.encode_nested_message(item)
             else:
                 raise NotImplementedError(
                     f"Unsupported list element type: {element_type}"
                 )
         return encoded
 
+    def encode_nested_message(self, message_obj: Dict[str, Any]) -> bytes:
+        """
+        Encode a complete message, with its own action, as a list element.
+
+        Args:
+            message_obj (Dict[str, Any]): The message to encode.
+
+        Returns:
+            bytes: The encoded message prefixed with its 4-byte length.
+        """
+        encoded = self.encode_message(message_obj)
+        return struct.pack("!I", len(encoded)) + encoded
+
     def encode_object(self, obj: Dict[str, Any], fields_spec: Dict[str, Any]) -> bytes:
         """
         Encode a dictionary into bytes.
@@ -275,6 +318,12 @@ class Decoder:
         self.messages = protocols["messages"]
         # Create reverse mapping from action_id to action_type
         self.id_to_action: Dict[int, str] = {v: k for k, v in self.action_ids.items()}
+        # Schemas compiled for decode_view, by action ID
+        self.layouts: Dict[int, MessageLayout] = {
+            action_id: MessageLayout(action, self.messages[action]["fields"])
+            for action_id, action in self.id_to_action.items()
+            if action in self.messages
+        }
 
     def decode_message(self, data: bytes) -> Dict[str, Any]:
         """
@@ -304,6 +353,13 @@ class Decoder:
         message_obj: Dict[str, Any] = {"action": action_type}
 
         for field_name, field_spec in message_schema["fields"].items():
+            if field_spec.get("optional"):
+                if offset >= len(data):
+                    raise ValueError(f"Data too short for field '{field_name}'.")
+                present = data[offset]
+                offset += 1
+                if not present:
+                    continue
             field_type: str = field_spec["type"]
             if field_type == "string":
                 field_value, bytes_consumed = self.decode_string(data, offset)
@@ -329,6 +385,10 @@ class Decoder:
             else:
                 raise NotImplementedError(f"Unsupported field type: {field_type}")
 
+        # Trailing request ID, if the sender attached one
+        if len(data) >= offset + 4:
+            message_obj[REQ_ID_FIELD] = struct.unpack_from("!I", data, offset)[0]
+
         return message_obj
 
     @staticmethod
@@ -354,9 +414,8 @@ class Decoder:
         if len(data) < offset + length:
             raise ValueError("Data too short to contain the expected string.")
 
-        # Unpack the string bytes
-        string_bytes = data[offset : offset + length]
-        string_value = string_bytes.decode("utf-8")
+        # Unpack the string bytes; str() also accepts memoryview slices
+        string_value = str(data[offset : offset + length], "utf-8")
         return string_value, 2 + length
 
     @staticmethod
@@ -413,6 +472,8 @@ class Decoder:
                         "Missing 'items' specification for object in list."
                     )
                 item, consumed = self.decode_object(data, offset, items_spec["fields"])
+            elif element_type == "message":
+                item, consumed = self.decode_nested_message(data, offset)
             else:
                 raise NotImplementedError(
                     f"Unsupported list element type: {element_type}"
@@ -422,6 +483,25 @@ class Decoder:
             bytes_consumed += consumed
         return items, bytes_consumed
 
+    def decode_nested_message(self, data: bytes, offset: int) -> Tuple[Dict[str, Any], int]:
+        """
+        Decode a length-prefixed message embedded as a list element.
+
+        Args:
+            data (bytes): The binary data containing the message.
+            offset (int): The starting offset of its length prefix.
+
+        Returns:
+            tuple: A tuple containing the decoded message and the number of bytes consumed.
+        """
+        if len(data) < offset + 4:
+            raise ValueError("Data too short to contain message length.")
+        length = struct.unpack_from("!I", data, offset)[0]
+        offset += 4
+        if len(data) < offset + length:
+            raise ValueError("Data too short to contain the expected message.")
+        return self.decode_message(data[offset : offset + length]), 4 + length
+
     def decode_object(
         self, data: bytes, offset: int, fields_spec: Dict[str, Any]
     ) -> Tuple[Dict[str, Any], int]:
@@ -460,3 +540,310 @@ class Decoder:
             offset += consumed
             total_consumed += consumed
         return obj, total_consumed
+
+    def decode_view(self, data: Union[bytes, bytearray, memoryview]) -> "MessageView":
+        """
+        Decode a message lazily: fields are decoded on first access, straight
+        from a memoryview over data, and never-read fields cost nothing but a
+        skip over their bytes. The buffer must not change while the view is
+        in use.
+
+        Args:
+            data (Union[bytes, bytearray, memoryview]): The encoded message.
+
+        Returns:
+            MessageView: A read-only mapping with the same contents as the
+            dict decode_message returns.
+
+        Raises:
+            ValueError: If the action is unknown or the data is too short for
+                the fields, which is checked up front.
+        """
+        view = memoryview(data)
+        if len(view) < 1:
+            raise ValueError("Data too short to contain action ID.")
+        layout = self.layouts.get(view[0])
+        if layout is None:
+            raise ValueError(f"Unknown action ID: {view[0]}")
+        message = MessageView(self, view, layout)
+        message.validate()
+        return message
+
+    def decode_field(
+        self, data: memoryview, offset: int, field_type: str, spec: Dict[str, Any]
+    ) -> Any:
+        """
+        Decode one value for a view. Lists of objects or messages come back
+        as a ListView and nested messages as a MessageView; everything else
+        is decoded as decode_message would.
+
+        Args:
+            data (memoryview): The encoded message.
+            offset (int): Where the value starts.
+            field_type (str): Its type, or the element type of a list.
+            spec (Dict[str, Any]): Its schema entry, or the list's 'items'.
+
+        Returns:
+            Any: The value.
+        """
+        if field_type == "string":
+            return self.decode_string(data, offset)[0]
+        if field_type == "int":
+            return self.decode_int(data, offset)[0]
+        if field_type == "list":
+            element_type = spec["element_type"]
+            if element_type in ("object", "message"):
+                return ListView(self, data, offset, element_type, spec.get("items") or {})
+            if element_type == "int":
+                # All elements in one unpack instead of one call each
+                length = struct.unpack_from("!H", data, offset)[0]
+                if len(data) < offset + 2 + 4 * length:
+                    raise ValueError("Data too short to contain the expected list.")
+                return list(struct.unpack_from(f"!{length}i", data, offset + 2))
+            return self.decode_list(data, offset, element_type, spec.get("items"))[0]
+        if field_type == "object":
+            return self.decode_object(data, offset, spec["fields"])[0]
+        if field_type == "message":
+            length = struct.unpack_from("!I", data, offset)[0]
+            return self.decode_view(data[offset + 4 : offset + 4 + length])
+        raise NotImplementedError(f"Unsupported field type: {field_type}")
+
+    def skip_field(
+        self, data: memoryview, offset: int, field_type: str, spec: Dict[str, Any]
+    ) -> int:
+        """
+        Find where a value ends without decoding it.
+
+        Args:
+            data (memoryview): The encoded message.
+            offset (int): Where the value starts.
+            field_type (str): Its type, or the element type of a list.
+            spec (Dict[str, Any]): Its schema entry, or the list's 'items'.
+
+        Returns:
+            int: The offset just past the value.
+        """
+        size = FIXED_SIZES.get(field_type)
+        if size is not None:
+            end = offset + size
+        elif field_type == "string":
+            end = offset + 2 + struct.unpack_from("!H", data, offset)[0]
+        elif field_type == "message":
+            end = offset + 4 + struct.unpack_from("!I", data, offset)[0]
+        elif field_type == "object":
+            end = offset
+            for field_spec in spec["fields"].values():
+                end = self.skip_field(data, end, field_spec["type"], field_spec)
+        elif field_type == "list":
+            length = struct.unpack_from("!H", data, offset)[0]
+            element_type = spec["element_type"]
+            size = FIXED_SIZES.get(element_type)
+            if size is not None:
+                end = offset + 2 + size * length
+            else:
+                end = offset + 2
+                items = spec.get("items") or {}
+                for _ in range(length):
+                    end = self.skip_field(data, end, element_type, items)
+        else:
+            raise NotImplementedError(f"Unsupported field type: {field_type}")
+        if end > len(data):
+            raise ValueError(f"Data too short to contain a {field_type}.")
+        return end
+
+
+class MessageLayout:
+    """
+    A message schema compiled for MessageView: its fields in wire order, and
+    the offsets of those that can be found without reading the message,
+    i.e. that follow only fixed-size, non-optional fields.
+    """
+
+    __slots__ = ("action", "fields", "index", "offsets")
+
+    def __init__(self, action: str, fields_spec: Dict[str, Any]) -> None:
+        self.action = action
+        self.fields: List[Tuple[str, Dict[str, Any]]] = list(fields_spec.items())
+        self.index: Dict[str, int] = {name: i for i, (name, _) in enumerate(self.fields)}
+        # offsets[i] is where field i starts, its presence byte included;
+        # offsets[len(fields)] is where the fields end and the req_id starts
+        self.offsets: List[int] = []
+        offset = 1  # After the action ID
+        for _, spec in self.fields:
+            self.offsets.append(offset)
+            size = None if spec.get("optional") else FIXED_SIZES.get(spec["type"])
+            if size is None:
+                break
+            offset += size
+        else:
+            self.offsets.append(offset)
+
+
+# Marks an optional field that was not sent
+_ABSENT = object()
+
+
+class MessageView(Mapping):
+    """
+    A decoded message that decodes each field on first access, see
+    Decoder.decode_view. Reads like the dict from decode_message.
+    """
+
+    __slots__ = ("_decoder", "_data", "_layout", "_offsets", "_values")
+
+    def __init__(self, decoder: Decoder, data: memoryview, layout: MessageLayout) -> None:
+        self._decoder = decoder
+        self._data = data
+        self._layout = layout
+        # Field offsets known so far, extended by skipping fields in order
+        self._offsets = list(layout.offsets)
+        self._values: Dict[str, Any] = {"action": layout.action}
+
+    def _locate(self, index: int) -> int:
+        """
+        Returns where field index starts; len(fields) gives the end.
+        """
+        offsets = self._offsets
+        while len(offsets) <= index:
+            offset = offsets[-1]
+            _, spec = self._layout.fields[len(offsets) - 1]
+            if spec.get("optional"):
+                if offset >= len(self._data):
+                    raise ValueError("Data too short for an optional field.")
+                offset += 1
+                if self._data[offset - 1]:
+                    offset = self._decoder.skip_field(self._data, offset, spec["type"], spec)
+            else:
+                offset = self._decoder.skip_field(self._data, offset, spec["type"], spec)
+            offsets.append(offset)
+        return offsets[index]
+
+    def validate(self) -> None:
+        """
+        Checks that the data holds every field, that its strings are valid
+        UTF-8 and that nested messages are valid in turn. Strings inside
+        lists and objects are only checked on access, which raises
+        MessageDecodeError if they are malformed.
+        """
+        self._locate(len(self._layout.fields))
+        for name, spec in self._layout.fields:
+            if spec["type"] in ("string", "message"):
+                self.get(name)  # Decoded once, and kept for the handler
+            elif spec["type"] == "list" and spec["element_type"] == "message":
+                for _ in self.get(name, ()):
+                    pass
+
+    def _decode(self, name: str) -> Any:
+        if name == REQ_ID_FIELD:
+            end = self._locate(len(self._layout.fields))
+            if len(self._data) >= end + 4:
+                return struct.unpack_from("!I", self._data, end)[0]
+            return _ABSENT
+        index = self._layout.index.get(name)
+        if index is None:
+            return _ABSENT
+        _, spec = self._layout.fields[index]
+        offset = self._locate(index)
+        if spec.get("optional"):
+            if not self._data[offset]:
+                return _ABSENT
+            offset += 1
+        return self._decoder.decode_field(self._data, offset, spec["type"], spec)
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        try:
+            value = self._decode(name)
+        except MessageDecodeError:
+            raise
+        except (ValueError, struct.error) as e:
+            raise MessageDecodeError(f"Malformed field '{name}': {e}") from e
+        if value is _ABSENT:
+            raise KeyError(name)
+        self._values[name] = value
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        yield "action"
+        for name, spec in self._layout.fields:
+            if not spec.get("optional") or name in self:
+                yield name
+        if REQ_ID_FIELD in self:
+            yield REQ_ID_FIELD
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class ListView(Sequence):
+    """
+    A list of objects or messages whose elements are decoded on access, so
+    a long list can be iterated, or indexed, without building every element.
+    """
+
+    __slots__ = ("_decoder", "_data", "_element_type", "_items_spec", "_offsets", "_length")
+
+    def __init__(
+        self,
+        decoder: Decoder,
+        data: memoryview,
+        offset: int,
+        element_type: str,
+        items_spec: Dict[str, Any],
+    ) -> None:
+        self._decoder = decoder
+        self._data = data
+        self._element_type = element_type
+        self._items_spec = items_spec
+        self._length = struct.unpack_from("!H", data, offset)[0]
+        # Element offsets known so far, extended by skipping elements in order
+        self._offsets = [offset + 2]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("list index out of range")
+        try:
+            return self._decode(index)
+        except MessageDecodeError:
+            raise
+        except (ValueError, struct.error) as e:
+            raise MessageDecodeError(f"Malformed list element {index}: {e}") from e
+
+    def _decode(self, index: int) -> Any:
+        offsets = self._offsets
+        while len(offsets) <= index:
+            offsets.append(
+                self._decoder.skip_field(
+                    self._data, offsets[-1], self._element_type, self._items_spec
+                )
+            )
+        if self._element_type == "object":
+            if not self._items_spec:
+                raise ValueError("Missing 'items' specification for object in list.")
+            return self._decoder.decode_object(
+                self._data, offsets[index], self._items_spec["fields"]
+            )[0]
+        return self._decoder.decode_field(
+            self._data, offsets[index], self._element_type, self._items_spec
+        )
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (list, ListView)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
@@ -1,31 +1,98 @@
 # database.py
 import sqlite3
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
-from typing import List, Tuple, Optional, Union, Dict
+from typing import Any, Callable, List, Tuple, Optional, Union, Dict
+import heapq
+import itertools
+import archive
+from cache import message_cache, user_directory
+from shards import Shard, ShardRouter
+from storage import Storage
 
 DB_FILE = "chat_app.db"
 
+# Direct messages, their conversations and read cursors are spread over this
+# many SQLite files by a hash of the conversation's participants. Users and
+# rooms stay in DB_FILE, which is also shard 0. Fixed for the life of a data set.
+MESSAGE_SHARDS = int(os.environ.get("MESSAGE_SHARDS", "1"))
+
+_router: Optional[ShardRouter] = None
+
+# How read state of direct messages is tracked:
+#   "status" - a read_status flag on every message row (default)
+#   "cursor" - a monotonic last_read_id per (user, peer) in read_cursors, so
+#              marking a conversation read is a single-row update
+READ_TRACKING = os.environ.get("READ_TRACKING", "status")
+
+
+def _shards() -> ShardRouter:
+    """
+    Returns the shard router, creating it on first use.
+
+    Returns:
+        ShardRouter: The router of the message shards.
+    """
+    global _router
+    if _router is None:
+        _router = ShardRouter(DB_FILE, MESSAGE_SHARDS)
+    return _router
+
+
+def _main_shard() -> Shard:
+    """
+    Returns the shard of the main database file, which also holds the users
+    and rooms, so their writes go through its writer thread too.
+
+    Returns:
+        Shard: Shard 0.
+    """
+    return _shards().shards[0]
+
 
 def initialize_database():
     """
     Initializes the database by creating necessary tables if they don't exist.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Create users table if it doesn't exist
-    # add number of unread messages to deliver
-    cursor.execute(
+    global _router
+    if _router is not None:
+        # Reopen the files in case they were replaced
+        _router.close()
+        _router = None
+
+    def create_user_tables(cursor: sqlite3.Cursor) -> None:
+        # Free pages are returned by compact_database; only takes effect on a new file
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Create users table if it doesn't exist
+        # add number of unread messages to deliver
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL,
+                n_unread_messages INTEGER NOT NULL DEFAULT 0
+            )
         """
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password_hash TEXT NOT NULL,
-            n_unread_messages INTEGER NOT NULL DEFAULT 0
         )
+
+    _main_shard().write(create_user_tables)
+    for shard in _shards().shards:
+        shard.write(_create_message_tables)
+    _main_shard().write(_create_room_tables)
+
+
+def _create_message_tables(cursor: sqlite3.Cursor) -> None:
     """
-    )
+    Creates the direct message tables of one shard and migrates older layouts.
 
+    Args:
+        cursor (sqlite3.Cursor): A cursor on the shard's writer connection.
+
+    Returns:
+        None
+    """
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
     # Create messages table if it doesn't exist
     cursor.execute(
         """
@@ -37,299 +104,1961 @@ def initialize_database():
             timestamp TEXT NOT NULL,
             read_status INTEGER NOT NULL DEFAULT 0,
             delivered INTEGER NOT NULL DEFAULT 0,
+            conversation_id INTEGER,
             FOREIGN KEY (sender) REFERENCES users(username),
-            FOREIGN KEY (receiver) REFERENCES users(username)
+            FOREIGN KEY (receiver) REFERENCES users(username),
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+        )
+    """
+    )
+
+    # Read cursors: messages from peer to username with id <= last_read_id
+    # are read. Used when READ_TRACKING is "cursor".
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS read_cursors (
+            username TEXT NOT NULL,
+            peer TEXT NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, peer)
+        )
+    """
+    )
+    # Lets unread lookups range-scan one conversation past its cursor
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_sender "
+        "ON messages (receiver, sender, id)"
+    )
+    # Holds only messages awaiting an ack, so login replay and acks stay
+    # cheap however much delivered history a user has
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_undelivered "
+        "ON messages (receiver, id) WHERE delivered = 0"
+    )
+    if READ_TRACKING == "cursor":
+        cursor.execute("SELECT 1 FROM read_cursors LIMIT 1")
+        if cursor.fetchone() is None:
+            # First start in cursor mode: seed cursors from read_status
+            cursor.execute(
+                """
+                INSERT INTO read_cursors (username, peer, last_read_id)
+                SELECT receiver, sender,
+                       COALESCE(MAX(CASE WHEN read_status = 1 THEN id END), 0)
+                FROM messages
+                GROUP BY receiver, sender
+            """
+            )
+
+    # One row per pair of users (user_a < user_b) with a maintained summary
+    # of the thread: its last message and each side's unread count, and the
+    # newest of its messages moved to the archive (0 if none)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_a TEXT NOT NULL,
+            user_b TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL DEFAULT 0,
+            last_sender TEXT NOT NULL DEFAULT '',
+            last_content TEXT NOT NULL DEFAULT '',
+            last_timestamp TEXT NOT NULL DEFAULT '',
+            unread_a INTEGER NOT NULL DEFAULT 0,
+            unread_b INTEGER NOT NULL DEFAULT 0,
+            archived_max_id INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (user_a, user_b)
+        )
+    """
+    )
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(conversations)")]
+    if "archived_max_id" not in columns:
+        cursor.execute(
+            "ALTER TABLE conversations ADD COLUMN archived_max_id INTEGER NOT NULL DEFAULT 0"
+        )
+        if archive.list_partitions():
+            # Archived before this was tracked: any conversation may have some
+            cursor.execute("UPDATE conversations SET archived_max_id = last_message_id")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_a "
+        "ON conversations (user_a, last_message_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_b "
+        "ON conversations (user_b, last_message_id)"
+    )
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(messages)")]
+    if "conversation_id" not in columns:
+        # Databases created before conversations existed
+        cursor.execute("ALTER TABLE messages ADD COLUMN conversation_id INTEGER")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation "
+        "ON messages (conversation_id, id)"
+    )
+    cursor.execute("SELECT 1 FROM messages WHERE conversation_id IS NULL LIMIT 1")
+    if cursor.fetchone() is not None:
+        _backfill_conversations(cursor)
+
+    # Full-text index over message content and its participants. It stores
+    # no copy of the text (content='messages_fts_source') and is kept in
+    # sync by triggers, so every path that inserts or deletes messages is
+    # covered.
+    fts_columns = [row[1] for row in cursor.execute("PRAGMA table_info(messages_fts)")]
+    if fts_columns and "participants" not in fts_columns:
+        # Indexed before searches were restricted inside the index
+        for statement in _FTS_DROP:
+            cursor.execute(statement)
+        fts_columns = []
+    for statement in _FTS_SCHEMA:
+        cursor.execute(statement)
+    if not fts_columns:
+        # Index messages stored before the index existed
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        # Participants only restrict matches; they must not affect ranking
+        cursor.execute(
+            "INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"
         )
+
+
+# Sender and receiver are indexed as one token each, their hex-encoded
+# names, so a search can be restricted to a user's messages by the MATCH
+# itself instead of filtering every match of the words afterwards
+_FTS_SCHEMA = (
+    """
+    CREATE VIEW IF NOT EXISTS messages_fts_source AS
+    SELECT id, content, hex(sender) || ' ' || hex(receiver) AS participants
+    FROM messages
+    """,
     """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, participants, content='messages_fts_source', content_rowid='id'
     )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content, participants)
+        VALUES (new.id, new.content, hex(new.sender) || ' ' || hex(new.receiver));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, hex(old.sender) || ' ' || hex(old.receiver));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content, participants)
+        VALUES ('delete', old.id, old.content, hex(old.sender) || ' ' || hex(old.receiver));
+        INSERT INTO messages_fts (rowid, content, participants)
+        VALUES (new.id, new.content, hex(new.sender) || ' ' || hex(new.receiver));
+    END
+    """,
+)
 
-    conn.commit()
-    conn.close()
+_FTS_DROP = (
+    "DROP TRIGGER IF EXISTS messages_fts_insert",
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    "DROP TRIGGER IF EXISTS messages_fts_update",
+    "DROP TABLE IF EXISTS messages_fts",
+)
 
 
-def insert_message(sender: str, content: str, receiver: str) -> int:
+def _create_room_tables(cursor: sqlite3.Cursor) -> None:
     """
-    Inserts a new message into the messages table.
+    Creates the room tables in the main database.
 
     Args:
-        sender (str): The username of the user sending the message.
-        content (str): The content of the message.
-        receiver (str): The username of the user receiving the message.
+        cursor (sqlite3.Cursor): A cursor on the main database.
 
     Returns:
-        int: The ID of the newly inserted message.
+        None
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    timestamp = datetime.utcnow().isoformat() + "Z"  # UTC time in ISO format
+    # Rooms are group chats or broadcast channels. Room messages are stored
+    # once per message, and each member keeps a read cursor instead of a row
+    # per recipient.
     cursor.execute(
         """
-        INSERT INTO messages (sender, content, receiver, timestamp, read_status, delivered)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """,
-        (sender, content, receiver, timestamp, 0, 0),
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            owner TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'group',
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (owner) REFERENCES users(username)
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS room_members (
+            room_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (room_id, username),
+            FOREIGN KEY (room_id) REFERENCES rooms(id),
+            FOREIGN KEY (username) REFERENCES users(username)
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_room_members_username "
+        "ON room_members (username)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS room_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL,
+            sender TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY (room_id) REFERENCES rooms(id),
+            FOREIGN KEY (sender) REFERENCES users(username)
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_room_messages_room "
+        "ON room_messages (room_id, id)"
     )
-
-    # Get the last inserted rowid
-    cursor.execute("SELECT last_insert_rowid()")
-    message_id = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return message_id
 
 
-def get_recent_messages(
-    user_id: str, limit: int = 50
-) -> List[Tuple[str, str, str, str, int]]:
+def _conversation_pair(user1: str, user2: str) -> Tuple[str, str]:
     """
-    Retrieves the most recent messages from the messages table.
+    Normalizes a pair of participants to the (user_a, user_b) key order.
 
     Args:
-        user_id (str): The user ID of the user whose messages to retrieve
-        limit (int): The maximum number of messages to retrieve. Defaults to 50.
+        user1 (str): One participant.
+        user2 (str): The other participant.
 
     Returns:
-        List[Tuple[str, str, str, str, int]]: A list of tuples, each containing the sender, content, receiver, timestamp, and id of a message, sorted from oldest to newest.
+        Tuple[str, str]: The participants, lexicographically smaller first.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    query = """
-        SELECT sender, content, receiver, timestamp, id
-        FROM messages
-        WHERE (receiver = ? OR sender = ?)
-        AND read_status = 1
-        ORDER BY id DESC
-        LIMIT ?
+    return (user1, user2) if user1 <= user2 else (user2, user1)
+
+
+def _get_or_create_conversation(cursor: sqlite3.Cursor, user1: str, user2: str) -> int:
     """
-    logging.info(f"recent messages query: {query}")
-    logging.info(f"recent messages user_id: {user_id}")
-    logging.info(f"recent messages limit: {limit}")
+    Looks up the conversation between two users, creating it if needed.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        user1 (str): One participant.
+        user2 (str): The other participant.
+
+    Returns:
+        int: The conversation ID.
+    """
+    user_a, user_b = _conversation_pair(user1, user2)
+    cursor.execute(
+        "INSERT OR IGNORE INTO conversations (user_a, user_b) VALUES (?, ?)",
+        (user_a, user_b),
+    )
     cursor.execute(
-        query,
-        (
-            user_id,
-            user_id,
-            limit,
-        ),
+        "SELECT id FROM conversations WHERE user_a = ? AND user_b = ?",
+        (user_a, user_b),
     )
+    return cursor.fetchone()[0]
 
-    rows = cursor.fetchall()
-    logging.info(f"recent messages rows: {rows}")
-    conn.close()
 
-    # Reverse to have oldest messages first
-    return rows[::-1]
+def _count_unread(
+    cursor: sqlite3.Cursor, conversation_id: int, receiver: str, sender: str
+) -> int:
+    """
+    Counts a conversation's unread messages for one side from scratch.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        conversation_id (int): The conversation.
+        receiver (str): The participant whose unread count to compute.
+        sender (str): The other participant.
+
+    Returns:
+        int: The number of unread messages from sender to receiver.
+    """
+    if READ_TRACKING == "cursor":
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM messages
+            WHERE conversation_id = ? AND receiver = ? AND id > COALESCE(
+                (SELECT last_read_id FROM read_cursors WHERE username = ? AND peer = ?), 0
+            )
+        """,
+            (conversation_id, receiver, receiver, sender),
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM messages
+            WHERE conversation_id = ? AND receiver = ? AND read_status = 0
+        """,
+            (conversation_id, receiver),
+        )
+    return cursor.fetchone()[0]
 
 
-def get_undelivered_messages(user_id: str) -> List[Tuple[str, str, str, int]]:
+def _refresh_conversation(cursor: sqlite3.Cursor, conversation_id: int) -> None:
     """
-    Retrieves all undelivered messages for a user.
+    Rebuilds a conversation's summary row from its messages.
 
     Args:
-        user_id (str): The user ID of the user whose undelivered messages to retrieve.
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        conversation_id (int): The conversation to rebuild.
 
     Returns:
-        List[Tuple[str, str, str, int]]: A list of tuples, each containing the sender, content, timestamp, and id of an undelivered message, sorted from oldest to newest.
+        None
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
+    cursor.execute(
+        "SELECT user_a, user_b FROM conversations WHERE id = ?", (conversation_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return
+    user_a, user_b = row
     cursor.execute(
         """
-        SELECT sender, content, timestamp, id
-        FROM messages
-        WHERE receiver = ? AND delivered = 0
-        ORDER BY id ASC
+        SELECT id, sender, content, timestamp FROM messages
+        WHERE conversation_id = ?
+        ORDER BY id DESC
+        LIMIT 1
     """,
-        (user_id,),
+        (conversation_id,),
+    )
+    last = cursor.fetchone() or (0, "", "", "")
+    unread_a = _count_unread(cursor, conversation_id, user_a, user_b)
+    unread_b = _count_unread(cursor, conversation_id, user_b, user_a)
+    cursor.execute(
+        """
+        UPDATE conversations
+        SET last_message_id = ?, last_sender = ?, last_content = ?,
+            last_timestamp = ?, unread_a = ?, unread_b = ?
+        WHERE id = ?
+    """,
+        (*last, unread_a, unread_b, conversation_id),
     )
-
-    messages = cursor.fetchall()
-    conn.close()
-
-    return messages
 
 
-def mark_messages_delivered(user_id: str) -> None:
+def _adjust_unread(
+    cursor: sqlite3.Cursor, conversation_id: int, receiver: str, delta: int
+) -> None:
     """
-    Marks all undelivered messages for a user as delivered.
+    Adds delta to the receiver's side of a conversation's unread count.
 
     Args:
-        user_id (str): The user ID of the user whose undelivered messages to mark as delivered.
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        conversation_id (int): The conversation.
+        receiver (str): The participant whose unread count changes.
+        delta (int): The change in unread messages.
 
     Returns:
         None
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
     cursor.execute(
         """
-        UPDATE messages
-        SET delivered = 1
-        WHERE receiver = ? AND delivered = 0
+        UPDATE conversations
+        SET unread_a = MAX(unread_a + CASE WHEN user_a = ? THEN ? ELSE 0 END, 0),
+            unread_b = MAX(unread_b + CASE WHEN user_a != ? THEN ? ELSE 0 END, 0)
+        WHERE id = ?
     """,
-        (user_id,),
+        (receiver, delta, receiver, delta, conversation_id),
     )
 
-    conn.commit()
-    conn.close()
-
 
-def get_unread_messages(
-    user_id: str, limit: int = 20
-) -> List[Tuple[int, str, str, str]]:
+def _refresh_unread(cursor: sqlite3.Cursor, receiver: str, sender: str) -> None:
     """
-    Retrieves the first 'limit' unread messages for a user.
+    Recounts the receiver's unread messages in their conversation with sender.
+    In cursor mode this is a range scan past the cursor on (conversation_id, id).
 
     Args:
-        user_id (str): The user ID of the user whose unread messages to retrieve.
-        limit (int): The maximum number of messages to retrieve. Defaults to 20.
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        receiver (str): The participant whose unread count to refresh.
+        sender (str): The other participant.
 
     Returns:
-        List[Tuple[int, str, str, str]]: A list of tuples, each containing the ID, sender, content, and timestamp of an unread message, sorted from oldest to newest.
+        None
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    user_a, user_b = _conversation_pair(receiver, sender)
+    cursor.execute(
+        "SELECT id FROM conversations WHERE user_a = ? AND user_b = ?",
+        (user_a, user_b),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return
+    unread = _count_unread(cursor, row[0], receiver, sender)
+    column = "unread_a" if receiver == user_a else "unread_b"
+    cursor.execute(f"UPDATE conversations SET {column} = ? WHERE id = ?", (unread, row[0]))
+
+
+def _backfill_conversations(cursor: sqlite3.Cursor) -> None:
+    """
+    Assigns conversations to messages stored before conversations existed
+    and builds their summary rows.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
 
+    Returns:
+        None
+    """
     cursor.execute(
         """
-        SELECT id, sender, content, timestamp
+        INSERT OR IGNORE INTO conversations (user_a, user_b)
+        SELECT DISTINCT MIN(sender, receiver), MAX(sender, receiver)
         FROM messages
-        WHERE receiver = ? AND read_status = 0
-        ORDER BY id ASC
-        LIMIT ?
-    """,
-        (user_id, limit),
+        WHERE conversation_id IS NULL
+    """
     )
-
-    messages: List[Tuple[int, str, str, str]] = cursor.fetchall()
-    conn.close()
-
-    return messages
+    cursor.execute(
+        """
+        UPDATE messages SET conversation_id = (
+            SELECT id FROM conversations
+            WHERE user_a = MIN(messages.sender, messages.receiver)
+              AND user_b = MAX(messages.sender, messages.receiver)
+        )
+        WHERE conversation_id IS NULL
+    """
+    )
+    cursor.execute("SELECT id FROM conversations")
+    for (conversation_id,) in cursor.fetchall():
+        _refresh_conversation(cursor, conversation_id)
 
 
-def mark_messages_as_read(message_ids: List[int]) -> None:
+def insert_message(sender: str, content: str, receiver: str) -> int:
     """
-    Marks specified messages as read.
+    Inserts a new message into the messages table of its conversation's shard.
 
     Args:
-        message_ids (List[int]): A list of message IDs to mark as read.
+        sender (str): The username of the user sending the message.
+        content (str): The content of the message.
+        receiver (str): The username of the user receiving the message.
 
     Returns:
-        None
+        int: The ID of the newly inserted message.
     """
-    if not message_ids:
-        return  # No messages to mark
+    router = _shards()
+    shard = router.shard_for_pair(sender, receiver)
+    timestamp = datetime.utcnow().isoformat() + "Z"  # UTC time in ISO format
+
+    def insert(cursor: sqlite3.Cursor) -> int:
+        conversation_id = _get_or_create_conversation(cursor, sender, receiver)
+        # Allocated on the writer thread so IDs commit in order within the shard
+        cursor.execute(
+            """
+            INSERT INTO messages (id, sender, content, receiver, timestamp, read_status, delivered, conversation_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                router.next_message_id(shard),
+                sender,
+                content,
+                receiver,
+                timestamp,
+                0,
+                0,
+                conversation_id,
+            ),
+        )
+        message_id = cursor.lastrowid
+        cursor.execute(
+            """
+            UPDATE conversations
+            SET last_message_id = ?, last_sender = ?, last_content = ?, last_timestamp = ?,
+                unread_a = unread_a + (user_a = ?), unread_b = unread_b + (user_a != ?)
+            WHERE id = ?
+        """,
+            (message_id, sender, content, timestamp, receiver, receiver, conversation_id),
+        )
+        if READ_TRACKING == "cursor":
+            # Every conversation needs a cursor row for unread range scans
+            cursor.execute(
+                "INSERT OR IGNORE INTO read_cursors (username, peer) VALUES (?, ?)",
+                (receiver, sender),
+            )
+        return message_id
+
+    message_id = shard.write(insert)
+    message_cache.on_insert((message_id, sender, receiver, content, timestamp))
+    return message_id
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
 
-    # Use parameter substitution to prevent SQL injection
-    placeholders = ",".join(["?"] * len(message_ids))
-    query = f"UPDATE messages SET read_status = 1 WHERE id IN ({placeholders})"
-    logging.info(f"mark_messages_as_read query: {query}")
-    logging.info(f"mark_messages_as_read query: {message_ids}")
-    cursor.execute(query, message_ids)
+def _merge(
+    results: List[list], key: Callable[[tuple], Any], limit: int, reverse: bool = False
+) -> list:
+    """
+    Merges per-shard query results that are each sorted by key.
+
+    Args:
+        results (List[list]): One sorted list of rows per shard.
+        key (Callable[[tuple], Any]): The sort key of a row.
+        limit (int): The maximum number of rows to return.
+        reverse (bool, optional): True if the lists are sorted descending.
 
-    conn.commit()
-    conn.close()
+    Returns:
+        list: The first 'limit' rows of the merged order.
+    """
+    if len(results) == 1:
+        return results[0][:limit]
+    return list(itertools.islice(heapq.merge(*results, key=key, reverse=reverse), limit))
 
 
-#  get user information
-def get_user_info(username: str) -> Optional[Tuple[str, int]]:
+def _cache_load_limit(limit: int) -> int:
     """
-    Retrieves user information, specifically the username and the number of unread messages.
+    Picks how many rows to load on a cache miss: a full cache tail when the
+    request fits in one, so later requests can be served from memory.
 
     Args:
-        username (str): The username to retrieve information for.
+        limit (int): The number of rows requested.
 
     Returns:
-        Optional[Tuple[str, int]]: A tuple of the username and the number of unread messages, or None if the user does not exist.
+        int: The number of rows to load.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    if message_cache.enabled and limit <= message_cache.tail_size:
+        return message_cache.tail_size
+    return limit
 
-    cursor.execute(
-        "SELECT username, n_unread_messages FROM users WHERE username = ?", (username,)
-    )
-    user_info = cursor.fetchone()
 
-    conn.close()
+def _recent_query() -> str:
+    """
+    Returns the query for a user's newest read messages, newest first, as
+    (sender, content, receiver, timestamp, id). Parameters: user, user, limit.
+    """
+    if READ_TRACKING == "cursor":
+        return """
+            SELECT m.sender, m.content, m.receiver, m.timestamp, m.id
+            FROM messages m
+            JOIN read_cursors c ON c.username = m.receiver AND c.peer = m.sender
+            WHERE (m.receiver = ? OR m.sender = ?)
+            AND m.id <= c.last_read_id
+            ORDER BY m.id DESC
+            LIMIT ?
+        """
+    return """
+            SELECT sender, content, receiver, timestamp, id
+            FROM messages
+            WHERE (receiver = ? OR sender = ?)
+            AND read_status = 1
+            ORDER BY id DESC
+            LIMIT ?
+        """
+
 
-    return user_info
+def _unread_query() -> str:
+    """
+    Returns the query for a user's oldest unread messages, oldest first, as
+    (id, sender, content, timestamp). Parameters: user, limit.
+    """
+    if READ_TRACKING == "cursor":
+        # One range scan of (receiver, sender, id) past each cursor;
+        # CROSS JOIN pins read_cursors as the outer loop
+        return """
+            SELECT m.id, m.sender, m.content, m.timestamp
+            FROM read_cursors c
+            CROSS JOIN messages m
+              ON m.receiver = c.username AND m.sender = c.peer
+             AND m.id > c.last_read_id
+            WHERE c.username = ?
+            ORDER BY m.id ASC
+            LIMIT ?
+        """
+    return """
+            SELECT id, sender, content, timestamp
+            FROM messages
+            WHERE receiver = ? AND read_status = 0
+            ORDER BY id ASC
+            LIMIT ?
+        """
 
 
-def set_n_unread_messages(username: str, n_unread_messages: int) -> bool:
+def get_recent_messages(
+    user_id: str, limit: int = 50
+) -> List[Tuple[str, str, str, str, int]]:
     """
-    Updates the number of unread messages for a user.
+    Retrieves the most recent messages from the messages table.
 
     Args:
-        username (str): The username to update.
-        n_unread_messages (int): The new number of unread messages for the user.
+        user_id (str): The user ID of the user whose messages to retrieve
+        limit (int): The maximum number of messages to retrieve. Defaults to 50.
 
     Returns:
-        bool: True if the update was successful, False otherwise.
+        List[Tuple[str, str, str, str, int]]: A list of tuples, each containing the sender, content, receiver, timestamp, and id of a message, sorted from oldest to newest.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    cached = message_cache.get_recent(user_id, limit)
+    if cached is not None:
+        return [
+            (sender, content, receiver, timestamp, id)
+            for id, sender, receiver, content, timestamp in cached
+        ]
+    # Load a full cache tail so the next request for this user is a hit
+    version = message_cache.version(user_id)
+    load_limit = _cache_load_limit(limit)
+
+    query = _recent_query()
+    logging.info(f"recent messages query: {query}")
+    logging.info(f"recent messages user_id: {user_id}")
+    logging.info(f"recent messages limit: {limit}")
 
-    cursor.execute(
-        "UPDATE users SET n_unread_messages = ? WHERE username = ?",
-        (n_unread_messages, username),
-    )
+    def recent(shard: Shard) -> list:
+        return shard.read(
+            lambda cursor: cursor.execute(query, (user_id, user_id, load_limit)).fetchall()
+        )
 
-    conn.commit()
-    conn.close()
-    return True
+    # Each shard returns its newest rows; keep the newest across shards
+    rows = _merge(_shards().map(recent), lambda row: row[4], load_limit, reverse=True)
+    logging.info(f"recent messages rows: {rows}")
 
+    # Reverse to have oldest messages first
+    rows = rows[::-1]
+    message_cache.fill_recent(
+        user_id,
+        version,
+        [
+            (id, sender, receiver, content, timestamp)
+            for sender, content, receiver, timestamp, id in rows
+        ],
+        load_limit,
+    )
+    return rows[max(len(rows) - limit, 0) :] if limit else []
 
-def delete_message(message_id: int) -> bool:
+
+def get_undelivered_messages(user_id: str) -> List[Tuple[str, str, str, int]]:
     """
-    Deletes a message from the database.
+    Retrieves all undelivered messages for a user.
 
     Args:
-        message_id (int): The ID of the message to delete.
+        user_id (str): The user ID of the user whose undelivered messages to retrieve.
 
     Returns:
-        bool: True if the deletion was successful, False otherwise.
+        List[Tuple[str, str, str, int]]: A list of tuples, each containing the sender, content, timestamp, and id of an undelivered message, sorted from oldest to newest.
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
-        conn.commit()
-        return True
-    except Exception as e:
-        logging.error(f"Error deleting message {message_id}: {e}")
-        return False
-    finally:
-        conn.close()
 
+    def undelivered(shard: Shard) -> list:
+        return shard.read(
+            lambda cursor: cursor.execute(
+                """
+                SELECT sender, content, timestamp, id
+                FROM messages
+                WHERE receiver = ? AND delivered = 0
+                ORDER BY id ASC
+            """,
+                (user_id,),
+            ).fetchall()
+        )
 
-def get_all_users_except(username: str) -> List[str]:
+    results = _shards().map(undelivered)
+    return _merge(results, lambda row: row[3], sum(len(rows) for rows in results))
+
+
+def mark_messages_delivered(user_id: str, message_ids: Optional[List[int]] = None) -> int:
     """
-    Retrieves all usernames except the given username.
+    Marks undelivered messages for a user as delivered.
 
     Args:
-        username (str): The username to exclude.
+        user_id (str): The user ID of the receiver whose messages to mark as delivered.
+        message_ids (Optional[List[int]]): The acknowledged message IDs, or None
+            to mark every undelivered message. IDs of messages sent to other
+            users are ignored.
 
     Returns:
-        List[str]: A list of all usernames except the given username.
+        int: The number of messages that became delivered.
+    """
+    if message_ids is None:
+
+        def deliver_all(cursor: sqlite3.Cursor) -> int:
+            cursor.execute(
+                """
+                UPDATE messages
+                SET delivered = 1
+                WHERE receiver = ? AND delivered = 0
+            """,
+                (user_id,),
+            )
+            return cursor.rowcount
+
+        return sum(_shards().map(lambda shard: shard.write(deliver_all)))
+
+    router = _shards()
+    ids_by_shard: Dict[Shard, List[int]] = {}
+    for message_id in message_ids:
+        ids_by_shard.setdefault(router.shard_for_id(message_id), []).append(message_id)
+
+    def deliver(cursor: sqlite3.Cursor, ids: List[int]) -> int:
+        placeholders = ",".join(["?"] * len(ids))
+        cursor.execute(
+            f"""
+            UPDATE messages
+            SET delivered = 1
+            WHERE receiver = ? AND delivered = 0 AND id IN ({placeholders})
+        """,
+            (user_id, *ids),
+        )
+        return cursor.rowcount
+
+    return sum(
+        shard.write(lambda cursor, ids=ids: deliver(cursor, ids))
+        for shard, ids in ids_by_shard.items()
+    )
+
+
+def get_unread_messages(
+    user_id: str, limit: int = 20
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Retrieves the first 'limit' unread messages for a user.
+
+    Args:
+        user_id (str): The user ID of the user whose unread messages to retrieve.
+        limit (int): The maximum number of messages to retrieve. Defaults to 20.
+
+    Returns:
+        List[Tuple[int, str, str, str]]: A list of tuples, each containing the ID, sender, content, and timestamp of an unread message, sorted from oldest to newest.
+    """
+    cached = message_cache.get_unread(user_id, limit)
+    if cached is not None:
+        return [
+            (id, sender, content, timestamp)
+            for id, sender, _, content, timestamp in cached
+        ]
+    version = message_cache.version(user_id)
+    load_limit = _cache_load_limit(limit)
+
+    query = _unread_query()
+
+    def unread(shard: Shard) -> list:
+        return shard.read(
+            lambda cursor: cursor.execute(query, (user_id, load_limit)).fetchall()
+        )
+
+    # Each shard returns its oldest unread rows; keep the oldest across shards
+    messages: List[Tuple[int, str, str, str]] = _merge(
+        _shards().map(unread), lambda row: row[0], load_limit
+    )
+
+    message_cache.fill_unread(
+        user_id,
+        version,
+        [
+            (id, sender, user_id, content, timestamp)
+            for id, sender, content, timestamp in messages
+        ],
+        load_limit,
+    )
+    return messages[:limit]
+
+
+def get_login_bootstrap(
+    username: str, default_limit: int = 50
+) -> Tuple[List[Tuple[int, str, str, str]], List[Tuple[str, str, str, str, int]], List[str]]:
+    """
+    Loads everything a client shows right after login: the user's unread
+    and recent messages, as many of each as their n_unread_messages setting
+    (or default_limit), and the other users.
+
+    The setting and both message lists are read in one transaction on one
+    pooled connection per shard, instead of a connection per query, and
+    lists already in the message cache are not queried at all.
+
+    Args:
+        username (str): The user logging in.
+        default_limit (int): The limit for users without a setting. Defaults to 50.
+
+    Returns:
+        Tuple: The unread messages as returned by get_unread_messages, the recent
+            messages as returned by get_recent_messages, and every other username.
+    """
+    router = _shards()
+    version = message_cache.version(username)
+    # Rows to load per list, or None when the cache already holds it
+    loads: Dict[str, Optional[int]] = {}
+
+    def read(cursor: sqlite3.Cursor) -> tuple:
+        # SELECTs alone do not open a transaction; an explicit one gives every
+        # query on this shard a single snapshot
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN")
+        unread = recent = None
+        if loads["unread"] is not None:
+            unread = cursor.execute(_unread_query(), (username, loads["unread"])).fetchall()
+        if loads["recent"] is not None:
+            recent = cursor.execute(
+                _recent_query(), (username, username, loads["recent"])
+            ).fetchall()
+        return unread, recent
+
+    def read_first(cursor: sqlite3.Cursor) -> tuple:
+        # The users table lives on the first shard, next to its share of messages
+        cursor.execute("BEGIN")
+        row = cursor.execute(
+            "SELECT n_unread_messages FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        limit = (row[0] if row else 0) or default_limit
+        cached_unread = message_cache.get_unread(username, limit)
+        cached_recent = message_cache.get_recent(username, limit)
+        load = _cache_load_limit(limit)
+        loads["unread"] = None if cached_unread is not None else load
+        loads["recent"] = None if cached_recent is not None else load
+        return limit, cached_unread, cached_recent, read(cursor)
+
+    limit, cached_unread, cached_recent, first = router.shards[0].read(read_first)
+    results = [first]
+    if router.count > 1 and (loads["unread"] is not None or loads["recent"] is not None):
+        results += router.map(lambda shard: shard.read(read) if shard.index else None)[1:]
+
+    if cached_unread is not None:
+        unread = [
+            (id, sender, content, timestamp)
+            for id, sender, _, content, timestamp in cached_unread
+        ]
+    else:
+        unread = _merge([r[0] for r in results], lambda row: row[0], loads["unread"])
+        message_cache.fill_unread(
+            username,
+            version,
+            [
+                (id, sender, username, content, timestamp)
+                for id, sender, content, timestamp in unread
+            ],
+            loads["unread"],
+        )
+        unread = unread[:limit]
+
+    if cached_recent is not None:
+        recent = [
+            (sender, content, receiver, timestamp, id)
+            for id, sender, receiver, content, timestamp in cached_recent
+        ]
+    else:
+        recent = _merge(
+            [r[1] for r in results], lambda row: row[4], loads["recent"], reverse=True
+        )[::-1]
+        message_cache.fill_recent(
+            username,
+            version,
+            [
+                (id, sender, receiver, content, timestamp)
+                for sender, content, receiver, timestamp, id in recent
+            ],
+            loads["recent"],
+        )
+        recent = recent[max(len(recent) - limit, 0) :]
+
+    return unread, recent, get_all_users_except(username)
+
+
+def mark_messages_as_read(message_ids: List[int]) -> None:
+    """
+    Marks specified messages as read. In cursor mode the read cursor of each
+    affected conversation is advanced to the newest of the given IDs.
+
+    Args:
+        message_ids (List[int]): A list of message IDs to mark as read.
+
+    Returns:
+        None
+    """
+    if not message_ids:
+        return  # No messages to mark
+
+    router = _shards()
+    ids_by_shard: Dict[Shard, List[int]] = {}
+    for message_id in message_ids:
+        ids_by_shard.setdefault(router.shard_for_id(message_id), []).append(message_id)
+
+    for shard, ids in ids_by_shard.items():
+        read = shard.write(lambda cursor, ids=ids: _mark_read(cursor, ids))
+        for receiver, sender, read_ids, up_to_id in read:
+            message_cache.on_read(receiver, sender, message_ids=read_ids, up_to_id=up_to_id)
+
+
+def _mark_read(
+    cursor: sqlite3.Cursor, message_ids: List[int]
+) -> List[Tuple[str, str, Optional[List[int]], Optional[int]]]:
+    """
+    Marks messages of one shard as read.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor on the shard's writer connection.
+        message_ids (List[int]): The IDs to mark, all on this shard.
+
+    Returns:
+        List[Tuple[str, str, Optional[List[int]], Optional[int]]]: Per
+            (receiver, sender) pair, the IDs that became read or, in cursor
+            mode, the ID the read cursor advanced to.
+    """
+    # Use parameter substitution to prevent SQL injection
+    placeholders = ",".join(["?"] * len(message_ids))
+    if READ_TRACKING == "cursor":
+        # Advance one cursor per conversation to the newest ID given
+        cursor.execute(
+            f"""
+            SELECT receiver, sender, MAX(id)
+            FROM messages
+            WHERE id IN ({placeholders})
+            GROUP BY receiver, sender
+        """,
+            message_ids,
+        )
+        advanced = cursor.fetchall()
+        for receiver, sender, last_read_id in advanced:
+            _advance_read_cursor(cursor, receiver, sender, last_read_id)
+            _refresh_unread(cursor, receiver, sender)
+        return [
+            (receiver, sender, None, last_read_id)
+            for receiver, sender, last_read_id in advanced
+        ]
+
+    # Find rows that are about to flip so summaries and the cache can follow
+    cursor.execute(
+        f"""
+        SELECT id, sender, receiver, conversation_id
+        FROM messages
+        WHERE id IN ({placeholders}) AND read_status = 0
+    """,
+        message_ids,
+    )
+    newly_read = cursor.fetchall()
+    query = f"UPDATE messages SET read_status = 1 WHERE id IN ({placeholders})"
+    logging.info(f"mark_messages_as_read query: {query}")
+    logging.info(f"mark_messages_as_read query: {message_ids}")
+    cursor.execute(query, message_ids)
+
+    by_conversation: Dict[Tuple[int, str], int] = {}
+    by_pair: Dict[Tuple[str, str], List[int]] = {}
+    for message_id, sender, receiver, conversation_id in newly_read:
+        key = (conversation_id, receiver)
+        by_conversation[key] = by_conversation.get(key, 0) + 1
+        by_pair.setdefault((receiver, sender), []).append(message_id)
+    for (conversation_id, receiver), count in by_conversation.items():
+        _adjust_unread(cursor, conversation_id, receiver, -count)
+    return [(receiver, sender, ids, None) for (receiver, sender), ids in by_pair.items()]
+
+
+def _advance_read_cursor(
+    cursor: sqlite3.Cursor, username: str, peer: str, last_read_id: int
+) -> None:
+    """
+    Moves a read cursor forward, creating it if needed. Cursors never move backwards.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        username (str): The reader.
+        peer (str): The sender of the conversation's incoming messages.
+        last_read_id (int): The ID of the newest message read.
+
+    Returns:
+        None
+    """
+    cursor.execute(
+        """
+        INSERT INTO read_cursors (username, peer, last_read_id)
+        VALUES (?, ?, ?)
+        ON CONFLICT (username, peer)
+        DO UPDATE SET last_read_id = MAX(last_read_id, excluded.last_read_id)
+    """,
+        (username, peer, last_read_id),
+    )
+
+
+def mark_conversation_read(username: str, peer: str, last_read_id: int) -> None:
+    """
+    Marks every message from peer to username up to last_read_id as read.
+
+    In cursor mode this is a single-row update of the conversation's cursor.
+
+    Args:
+        username (str): The user who read the messages.
+        peer (str): The user who sent them.
+        last_read_id (int): The ID of the newest message read.
+
+    Returns:
+        None
+    """
+
+    def mark_read(cursor: sqlite3.Cursor) -> None:
+        if READ_TRACKING == "cursor":
+            # Clamped to the newest message, as status mode only marks rows that
+            # exist; a cursor past it would mark future messages as read
+            newest = cursor.execute(
+                "SELECT MAX(id) FROM messages WHERE receiver = ? AND sender = ?",
+                (username, peer),
+            ).fetchone()[0]
+            _advance_read_cursor(cursor, username, peer, min(last_read_id, newest or 0))
+            _refresh_unread(cursor, username, peer)
+            return
+        cursor.execute(
+            """
+            UPDATE messages SET read_status = 1
+            WHERE receiver = ? AND sender = ? AND id <= ? AND read_status = 0
+        """,
+            (username, peer, last_read_id),
+        )
+        newly_read = cursor.rowcount
+        if newly_read > 0:
+            user_a, user_b = _conversation_pair(username, peer)
+            cursor.execute(
+                "SELECT id FROM conversations WHERE user_a = ? AND user_b = ?",
+                (user_a, user_b),
+            )
+            row = cursor.fetchone()
+            if row:
+                _adjust_unread(cursor, row[0], username, -newly_read)
+
+    _shards().shard_for_pair(username, peer).write(mark_read)
+    message_cache.on_read(username, peer, up_to_id=last_read_id)
+
+
+def create_user(username: str, password_hash: str) -> bool:
+    """
+    Stores a new user.
+
+    Args:
+        username (str): The username of the new user.
+        password_hash (str): The hash of their password.
+
+    Returns:
+        bool: True if the user was created, False if the username is taken.
+    """
+    try:
+        _main_shard().write(
+            lambda cursor: cursor.execute(
+                """
+                INSERT INTO users (username, password_hash)
+                VALUES (?, ?)
+            """,
+                (username, password_hash),
+            )
+        )
+    except sqlite3.IntegrityError:
+        return False
+
+    user_directory.add(username)
+    return True
+
+
+def get_password_hash(username: str) -> Optional[str]:
+    """
+    Retrieves a user's password hash.
+
+    Args:
+        username (str): The user.
+
+    Returns:
+        Optional[str]: The password hash, or None if the user does not exist.
+    """
+    row = _main_shard().read(
+        lambda cursor: cursor.execute(
+            "SELECT password_hash FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    )
+    return row[0] if row else None
+
+
+def delete_user(username: str) -> bool:
+    """
+    Deletes a user with the messages they sent, their conversations and
+    their room memberships.
+
+    Args:
+        username (str): The user to delete.
+
+    Returns:
+        bool: True if the user was deleted, False if they did not exist.
+    """
+    # Delete the user's messages first (to maintain foreign key constraints)
+    delete_user_messages(username)
+
+    def delete(cursor: sqlite3.Cursor) -> bool:
+        cursor.execute("DELETE FROM room_members WHERE username = ?", (username,))
+        cursor.execute("DELETE FROM users WHERE username = ?", (username,))
+        return cursor.rowcount > 0
+
+    deleted = _main_shard().write(delete)
+
+    # Peers' cached history may include the deleted messages
+    message_cache.clear()
+    user_directory.remove(username)
+    return deleted
+
+
+#  get user information
+def get_user_info(username: str) -> Optional[Tuple[str, int]]:
+    """
+    Retrieves user information, specifically the username and the number of unread messages.
+
+    Args:
+        username (str): The username to retrieve information for.
+
+    Returns:
+        Optional[Tuple[str, int]]: A tuple of the username and the number of unread messages, or None if the user does not exist.
+    """
+    return _main_shard().read(
+        lambda cursor: cursor.execute(
+            "SELECT username, n_unread_messages FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    )
+
+
+def set_n_unread_messages(username: str, n_unread_messages: int) -> bool:
+    """
+    Updates the number of unread messages for a user.
+
+    Args:
+        username (str): The username to update.
+        n_unread_messages (int): The new number of unread messages for the user.
+
+    Returns:
+        bool: True if the update was successful, False otherwise.
+    """
+    _main_shard().write(
+        lambda cursor: cursor.execute(
+            "UPDATE users SET n_unread_messages = ? WHERE username = ?",
+            (n_unread_messages, username),
+        )
+    )
+    return True
+
+
+def delete_message(message_id: int) -> bool:
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    Deletes a message from the database.
+
+    Args:
+        message_id (int): The ID of the message to delete.
+
+    Returns:
+        bool: True if the deletion was successful, False otherwise.
+    """
+
+    def delete(cursor: sqlite3.Cursor) -> Optional[tuple]:
+        cursor.execute(
+            """
+            SELECT conversation_id, sender, receiver, read_status
+            FROM messages WHERE id = ?
+        """,
+            (message_id,),
+        )
+        row = cursor.fetchone()
+        cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+        if row and row[0] is not None:
+            _remove_from_conversation(cursor, message_id, *row)
+        return row
+
+    try:
+        row = _shards().shard_for_id(message_id).write(delete)
+        if row:
+            message_cache.on_delete(message_id, row[1], row[2])
+        return True
+    except Exception as e:
+        logging.error(f"Error deleting message {message_id}: {e}")
+        return False
+
+
+def delete_user_messages(username: str) -> None:
+    """
+    Deletes the messages a user sent, their read cursors, their peers'
+    cursors on them and their conversations from every shard, as part of
+    deleting their account.
+
+    Args:
+        username (str): The user being deleted.
+
+    Returns:
+        None
+    """
+
+    def delete(cursor: sqlite3.Cursor) -> None:
+        cursor.execute("DELETE FROM messages WHERE sender = ?", (username,))
+        cursor.execute("DELETE FROM read_cursors WHERE username = ?", (username,))
+        cursor.execute("DELETE FROM read_cursors WHERE peer = ?", (username,))
+        cursor.execute(
+            "DELETE FROM conversations WHERE user_a = ? OR user_b = ?",
+            (username, username),
+        )
+
+    _shards().map(lambda shard: shard.write(delete))
+
+
+def _remove_from_conversation(
+    cursor: sqlite3.Cursor,
+    message_id: int,
+    conversation_id: int,
+    sender: str,
+    receiver: str,
+    read_status: int,
+) -> None:
+    """
+    Updates a conversation's summary after one of its messages was deleted.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor of the open transaction.
+        message_id (int): The ID of the deleted message.
+        conversation_id (int): The conversation it belonged to.
+        sender (str): Its sender.
+        receiver (str): Its receiver.
+        read_status (int): Its read_status flag.
+
+    Returns:
+        None
+    """
+    if READ_TRACKING == "cursor":
+        cursor.execute(
+            "SELECT last_read_id FROM read_cursors WHERE username = ? AND peer = ?",
+            (receiver, sender),
+        )
+        cursor_row = cursor.fetchone()
+        was_unread = message_id > (cursor_row[0] if cursor_row else 0)
+    else:
+        was_unread = not read_status
+    if was_unread:
+        _adjust_unread(cursor, conversation_id, receiver, -1)
 
     cursor.execute(
-        "SELECT username FROM users WHERE username != ?",
-        (username,),
+        "SELECT last_message_id FROM conversations WHERE id = ?", (conversation_id,)
     )
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    summary = cursor.fetchone()
+    if summary and summary[0] == message_id:
+        cursor.execute(
+            """
+            SELECT id, sender, content, timestamp FROM messages
+            WHERE conversation_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+        """,
+            (conversation_id,),
+        )
+        last = cursor.fetchone() or (0, "", "", "")
+        cursor.execute(
+            """
+            UPDATE conversations
+            SET last_message_id = ?, last_sender = ?, last_content = ?, last_timestamp = ?
+            WHERE id = ?
+        """,
+            (*last, conversation_id),
+        )
+
+
+def get_all_users_except(username: str) -> List[str]:
+    """
+    Retrieves all usernames except the given username.
+
+    Args:
+        username (str): The username to exclude.
+
+    Returns:
+        List[str]: A list of all usernames except the given username.
+    """
+    usernames, _ = user_directory.load(_load_usernames)
+    return [user for user in usernames if user != username]
+
+
+def search_users(
+    prefix: str, limit: int = 20, exclude: Optional[str] = None
+) -> Tuple[List[str], int]:
+    """
+    Finds usernames starting with a prefix, in alphabetical order.
+
+    Args:
+        prefix (str): The prefix to match; empty matches everyone.
+        limit (int, optional): The maximum number of usernames. Defaults to 20.
+        exclude (Optional[str], optional): A username to leave out. Defaults to None.
+
+    Returns:
+        Tuple[List[str], int]: The matching usernames and the user directory
+            version, which changes whenever a user registers or is deleted.
+    """
+    return user_directory.search(_load_usernames, prefix, limit, exclude)
+
+
+def _load_usernames() -> List[str]:
+    """
+    Reads every username from the database to fill the user directory.
+
+    Returns:
+        List[str]: All usernames.
+    """
+    return _main_shard().read(
+        lambda cursor: [row[0] for row in cursor.execute("SELECT username FROM users")]
+    )
+
+
+def _fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 query matching messages that contain every
+    word, treating FTS5 operators and punctuation as plain text.
+
+    Args:
+        text (str): The search text entered by a user.
+
+    Returns:
+        str: The FTS5 query, or an empty string if there are no words.
+    """
+    terms = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_messages(
+    username: str, text: str, cursor: str = "", limit: int = 20
+) -> Tuple[List[Tuple[int, str, str, str, str]], str]:
+    """
+    Searches the content of messages the user sent or received, best
+    matches first.
+
+    Results are ordered by BM25 rank and then ID. Pages are walked with the
+    opaque 'cursor' returned by the previous page. Ranks are computed per
+    shard and are not comparable across shards, so the cursor keeps one
+    (rank, id) position per shard: the order of a merged page is approximate,
+    but every hit is returned exactly once.
+
+    Args:
+        username (str): The user searching; only their conversations are searched.
+        text (str): The words to search for.
+        cursor (str, optional): The cursor of the previous page, or "" for the first.
+        limit (int, optional): The page size. Defaults to 20.
+
+    Returns:
+        Tuple[List[Tuple[int, str, str, str, str]], str]: Rows of
+            (id, sender, receiver, snippet, timestamp) with matches in the
+            snippet wrapped in brackets, and the cursor of the next page, or ""
+            if this was the last one.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query = _fts_query(text)
+    if not query or limit <= 0:
+        return [], ""
+    router = _shards()
+    positions = [(float("-inf"), 0)] * router.count
+    if cursor:
+        try:
+            positions = [
+                (float(rank_text), int(id_text))
+                for rank_text, id_text in (position.split(":") for position in cursor.split(","))
+            ]
+        except ValueError:
+            raise ValueError("Invalid search cursor.")
+        if len(positions) != router.count:
+            raise ValueError("Invalid search cursor.")
+    # Only the user's messages are matched, see _FTS_SCHEMA
+    participant = username.encode("utf-8").hex().upper()
+    match = f'participants : "{participant}" AND content : ({query})'
+
+    def search(shard: Shard) -> list:
+        after_rank, after_id = positions[shard.index]
+        return shard.read(
+            lambda db_cursor: db_cursor.execute(
+                """
+                SELECT m.id, m.sender, m.receiver,
+                       snippet(messages_fts, 0, '[', ']', '...', 12),
+                       m.timestamp, messages_fts.rank
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+                  AND (messages_fts.rank > ? OR (messages_fts.rank = ? AND m.id > ?))
+                ORDER BY messages_fts.rank, m.id
+                LIMIT ?
+            """,
+                (match, after_rank, after_rank, after_id, limit + 1),
+            ).fetchall()
+        )
+
+    rows = _merge(router.map(search), lambda row: (row[5], row[0]), limit + 1)
+
+    next_cursor = ""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # The page takes a prefix of each shard's results, so each shard
+        # resumes after the last of its own rows on the page
+        for row in rows:
+            positions[router.shard_for_id(row[0]).index] = (row[5], row[0])
+        # repr() round-trips floats exactly, so the boundary row is not repeated
+        next_cursor = ",".join(f"{rank!r}:{message_id}" for rank, message_id in positions)
+    return [row[:5] for row in rows], next_cursor
+
+
+def get_conversation_id(user1: str, user2: str) -> Optional[int]:
+    """
+    Retrieves the ID of the conversation between two users.
+
+    Args:
+        user1 (str): One participant.
+        user2 (str): The other participant.
+
+    Returns:
+        Optional[int]: The conversation ID, or None if they never exchanged messages.
+    """
+    router = _shards()
+    shard = router.shard_for_pair(user1, user2)
+    row = shard.read(
+        lambda cursor: cursor.execute(
+            "SELECT id FROM conversations WHERE user_a = ? AND user_b = ?",
+            _conversation_pair(user1, user2),
+        ).fetchone()
+    )
+    return router.encode(row[0], shard) if row else None
+
+
+def get_conversation_messages(
+    conversation_id: int, before_id: Optional[int] = None, limit: int = 50
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Retrieves a page of one conversation using the (conversation_id, id) index.
+
+    Args:
+        conversation_id (int): The conversation.
+        before_id (Optional[int]): Only return messages with an ID lower than
+            this. None starts from the newest message.
+        limit (int): The maximum number of messages to retrieve. Defaults to 50.
+
+    Returns:
+        List[Tuple[int, str, str, str]]: A list of tuples, each containing the id, sender, content, and timestamp of a message, sorted from oldest to newest.
+    """
+    local_id, shard = _shards().decode(conversation_id)
+
+    def read_page(cursor: sqlite3.Cursor) -> Tuple[List[Tuple[int, str, str, str]], int]:
+        rows = cursor.execute(
+            """
+            SELECT id, sender, content, timestamp
+            FROM messages
+            WHERE conversation_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        """,
+            (local_id, before_id if before_id else 2**63 - 1, limit),
+        ).fetchall()
+        row = cursor.execute(
+            "SELECT archived_max_id FROM conversations WHERE id = ?", (local_id,)
+        ).fetchone()
+        return rows, row[0] if row else 0
+
+    rows, archived_max_id = shard.read(read_page)
+
+    # Reverse to have oldest messages first
+    rows = rows[::-1]
+    # Read messages are archived while unread ones stay live, so archived
+    # messages can be older than the page or interleaved with it
+    if archived_max_id and limit > 0 and (len(rows) < limit or archived_max_id > rows[0][0]):
+        archived = archive.get_conversation_messages(
+            conversation_id, before_id or 2**63 - 1, limit
+        )
+        rows = sorted(rows + archived, key=lambda row: row[0])[-limit:]
+    return rows
+
+
+def archive_read_messages(
+    retention_days: int, batch_size: int = 1000, now: Optional[datetime] = None
+) -> int:
+    """
+    Moves read messages older than the retention period to the archive.
+
+    Messages are copied in batches and deleted from the live table only after
+    their batch is stored, so an interrupted run loses nothing. Archived
+    messages stay reachable through get_conversation_messages but are no
+    longer returned by full-text search.
+
+    Args:
+        retention_days (int): Read messages older than this many days are archived.
+        batch_size (int, optional): Messages moved per transaction. Defaults to 1000.
+        now (Optional[datetime], optional): The current UTC time. Defaults to utcnow().
+
+    Returns:
+        int: The number of messages archived.
+    """
+    cutoff = ((now or datetime.utcnow()) - timedelta(days=retention_days)).isoformat() + "Z"
+    if READ_TRACKING == "cursor":
+        query = """
+            SELECT m.id, m.conversation_id, m.sender, m.receiver, m.content, m.timestamp
+            FROM messages m
+            JOIN read_cursors c ON c.username = m.receiver AND c.peer = m.sender
+            WHERE m.id > ? AND m.timestamp < ? AND m.id <= c.last_read_id
+            ORDER BY m.id
+            LIMIT ?
+        """
+    else:
+        query = """
+            SELECT id, conversation_id, sender, receiver, content, timestamp
+            FROM messages
+            WHERE id > ? AND timestamp < ? AND read_status = 1
+            ORDER BY id
+            LIMIT ?
+        """
+
+    router = _shards()
+
+    def archive_shard(shard: Shard) -> int:
+        archived = 0
+        last_id = 0
+        while True:
+            batch = shard.read(
+                lambda cursor: cursor.execute(query, (last_id, cutoff, batch_size)).fetchall()
+            )
+            if not batch:
+                return archived
+            # The archive is shared by all shards, so it stores global conversation IDs
+            archive.write_messages(
+                [
+                    (id, router.encode(conversation_id, shard), *rest)
+                    for id, conversation_id, *rest in batch
+                ]
+            )
+            ids = [row[0] for row in batch]
+            archived_max_ids: Dict[int, int] = {}
+            for id, conversation_id, *_ in batch:
+                archived_max_ids[conversation_id] = max(archived_max_ids.get(conversation_id, 0), id)
+
+            def delete_batch(cursor: sqlite3.Cursor) -> None:
+                cursor.execute(
+                    f"DELETE FROM messages WHERE id IN ({','.join('?' * len(ids))})", ids
+                )
+                # Pages of these conversations now look in the archive
+                cursor.executemany(
+                    "UPDATE conversations SET archived_max_id = MAX(archived_max_id, ?) "
+                    "WHERE id = ?",
+                    [(id, conversation_id) for conversation_id, id in archived_max_ids.items()],
+                )
+
+            shard.write(delete_batch)
+            archived += len(batch)
+            last_id = ids[-1]
+
+    archived = sum(router.map(archive_shard))
+    if archived:
+        # Cached recent tails may still hold archived messages
+        message_cache.clear()
+        logging.info(f"archived {archived} messages older than {cutoff}")
+    return archived
+
+
+def compact_database(max_pages: int = 0) -> None:
+    """
+    Returns free pages left by deletes to the file system and refreshes the
+    query planner's statistics.
+
+    A database created before incremental vacuum was enabled is converted
+    with one full VACUUM the first time this runs.
+
+    Args:
+        max_pages (int, optional): The most free pages to release; 0 releases all.
+
+    Returns:
+        None
+    """
+
+    def compact(cursor: sqlite3.Cursor) -> None:
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+        cursor.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+        cursor.execute("ANALYZE")
+
+    # On the writer threads, so compaction never races a shard's writes
+    _shards().map(lambda shard: shard.write(compact))
+
+
+def list_conversations(
+    username: str, limit: int = 50
+) -> List[Tuple[int, str, int, str, str, str, int]]:
+    """
+    Retrieves a user's conversations from their summary rows, most recently
+    active first, without touching the messages table.
+
+    Args:
+        username (str): The user whose conversations to list.
+        limit (int): The maximum number of conversations. Defaults to 50.
+
+    Returns:
+        List[Tuple[int, str, int, str, str, str, int]]: A list of tuples, each containing the conversation id, peer, last message id, last sender, last content, last timestamp and the user's unread count.
+    """
+    router = _shards()
+
+    def conversations(shard: Shard) -> list:
+        rows = shard.read(
+            lambda cursor: cursor.execute(
+                """
+                SELECT id, user_b, last_message_id, last_sender, last_content,
+                       last_timestamp, unread_a
+                FROM conversations WHERE user_a = ?
+                UNION ALL
+                SELECT id, user_a, last_message_id, last_sender, last_content,
+                       last_timestamp, unread_b
+                FROM conversations WHERE user_b = ? AND user_a != user_b
+                ORDER BY last_message_id DESC
+                LIMIT ?
+            """,
+                (username, username, limit),
+            ).fetchall()
+        )
+        return [(router.encode(row[0], shard), *row[1:]) for row in rows]
+
+    return _merge(router.map(conversations), lambda row: row[2], limit, reverse=True)
+
+
+def create_room(name: str, owner: str, kind: str = "group") -> Optional[int]:
+    """
+    Creates a room and adds its owner as the first member.
+
+    Args:
+        name (str): The unique name of the room.
+        owner (str): The username of the user creating the room.
+        kind (str): "group" for a chat every member can post to, or "channel"
+            for a broadcast channel only the owner can post to.
+
+    Returns:
+        Optional[int]: The ID of the new room, or None if the name is taken.
+    """
+    def create(cursor: sqlite3.Cursor) -> int:
+        timestamp = datetime.utcnow().isoformat() + "Z"
+        cursor.execute(
+            "INSERT INTO rooms (name, owner, kind, created_at) VALUES (?, ?, ?, ?)",
+            (name, owner, kind, timestamp),
+        )
+        room_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO room_members (room_id, username) VALUES (?, ?)",
+            (room_id, owner),
+        )
+        return room_id
+
+    try:
+        return _main_shard().write(create)
+    except sqlite3.IntegrityError:
+        return None
+
+
+def get_room(room_id: int) -> Optional[Tuple[int, str, str, str]]:
+    """
+    Retrieves a room by ID.
+
+    Args:
+        room_id (int): The ID of the room.
+
+    Returns:
+        Optional[Tuple[int, str, str, str]]: A tuple of the id, name, owner and kind of the room, or None if it does not exist.
+    """
+    return _main_shard().read(
+        lambda cursor: cursor.execute(
+            "SELECT id, name, owner, kind FROM rooms WHERE id = ?", (room_id,)
+        ).fetchone()
+    )
+
+
+def add_room_member(room_id: int, username: str) -> bool:
+    """
+    Adds a user to a room. The member's read cursor starts at the latest
+    message so joining does not flood them with the room's backlog.
+
+    Args:
+        room_id (int): The ID of the room.
+        username (str): The user to add.
+
+    Returns:
+        bool: True if the user was added, False if they were already a member.
+    """
+    def add(cursor: sqlite3.Cursor) -> bool:
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO room_members (room_id, username, last_read_id)
+            VALUES (?, ?, (SELECT COALESCE(MAX(id), 0) FROM room_messages WHERE room_id = ?))
+        """,
+            (room_id, username, room_id),
+        )
+        return cursor.rowcount > 0
+
+    return _main_shard().write(add)
+
+
+def remove_room_member(room_id: int, username: str) -> bool:
+    """
+    Removes a user from a room.
+
+    Args:
+        room_id (int): The ID of the room.
+        username (str): The user to remove.
+
+    Returns:
+        bool: True if the user was removed, False if they were not a member.
+    """
+    def remove(cursor: sqlite3.Cursor) -> bool:
+        cursor.execute(
+            "DELETE FROM room_members WHERE room_id = ? AND username = ?",
+            (room_id, username),
+        )
+        return cursor.rowcount > 0
+
+    return _main_shard().write(remove)
+
+
+def get_room_members(room_id: int) -> List[str]:
+    """
+    Retrieves the usernames of all members of a room.
+
+    Args:
+        room_id (int): The ID of the room.
+
+    Returns:
+        List[str]: The members' usernames.
+    """
+    return _main_shard().read(
+        lambda cursor: [
+            row[0]
+            for row in cursor.execute(
+                "SELECT username FROM room_members WHERE room_id = ?", (room_id,)
+            )
+        ]
+    )
+
+
+def get_user_rooms(username: str) -> List[Tuple[int, str, str]]:
+    """
+    Retrieves the rooms a user is a member of.
+
+    Args:
+        username (str): The user whose rooms to retrieve.
+
+    Returns:
+        List[Tuple[int, str, str]]: A list of tuples, each containing the id, name and kind of a room.
+    """
+    return _main_shard().read(
+        lambda cursor: cursor.execute(
+            """
+            SELECT rooms.id, rooms.name, rooms.kind
+            FROM room_members
+            JOIN rooms ON rooms.id = room_members.room_id
+            WHERE room_members.username = ?
+            ORDER BY rooms.id ASC
+        """,
+            (username,),
+        ).fetchall()
+    )
+
+
+def insert_room_message(room_id: int, sender: str, content: str) -> int:
+    """
+    Stores a room message once, regardless of the number of members.
+
+    Args:
+        room_id (int): The ID of the room.
+        sender (str): The username of the sender.
+        content (str): The content of the message.
+
+    Returns:
+        int: The ID of the newly inserted message.
+    """
+    timestamp = datetime.utcnow().isoformat() + "Z"  # UTC time in ISO format
+    return _main_shard().write(
+        lambda cursor: cursor.execute(
+            """
+            INSERT INTO room_messages (room_id, sender, content, timestamp)
+            VALUES (?, ?, ?, ?)
+        """,
+            (room_id, sender, content, timestamp),
+        ).lastrowid
+    )
+
+
+def get_room_history(
+    room_id: int, before_id: Optional[int] = None, limit: int = 50
+) -> List[Tuple[int, str, str, str]]:
+    """
+    Retrieves a page of a room's messages using the (room_id, id) index.
+
+    Args:
+        room_id (int): The ID of the room.
+        before_id (Optional[int]): Only return messages with an ID lower than
+            this. None starts from the newest message.
+        limit (int): The maximum number of messages to retrieve. Defaults to 50.
+
+    Returns:
+        List[Tuple[int, str, str, str]]: A list of tuples, each containing the id, sender, content, and timestamp of a message, sorted from oldest to newest.
+    """
+    rows = _main_shard().read(
+        lambda cursor: cursor.execute(
+            """
+            SELECT id, sender, content, timestamp
+            FROM room_messages
+            WHERE room_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        """,
+            (room_id, before_id if before_id else 2**63 - 1, limit),
+        ).fetchall()
+    )
+    # Reverse to have oldest messages first
+    return rows[::-1]
+
+
+def mark_room_read(room_id: int, username: str, last_read_id: int) -> None:
+    """
+    Advances a member's read cursor for a room. The cursor never moves
+    backwards, nor past the room's newest message, so marking a room as
+    read is a single-row update.
+
+    Args:
+        room_id (int): The ID of the room.
+        username (str): The member whose cursor to advance.
+        last_read_id (int): The ID of the newest message the member has read.
+
+    Returns:
+        None
+    """
+    _main_shard().write(
+        lambda cursor: cursor.execute(
+            """
+            UPDATE room_members
+            SET last_read_id = MAX(last_read_id, MIN(?, (
+                SELECT COALESCE(MAX(id), 0) FROM room_messages WHERE room_id = ?
+            )))
+            WHERE room_id = ? AND username = ?
+        """,
+            (last_read_id, room_id, room_id, username),
+        )
+    )
+
+
+def get_room_read_cursor(room_id: int, username: str) -> Optional[int]:
+    """
+    Retrieves a member's read cursor for a room.
+
+    Args:
+        room_id (int): The ID of the room.
+        username (str): The member.
+
+    Returns:
+        Optional[int]: The ID of the newest message the member has read, or None if they are not a member.
+    """
+    row = _main_shard().read(
+        lambda cursor: cursor.execute(
+            "SELECT last_read_id FROM room_members WHERE room_id = ? AND username = ?",
+            (room_id, username),
+        ).fetchone()
+    )
+    return row[0] if row else None
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage engine backed by the SQLite functions of this module.
+    """
+
+    def initialize(self) -> None:
+        initialize_database()
+
+    def close(self) -> None:
+        global _router
+        if _router is not None:
+            _router.close()
+            _router = None
+
+    def create_user(self, username: str, password_hash: str) -> bool:
+        return create_user(username, password_hash)
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        return get_password_hash(username)
+
+    def delete_user(self, username: str) -> bool:
+        return delete_user(username)
+
+    def get_user_info(self, username: str) -> Optional[Tuple[str, int]]:
+        return get_user_info(username)
+
+    def set_n_unread_messages(self, username: str, n_unread_messages: int) -> bool:
+        return set_n_unread_messages(username, n_unread_messages)
+
+    def get_all_users_except(self, username: str) -> List[str]:
+        return get_all_users_except(username)
+
+    def search_users(
+        self, prefix: str, limit: int = 20, exclude: Optional[str] = None
+    ) -> Tuple[List[str], int]:
+        return search_users(prefix, limit, exclude)
+
+    def insert_message(self, sender: str, content: str, receiver: str) -> int:
+        return insert_message(sender, content, receiver)
+
+    def get_recent_messages(
+        self, user_id: str, limit: int = 50
+    ) -> List[Tuple[str, str, str, str, int]]:
+        return get_recent_messages(user_id, limit)
+
+    def get_unread_messages(
+        self, user_id: str, limit: int = 20
+    ) -> List[Tuple[int, str, str, str]]:
+        return get_unread_messages(user_id, limit)
+
+    def get_undelivered_messages(self, user_id: str) -> List[Tuple[str, str, str, int]]:
+        return get_undelivered_messages(user_id)
+
+    def mark_messages_delivered(
+        self, user_id: str, message_ids: Optional[List[int]] = None
+    ) -> int:
+        return mark_messages_delivered(user_id, message_ids)
+
+    def get_login_bootstrap(
+        self, username: str, default_limit: int = 50
+    ) -> Tuple[List[Tuple[int, str, str, str]], List[Tuple[str, str, str, str, int]], List[str]]:
+        return get_login_bootstrap(username, default_limit)
+
+    def mark_messages_as_read(self, message_ids: List[int]) -> None:
+        mark_messages_as_read(message_ids)
+
+    def mark_conversation_read(self, username: str, peer: str, last_read_id: int) -> None:
+        mark_conversation_read(username, peer, last_read_id)
+
+    def delete_message(self, message_id: int) -> bool:
+        return delete_message(message_id)
+
+    def search_messages(
+        self, username: str, text: str, cursor: str = "", limit: int = 20
+    ) -> Tuple[List[Tuple[int, str, str, str, str]], str]:
+        return search_messages(username, text, cursor, limit)
+
+    def get_conversation_id(self, user1: str, user2: str) -> Optional[int]:
+        return get_conversation_id(user1, user2)
+
+    def get_conversation_messages(
+        self, conversation_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        return get_conversation_messages(conversation_id, before_id, limit)
+
+    def list_conversations(
+        self, username: str, limit: int = 50
+    ) -> List[Tuple[int, str, int, str, str, str, int]]:
+        return list_conversations(username, limit)
+
+    def create_room(self, name: str, owner: str, kind: str = "group") -> Optional[int]:
+        return create_room(name, owner, kind)
+
+    def get_room(self, room_id: int) -> Optional[Tuple[int, str, str, str]]:
+        return get_room(room_id)
+
+    def add_room_member(self, room_id: int, username: str) -> bool:
+        return add_room_member(room_id, username)
+
+    def remove_room_member(self, room_id: int, username: str) -> bool:
+        return remove_room_member(room_id, username)
+
+    def get_room_members(self, room_id: int) -> List[str]:
+        return get_room_members(room_id)
+
+    def get_user_rooms(self, username: str) -> List[Tuple[int, str, str]]:
+        return get_user_rooms(username)
+
+    def insert_room_message(self, room_id: int, sender: str, content: str) -> int:
+        return insert_room_message(room_id, sender, content)
+
+    def get_room_history(
+        self, room_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        return get_room_history(room_id, before_id, limit)
+
+    def mark_room_read(self, room_id: int, username: str, last_read_id: int) -> None:
+        mark_room_read(room_id, username, last_read_id)
 
-    return users
+    def get_room_read_cursor(self, room_id: int, username: str) -> Optional[int]:
+        return get_room_read_cursor(room_id, username)
 
+    def archive_read_messages(self, retention_days: int) -> int:
+        return archive_read_messages(retention_days)
 
-# Initialize the database when the module is imported
-initialize_database()
+    def compact(self, max_pages: int = 0) -> None:
+        compact_database(max_pages)
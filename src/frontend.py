@@ -8,7 +8,7 @@ from tkinter import messagebox
 import json
 import threading
 
-from client import WebSocketClient  # Import the WebSocketClient class
+from client import WebSocketClient, DEFAULT_BATCH_WINDOW
 import logging, logging.config
 from pathlib import Path
 import datetime
@@ -32,7 +32,8 @@ class ChatApp(tk.Tk):
         self.resizable(False, False)
 
         # Initialize WebSocket client
-        self.ws_client = WebSocketClient()
+        # Batching coalesces bursts such as the requests sent after login
+        self.ws_client = WebSocketClient(batch_window=DEFAULT_BATCH_WINDOW)
         self.ws_client.connect()
 
         # Create Authentication Box
@@ -111,7 +112,7 @@ class ChatApp(tk.Tk):
                         "Registration Successful",
                         data.get("message", "You have registered successfully."),
                     )
-                elif action == "confirm_login":
+                elif action in ("confirm_login", "login_bootstrap"):
                     messagebox.showinfo(
                         "Login Successful",
                         data.get("message", "You have logged in successfully."),
@@ -121,10 +122,17 @@ class ChatApp(tk.Tk):
                     self.messages_container.username = data.get("username")
                     self.delete_account_container.username = data.get("username")
                     logging.info(f"User '{data.get('username')}' logged in.")
-                    # call to get unread mesasges
-                    self.get_unread_messages()
-                    self.get_recent_messages()
-                    self.chat_box.fetch_users()  # Fetch users after login
+                    if action == "login_bootstrap":
+                        # Everything arrived with the login reply
+                        for msg in data.get("unread", []):
+                            self.messages_container.add_unread_message(msg)
+                        for msg in data.get("recent", []):
+                            self.messages_container.add_recent_message(msg)
+                    else:
+                        # call to get unread mesasges
+                        self.get_unread_messages()
+                        self.get_recent_messages()
+                    # Recipients are autocompleted, see ChatBox.search_users
                     # mesage_dict
                     self.switch_to_chat_screen()
                     logging.info(f"User '{data.get('username')}' logged in.")
@@ -142,6 +150,7 @@ class ChatApp(tk.Tk):
                             "username": data.get("username"),
                         }
                         self.messages_container.add_unread_message(incoming_message)
+                        self.ws_client.ack([data["id"]])
                     else:
                         logging.error("Received message without 'id'.")
                 elif action == "recent_messages":
@@ -153,6 +162,12 @@ class ChatApp(tk.Tk):
                     unread_msgs = data.get("messages", [])
                     for msg in unread_msgs:
                         self.messages_container.add_unread_message(msg)
+                elif action == "undelivered_messages":
+                    # Replayed on login; add_unread_message skips IDs already shown
+                    undelivered_msgs = data.get("messages", [])
+                    for msg in undelivered_msgs:
+                        self.messages_container.add_unread_message(msg)
+                    self.ws_client.ack(msg["id"] for msg in undelivered_msgs)
                 elif action == "mark_as_read":
                     messagebox.showinfo(
                         "Messages Read", data.get("message", "Messages marked as read.")
@@ -174,8 +189,10 @@ class ChatApp(tk.Tk):
                     # Optionally handle confirmation of message deletion
                     logging.info(f"Message {data.get('id')} deleted successfully.")
                 # Handle other success actions as needed
-                elif action == "user_list":
-                    self.chat_box.update_user_list(data.get("users", []))
+                elif action == "user_search":
+                    self.chat_box.show_suggestions(
+                        data.get("prefix", ""), data.get("users", [])
+                    )
             elif status == "error":
                 error_msg = data.get("message", "An error occurred.")
                 messagebox.showerror("Error", error_msg)
@@ -395,10 +412,12 @@ class LoginForm(tk.Frame):
             return
 
         # Create the login payload
-        login_payload: Dict[str, str] = {
+        # Ask for the unread, recent and user lists with the login reply
+        login_payload: Dict[str, Any] = {
             "action": "login",
             "username": username,
             "password": password,
+            "bootstrap": 1,
         }
 
         # Send the login payload via WebSocket
@@ -451,6 +470,12 @@ class NNewMessages(tk.Frame):
         )
 
 
+# Recipients are autocompleted from the server as the user types: a search
+# is sent once typing pauses for this long, for at most this many names
+USER_SEARCH_DELAY_MS = 250
+USER_SEARCH_LIMIT = 10
+
+
 class ChatBox(tk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
@@ -460,21 +485,18 @@ class ChatBox(tk.Frame):
         # self.messages_display = tk.Text(self, height=15, width=80, state="disabled")
         # self.messages_display.pack(pady=5)
 
-        # Receiver Username
+        # Receiver Username, autocompleted by prefix instead of picked from
+        # a list of every user
         receiver_frame = tk.Frame(self)
         receiver_frame.pack(pady=5)
         tk.Label(receiver_frame, text="Receiver Username:").pack(side=tk.LEFT, padx=5)
-        self.user_list = []
         self.selected_user = tk.StringVar(self)
-        self.selected_user.set("Select a user")  # Default placeholder
-        self.user_dropdown = tk.OptionMenu(
-            receiver_frame, self.selected_user, "Select a user", *self.user_list
-        )
-        self.user_dropdown.pack(side=tk.LEFT, padx=5)
-
-        tk.Button(receiver_frame, text="Refresh", command=self.fetch_users).pack(
-            side=tk.LEFT, padx=5
-        )
+        self.receiver_entry = tk.Entry(receiver_frame, textvariable=self.selected_user, width=30)
+        self.receiver_entry.pack(side=tk.LEFT, padx=5)
+        self.receiver_entry.bind("<KeyRelease>", self.schedule_user_search)
+        self.suggestions = tk.Listbox(self, height=5, width=30)
+        self.suggestions.bind("<<ListboxSelect>>", self.select_suggestion)
+        self._search_job = None
 
         # Message Text
         message_frame = tk.Frame(self)
@@ -493,7 +515,7 @@ class ChatBox(tk.Frame):
         self.error_box.pack_forget()  # Initially hidden
 
     def send_message(self):
-        receiver = self.selected_user.get()
+        receiver = self.selected_user.get().strip()
         message = self.message_text.get().strip()
         if not receiver or not message:
             self.display_error("Receiver and message cannot be empty.")
@@ -520,30 +542,51 @@ class ChatBox(tk.Frame):
         self.error_box.config(text=message)
         self.error_box.pack()
 
-    def update_user_list(self, users):
+    def schedule_user_search(self, event=None):
         """
-        Updates the dropdown with the latest list of users.
+        Searches for recipients once typing pauses, instead of on every key.
         """
-        if not users:
-            self.selected_user.set("No users available")
-            return
-
-        self.user_list = users
-        self.selected_user.set(users[0])  # Set the first user as default
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(USER_SEARCH_DELAY_MS, self.search_users)
 
-        menu = self.user_dropdown["menu"]
-        menu.delete(0, "end")  # Clear previous entries
+    def search_users(self):
+        """
+        Sends a request for the usernames starting with the typed prefix.
+        """
+        self._search_job = None
+        prefix = self.selected_user.get().strip()
+        if not prefix:
+            self.show_suggestions("", [])
+            return
+        self.master.send_message_via_ws(
+            {"action": "search_users", "prefix": prefix, "limit": USER_SEARCH_LIMIT}
+        )
 
+    def show_suggestions(self, prefix, users):
+        """
+        Lists the usernames found for a prefix, unless the user has typed
+        something else since it was searched.
+        """
+        if prefix != self.selected_user.get().strip():
+            return
+        self.suggestions.delete(0, tk.END)
         for user in users:
-            menu.add_command(
-                label=user, command=lambda value=user: self.selected_user.set(value)
-            )
+            self.suggestions.insert(tk.END, user)
+        if users:
+            self.suggestions.pack(pady=5, after=self.receiver_entry.master)
+        else:
+            self.suggestions.pack_forget()
 
-    def fetch_users(self):
+    def select_suggestion(self, event=None):
         """
-        Sends a request to fetch all users except the logged-in user.
+        Fills in the suggested username that was clicked.
         """
-        self.master.send_message_via_ws({"action": "get_users"})
+        selection = self.suggestions.curselection()
+        if not selection:
+            return
+        self.selected_user.set(self.suggestions.get(selection[0]))
+        self.show_suggestions(self.selected_user.get(), [])
 
 
 class MessagesContainer(tk.Frame):
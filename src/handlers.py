@@ -1,31 +1,100 @@
 import json
 import logging
+import math
 import threading
-from utils import perform_handshake, WebSocketUtil
+from utils import (
+    perform_handshake,
+    WebSocketUtil,
+    WebSocketError,
+    PreparedFrame,
+    WS_CLOSE_GOING_AWAY,
+    WS_CLOSE_INTERNAL_ERROR,
+    WS_CLOSE_INVALID_PAYLOAD,
+    WS_CLOSE_TIMEOUT,
+)
+from custom_protocol import MessageDecodeError
+from heartbeat import Heartbeat, Liveness
+from rate_limit import RateLimiter
+from workers import WorkerPool
 from users import register_user, authenticate_user, delete_account
-from database import (
+from storage import (
     insert_message,
     get_recent_messages,
     get_unread_messages,
+    get_undelivered_messages,
+    mark_messages_delivered,
+    get_login_bootstrap,
     mark_messages_as_read,
+    mark_conversation_read,
     get_user_info,
     set_n_unread_messages,
     delete_message,
     get_all_users_except,
+    search_users,
+    search_messages,
+    get_conversation_id,
+    get_conversation_messages,
+    list_conversations,
+    create_room,
+    get_room,
+    add_room_member,
+    remove_room_member,
+    get_user_rooms,
+    insert_room_message,
+    get_room_history,
+    mark_room_read,
+    get_room_read_cursor,
 )
 from datetime import datetime
 import traceback
 import socket
-from typing import Dict, Any, Optional, Union, List
+from collections.abc import Mapping, Sequence
+from typing import Dict, Any, Optional, Union, List, Iterable, Callable
 
 # Global dictionary to track online users
 # Key: username, Value: connection object
 online_users = {}
 # Lock for thread-safe operations on online_users
 online_users_lock = threading.Lock()
+# Online members of each room, so room delivery only touches online users
+# Key: room id, Value: set of usernames (guarded by online_users_lock)
+online_room_members: Dict[int, set] = {}
+
+# Every upgraded connection, so a shutdown can reach them all
+open_connections: set = set()
+# Guards open_connections; notified whenever a connection closes
+open_connections_changed = threading.Condition()
+# Set once the server is shutting down; closing connections then say why
+going_away = threading.Event()
+
+ROOM_KINDS = ("group", "channel")
+# Page sizes for cursor-paged history actions
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+# Page size bounds for user directory searches
+USER_SEARCH_DEFAULT_LIMIT = 20
+USER_SEARCH_MAX_LIMIT = 100
+
+# Page size bounds for message searches
+MESSAGE_SEARCH_DEFAULT_LIMIT = 20
+MESSAGE_SEARCH_MAX_LIMIT = 100
+
+# Most message IDs accepted in one delivery acknowledgement
+ACK_MAX_IDS = 500
+
+# Most sub-requests accepted in one batch
+BATCH_MAX_REQUESTS = 50
 
 # TODO get rid of global state
-websocket = WebSocketUtil()
+# Requests are decoded on access, so handlers only pay for the fields they read
+websocket = WebSocketUtil(lazy_decoding=True)
+_PING_FRAME = websocket.build_control_frame(websocket.WS_OPCODE_PING)
+
+# The request being handled on this thread: its connection, optional
+# 'req_id', which send_success and send_error echo on replies to it, and
+# the list collecting those replies while a batch runs
+_current_request = threading.local()
 
 
 class ClientContext:
@@ -46,9 +115,17 @@ class ClientContext:
         self.addr = addr
         self.authenticated = False
         self.username = None
+        self.room_ids = set()
+        # Close status set by a worker that gave up on the connection
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
 
 
-def handle_client_connection(conn: socket.socket, addr: tuple) -> None:
+def handle_client_connection(
+    conn: socket.socket,
+    addr: tuple,
+    on_handshake: Optional[Callable[[bool], None]] = None,
+) -> None:
     """
     Handles a new client connection:
       1. Performs the WebSocket handshake.
@@ -59,52 +136,287 @@ def handle_client_connection(conn: socket.socket, addr: tuple) -> None:
     :type conn: socket.socket
     :param addr: The address of the connected client.
     :type addr: tuple
+    :param on_handshake: Called with the handshake outcome before anything else.
+    :type on_handshake: Optional[Callable[[bool], None]]
     :return: None
     """
     logging.info(f"[+] Client connected: {addr}")
-    if not perform_handshake(conn):
+    upgraded = perform_handshake(conn)
+    if on_handshake is not None:
+        on_handshake(upgraded)
+    if not upgraded:
         conn.close()
         return  # Handshake failed, close connection
+    # Any handshake deadline set by the server ends with the handshake
+    conn.settimeout(None)
 
     # Initialize client context
     context = ClientContext(conn, addr)
+    liveness = heartbeat.register(conn, context)
+    # Handlers run on the worker pool, in order, while this thread keeps reading
+    strand = worker_pool.strand()
+    with open_connections_changed:
+        open_connections.add(context)
+
+    # How to close: the status and reason of our close frame, or no frame
+    # at all (code None) if the connection failed; set by whoever ends it
+    close_code, close_reason, peer_closed = None, "", False
+
+    def on_control(opcode: int, payload: bytes) -> None:
+        nonlocal close_code, peer_closed
+        heartbeat.touch(liveness)
+        if opcode == websocket.WS_OPCODE_PING:
+            pong = websocket.build_control_frame(websocket.WS_OPCODE_PONG, payload)
+            with websocket.send_lock(conn):
+                conn.sendall(pong)
+        elif opcode == websocket.WS_OPCODE_CLOSE:
+            # Echoed once the pending replies are out
+            close_code, _ = websocket.parse_close_payload(payload)
+            peer_closed = True
+
     try:
         while True:
-            data = websocket.read_ws_frame(conn)
+            data = websocket.read_ws_frame(conn, on_control=on_control)
             if data is None:
-                break  # Connection closed or error
-
-            logging.info(f"Received message from {addr}: {data}")
+                break  # Close frame, or end of stream without one
+            heartbeat.touch(liveness)
 
-            # Check if 'action' is present
-            action = data.get("action")
-            if not action:
-                send_error(conn, "Missing 'action' in JSON message.")
-                continue
-
-            # Dispatch to the appropriate handler
-            handler = ACTION_HANDLERS.get(action, None)
-            if handler:
-                logging.info(f"Received action: {action}")
-                handler(context, data)
-            else:
-                logging.warning(f"Unknown action: {action}")
-                handle_unknown_action(context, action)
+            logging.debug("Received message from %s: %s", addr, data)
+            strand.submit(_run_request, context, data)
 
+    except WebSocketError as e:
+        logging.warning(f"Protocol error from {addr}: {e}")
+        close_code, close_reason = e.code, str(e)
+    except OSError as e:
+        logging.info(f"Connection to {addr} lost: {e}")
     except Exception as e:
         logging.error(f"Exception handling client {addr}: {e}", exc_info=True)
+        close_code, close_reason = WS_CLOSE_INTERNAL_ERROR, "Internal error"
     finally:
-        if context.authenticated and context.username:
-            with online_users_lock:
-                if online_users.get(context.username) == conn:
-                    del online_users[context.username]
-                    logging.info(
-                        f"User '{context.username}' removed from online users."
-                    )
-        conn.close()
+        # Requests already read still get their replies before the socket closes
+        strand.join()
+        heartbeat.unregister(liveness)
+        _remove_online_user(context)
+        if context.close_code is not None and not peer_closed:
+            close_code, close_reason = context.close_code, context.close_reason
+        elif going_away.is_set() and not peer_closed:
+            close_code, close_reason = WS_CLOSE_GOING_AWAY, "Server restarting"
+        # Once the peer's close frame was read it sends nothing more
+        websocket.close_connection(
+            conn, close_code, close_reason, 0 if peer_closed else WS_CLOSE_TIMEOUT
+        )
+        with open_connections_changed:
+            open_connections.discard(context)
+            open_connections_changed.notify_all()
         logging.info(f"[-] Connection closed for {addr}")
 
 
+def close_all_connections(timeout: float) -> int:
+    """
+    Closes every open connection for a shutdown. Reading stops at once, but
+    requests already read still run and get their replies, then each client
+    gets a 'going away' close frame.
+
+    :param timeout: Seconds to wait for connections to finish on their own
+        before their sockets are shut down in both directions.
+    :type timeout: float
+    :return: The number of connections that had to be cut off.
+    :rtype: int
+    """
+    going_away.set()
+    with open_connections_changed:
+        contexts = list(open_connections)
+    for context in contexts:
+        try:
+            # Wakes the reader; the write side stays open for pending replies
+            context.conn.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+    with open_connections_changed:
+        open_connections_changed.wait_for(lambda: not open_connections, timeout)
+        stuck = list(open_connections)
+    for context in stuck:
+        try:
+            # Fails sends blocked on clients that stopped reading
+            context.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    return len(stuck)
+
+
+def _remove_online_user(context: ClientContext) -> None:
+    """
+    Takes a client's user out of online_users and the online room members,
+    unless the user has since logged in on another connection.
+
+    :param context: The context of the client going offline.
+    :type context: ClientContext
+    :return: None
+    """
+    if context.authenticated and context.username:
+        with online_users_lock:
+            if online_users.get(context.username) == context.conn:
+                del online_users[context.username]
+                _remove_online_room_memberships(context)
+                logging.info(f"User '{context.username}' removed from online users.")
+
+
+def _send_ping(liveness: Liveness) -> None:
+    """
+    Pings a connection from the heartbeat thread without blocking it. The
+    ping is skipped if another frame is being written, which shows the
+    connection is in use, or if the send buffer is full, in which case the
+    peer is not reading and the idle timeout will reap it.
+
+    :param liveness: The connection's liveness record.
+    :type liveness: Liveness
+    :return: None
+    """
+    send_lock = websocket.send_lock(liveness.conn)
+    if not send_lock.acquire(blocking=False):
+        return
+    try:
+        sent = liveness.conn.send(_PING_FRAME, socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return
+    finally:
+        send_lock.release()
+    if sent < len(_PING_FRAME):
+        # Half a frame cannot be taken back; the stream is unusable
+        _reap_connection(liveness)
+
+
+def _reap_connection(liveness: Liveness) -> None:
+    """
+    Closes a connection that stayed silent past the idle timeout. Its user
+    goes offline right away; shutting the socket down wakes the reader
+    thread, which then cleans up as for any closed connection.
+
+    :param liveness: The connection's liveness record.
+    :type liveness: Liveness
+    :return: None
+    """
+    logging.info(f"Reaping idle connection {liveness.owner.addr}")
+    _remove_online_user(liveness.owner)
+    try:
+        liveness.conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed
+
+
+def _run_request(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Runs one request on a worker thread, leaving no request state behind
+    for the next connection served by the same thread.
+
+    :param context: The context of the client that sent the request.
+    :type context: ClientContext
+    :param data: The decoded request.
+    :type data: Dict[str, Any]
+    :return: None
+    """
+    try:
+        dispatch(context, data)
+    except MessageDecodeError as e:
+        # Lazily decoded, so a malformed field may only show up in a handler
+        logging.warning(f"Undecodable message from {context.addr}: {e}")
+        _abort_connection(context, WS_CLOSE_INVALID_PAYLOAD, f"Undecodable message: {e}")
+    except Exception as e:
+        logging.error(f"Request from {context.addr} failed: {e}", exc_info=True)
+        _abort_connection(context, WS_CLOSE_INTERNAL_ERROR, "Internal error")
+    finally:
+        _current_request.conn = None
+
+
+def _abort_connection(context: ClientContext, code: int, reason: str) -> None:
+    """
+    Ends a connection from a worker thread: shutting down the read side
+    wakes its reader, which closes the connection with code once the
+    requests already read have run.
+
+    :param context: The context of the connection to end.
+    :type context: ClientContext
+    :param code: The close status to send.
+    :type code: int
+    :param reason: A short human-readable reason.
+    :type reason: str
+    :return: None
+    """
+    if context.close_code is None:
+        context.close_code, context.close_reason = code, reason
+    try:
+        context.conn.shutdown(socket.SHUT_RD)
+    except OSError:
+        pass  # Already closed
+
+
+def dispatch(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Runs the handler of one request, replying with an error if its action is
+    missing or unknown.
+
+    :param context: The context of the client that sent the request.
+    :type context: ClientContext
+    :param data: The decoded request.
+    :type data: Dict[str, Any]
+    :return: None
+    """
+    _current_request.conn = context.conn
+    _current_request.req_id = data.get("req_id")
+
+    # Check if 'action' is present
+    action = data.get("action")
+    if not action:
+        send_error(context.conn, "Missing 'action' in JSON message.")
+        return
+
+    # Dispatch to the appropriate handler
+    handler = ACTION_HANDLERS.get(action, None)
+    if handler:
+        logging.info(f"Received action: {action}")
+        # Before login, buckets are per IP so reconnecting does not refill them
+        client = context.username if context.authenticated else context.addr[0]
+        retry_after = rate_limiter.check(client, action)
+        if retry_after:
+            send_rate_limited(context.conn, action, retry_after)
+            return
+        try:
+            handler(context, data)
+        except MessageDecodeError:
+            raise  # The connection is closed instead, see _run_request
+        except Exception as e:
+            # Answered like any failed request, so the client is not left waiting
+            logging.error(f"Handler for '{action}' failed: {e}", exc_info=True)
+            send_error(context.conn, f"Failed to handle '{action}'.")
+    else:
+        logging.warning(f"Unknown action: {action}")
+        handle_unknown_action(context, action)
+
+
+def _send_reply(conn: socket.socket, payload_dict: Dict[str, Any]) -> None:
+    """
+    Sends a payload. Replies to the request being handled get its 'req_id',
+    so clients can match pipelined replies to requests, and are collected
+    instead of sent while a batch runs. Pushes to other connections made
+    while handling it are sent untouched.
+
+    :param conn: The socket connection the payload is sent to.
+    :type conn: socket.socket
+    :param payload_dict: The payload to send.
+    :type payload_dict: Dict[str, Any]
+    :return: None
+    """
+    if getattr(_current_request, "conn", None) is conn:
+        req_id = getattr(_current_request, "req_id", None)
+        if req_id is not None:
+            payload_dict["req_id"] = req_id
+        replies = getattr(_current_request, "replies", None)
+        if replies is not None:
+            replies.append(payload_dict)
+            return
+    websocket.send_ws_frame(conn, payload_dict)
+
+
 def send_success(conn: socket.socket, payload_dict: Dict[str, Any] = None) -> None:
     """
     Helper to send a JSON response with status=success.
@@ -118,7 +430,7 @@ def send_success(conn: socket.socket, payload_dict: Dict[str, Any] = None) -> No
     if payload_dict is None:
         payload_dict = {}
     payload_dict["status"] = "success"
-    websocket.send_ws_frame(conn, payload_dict)
+    _send_reply(conn, payload_dict)
 
 
 def send_error(conn: socket.socket, message: str) -> None:
@@ -132,7 +444,79 @@ def send_error(conn: socket.socket, message: str) -> None:
     :return: None
     """
     payload_dict = {"status": "error", "message": message, "action": "error"}
-    websocket.send_ws_frame(conn, payload_dict)
+    _send_reply(conn, payload_dict)
+
+
+def send_rate_limited(conn: socket.socket, action: str, retry_after: float) -> None:
+    """
+    Helper to refuse a request that exceeded its rate limit.
+
+    :param conn: The socket connection to the client.
+    :type conn: socket.socket
+    :param action: The refused action.
+    :type action: str
+    :param retry_after: Seconds until the request would be accepted.
+    :type retry_after: float
+    :return: None
+    """
+    retry_after_ms = math.ceil(retry_after * 1000)
+    payload_dict = {
+        "status": "error",
+        "action": "rate_limited",
+        "message": f"Too many '{action}' requests. Retry in {retry_after_ms} ms.",
+        "limited_action": action,
+        "retry_after_ms": retry_after_ms,
+    }
+    _send_reply(conn, payload_dict)
+
+
+def prepare_success(payload_dict: Dict[str, Any]) -> PreparedFrame:
+    """
+    Helper to encode a status=success response once for several receivers.
+
+    :param payload_dict: Dictionary of data to send.
+    :type payload_dict: Dict[str, Any]
+    :return: The encoded and framed response.
+    :rtype: PreparedFrame
+    """
+    payload_dict["status"] = "success"
+    return websocket.prepare_frame(payload_dict)
+
+
+def push_to_users(usernames: Iterable[str], payload_dict: Dict[str, Any]) -> int:
+    """
+    Pushes a status=success message to every online user in usernames.
+
+    The payload is serialized and framed once, so the cost of a broadcast is
+    one socket write per online receiver. Offline users are skipped, and a
+    failed write to one receiver does not affect the others. Handlers that
+    deliver to more than one user should use this instead of send_success.
+
+    :param usernames: The users to deliver to.
+    :type usernames: Iterable[str]
+    :param payload_dict: Dictionary of data to send.
+    :type payload_dict: Dict[str, Any]
+    :return: The number of users the message was written to.
+    :rtype: int
+    """
+    with online_users_lock:
+        receivers = [
+            (username, online_users[username])
+            for username in usernames
+            if username in online_users
+        ]
+    if not receivers:
+        return 0
+
+    frame = prepare_success(payload_dict)
+    delivered = 0
+    for username, conn in receivers:
+        try:
+            websocket.send_prepared(conn, frame)
+            delivered += 1
+        except Exception as e:
+            logging.info(f"Failed to push message to '{username}': {e}")
+    return delivered
 
 
 def send_recent_messages(conn: socket.socket, messages: List[Dict[str, Any]]) -> None:
@@ -150,6 +534,25 @@ def send_recent_messages(conn: socket.socket, messages: List[Dict[str, Any]]) ->
     send_success(conn, payload)
 
 
+def send_undelivered_messages(context: ClientContext) -> None:
+    """
+    Sends every message not yet acknowledged by the client, oldest first.
+    The client acknowledges them with 'ack_delivered' like live pushes.
+
+    :param context: The context of the authenticated client.
+    :type context: ClientContext
+    :return: None
+    """
+    undelivered = get_undelivered_messages(context.username)
+    if not undelivered:
+        return
+    messages = [
+        {"id": msg_id, "from": sender, "message": content, "timestamp": timestamp}
+        for sender, content, timestamp, msg_id in undelivered
+    ]
+    send_success(context.conn, {"action": "undelivered_messages", "messages": messages})
+
+
 def send_unread_messages(conn: socket.socket, messages: List[Dict[str, Any]]) -> None:
     """
     Sends unread messages to the client after successful login.
@@ -219,6 +622,38 @@ def handle_set_n_unread_messages(context: ClientContext, data: Dict[str, Any]) -
         send_error(context.conn, "Failed to set number of unread messages.")
 
 
+def send_login_bootstrap(context: ClientContext) -> None:
+    """
+    Confirms a login together with the unread messages, recent messages and
+    user list the client would otherwise request one by one, so a login
+    takes a single round trip. Storage reads all three in one transaction.
+
+    Args:
+        context (ClientContext): The context of the client that just logged in.
+
+    Returns:
+        None
+    """
+    unread, recent, users = get_login_bootstrap(context.username)
+    send_success(
+        context.conn,
+        {
+            "action": "login_bootstrap",
+            "message": f"Login successful. Welcome, {context.username}!",
+            "username": context.username,
+            "unread": [
+                {"id": msg_id, "from": sender, "message": content, "timestamp": timestamp}
+                for msg_id, sender, content, timestamp in unread
+            ],
+            "recent": [
+                {"from": sender, "message": content, "timestamp": timestamp, "id": id}
+                for sender, content, receiver, timestamp, id in recent
+            ],
+            "users": users,
+        },
+    )
+
+
 def handle_login(context: ClientContext, data: Dict[str, Any]) -> None:
     """
     Handles the login of an existing user.
@@ -239,21 +674,32 @@ def handle_login(context: ClientContext, data: Dict[str, Any]) -> None:
     if success:
         context.authenticated = True
         context.username = login_username
-        send_success(
-            context.conn,
-            {
-                "message": f"Login successful. Welcome, {context.username}!",
-                "action": "confirm_login",
-                "username": context.username,
-            },
-        )
+        if data.get("bootstrap"):
+            send_login_bootstrap(context)
+        else:
+            send_success(
+                context.conn,
+                {
+                    "message": f"Login successful. Welcome, {context.username}!",
+                    "action": "confirm_login",
+                    "username": context.username,
+                },
+            )
         logging.warning(f"User '{context.username}' authenticated.")
 
         # Add user to online_users
+        context.room_ids = {room_id for room_id, _, _ in get_user_rooms(login_username)}
         with online_users_lock:
             online_users[context.username] = context.conn
+            for room_id in context.room_ids:
+                online_room_members.setdefault(room_id, set()).add(context.username)
             logging.warning(f"User '{context.username}' added to online users.")
 
+        # Replay what was pushed while the user was away, or pushed but never
+        # acknowledged. Messages arriving from now on are pushed live, so one
+        # sent during the replay may come twice; clients dedupe by ID.
+        send_undelivered_messages(context)
+
     else:
         send_error(context.conn, "Invalid username or password.")
 
@@ -301,8 +747,8 @@ def handle_send_message(context: ClientContext, data: Dict[str, Any]) -> None:
         try:
             send_success(receiver_conn, message_payload)
             logging.info(f"Message sent to '{receiver}'.")
-            # Optionally, mark the message as delivered immediately
-            # For simplicity, assuming messages are marked as delivered on login
+            # The message stays undelivered until the receiver acknowledges its
+            # ID, so a push lost with the connection is replayed on next login
         except Exception as e:
             logging.info(f"Failed to send message to '{receiver}': {e}")
             send_error(context.conn, f"Failed to send message to '{receiver}'.")
@@ -324,6 +770,37 @@ def handle_send_message(context: ClientContext, data: Dict[str, Any]) -> None:
     send_success(context.conn, response)
 
 
+def handle_ack_delivered(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles the 'ack_delivered' action: the client confirms it received the
+    pushed messages with the given IDs, which are marked delivered in bulk.
+
+    Acknowledgements are not answered on success, so batching them costs the
+    client one frame and the server one write per batch.
+
+    Args:
+        context (ClientContext): The client's connection context.
+        data (Dict[str, Any]): A dictionary with the received message IDs under 'ids'.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(msg_id, int) for msg_id in ids):
+        send_error(context.conn, "'ids' must be a list of message IDs.")
+        return
+    if len(ids) > ACK_MAX_IDS:
+        send_error(context.conn, f"At most {ACK_MAX_IDS} IDs can be acknowledged at once.")
+        return
+    if ids:
+        count = mark_messages_delivered(context.username, ids)
+        logging.info(f"User '{context.username}' acknowledged {count} message(s).")
+
+
 def handle_mark_as_read(context: ClientContext, data: Dict[str, Any]) -> None:
     """
     Handles the 'mark_as_read' action.
@@ -358,6 +835,45 @@ def handle_mark_as_read(context: ClientContext, data: Dict[str, Any]) -> None:
     )
 
 
+def handle_mark_conversation_read(
+    context: ClientContext, data: Dict[str, Any]
+) -> None:
+    """
+    Handles the 'mark_conversation_read' action, which marks every message
+    from a peer up to 'last_read_id' as read in one update.
+
+    Args:
+        context (ClientContext): The client's connection context.
+        data (Dict[str, Any]): A dictionary containing the peer and the ID of
+            the newest message read.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    peer = data.get("peer")
+    last_read_id = data.get("last_read_id")
+    if not peer:
+        send_error(context.conn, "Peer username is required.")
+        return
+    if not isinstance(last_read_id, int):
+        send_error(context.conn, "Invalid message ID format.")
+        return
+
+    mark_conversation_read(context.username, peer, last_read_id)
+    send_success(
+        context.conn,
+        {
+            "message": "Conversation marked as read.",
+            "action": "confirm_mark_conversation_read",
+            "peer": peer,
+        },
+    )
+
+
 def handle_delete_account(context: ClientContext, data: Dict[str, Any]) -> None:
     """
     Handles the 'delete_account' action.
@@ -379,12 +895,58 @@ def handle_delete_account(context: ClientContext, data: Dict[str, Any]) -> None:
         with online_users_lock:
             if online_users.get(context.username) == context.conn:
                 del online_users[context.username]
+                _remove_online_room_memberships(context)
                 logging.info(f"User '{context.username}' removed from online users.")
         context.conn.close()
     else:
         send_error(context.conn, "Failed to delete account.")
 
 
+def handle_batch(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles the 'batch' action: runs each sub-request in order through
+    ACTION_HANDLERS and answers with one 'batch_response' frame holding
+    their replies in order. Sub-requests without a reply, like
+    'ack_delivered', add none, so clients match replies by their 'req_id'.
+    Pushes to other users are sent as usual.
+
+    Args:
+        context (ClientContext): The client's connection context.
+        data (Dict[str, Any]): A dictionary with the sub-requests under 'requests'.
+
+    Returns:
+        None
+    """
+    requests = data.get("requests")
+    # Lazily decoded batches arrive as a ListView of MessageViews
+    if (
+        isinstance(requests, str)
+        or not isinstance(requests, Sequence)
+        or not all(isinstance(request, Mapping) for request in requests)
+    ):
+        send_error(context.conn, "'requests' must be a list of requests.")
+        return
+    if len(requests) > BATCH_MAX_REQUESTS:
+        send_error(
+            context.conn, f"At most {BATCH_MAX_REQUESTS} requests can be batched."
+        )
+        return
+    if any(request.get("action") == "batch" for request in requests):
+        send_error(context.conn, "Batches cannot be nested.")
+        return
+
+    batch_req_id = data.get("req_id")
+    replies: List[Dict[str, Any]] = []
+    _current_request.replies = replies
+    try:
+        for request in requests:
+            dispatch(context, request)
+    finally:
+        _current_request.replies = None
+        _current_request.req_id = batch_req_id
+    send_success(context.conn, {"action": "batch_response", "responses": replies})
+
+
 def handle_unknown_action(context: ClientContext, action: str) -> None:
     """
     Handles an unknown action by sending an error message.
@@ -563,11 +1125,542 @@ def handle_get_users(context: ClientContext, data: Dict[str, Any]) -> None:
     send_success(context.conn, {"action": "user_list", "users": users})
 
 
+def handle_search_users(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request for usernames starting with a prefix, e.g. to
+    autocomplete a recipient without fetching the whole user list.
+
+    The response carries the user directory 'version', which changes
+    whenever a user registers or deletes their account.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the 'prefix' and an
+            optional 'limit'.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    prefix = data.get("prefix") or ""
+    limit = data.get("limit") or USER_SEARCH_DEFAULT_LIMIT
+    if not isinstance(prefix, str) or not isinstance(limit, int) or limit < 0:
+        send_error(context.conn, "Invalid user search.")
+        return
+
+    users, version = search_users(
+        prefix, min(limit, USER_SEARCH_MAX_LIMIT), exclude=context.username
+    )
+    send_success(
+        context.conn,
+        {"action": "user_search", "prefix": prefix, "users": users, "version": version},
+    )
+
+
+def handle_search_messages(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a full-text search over the messages the caller sent or received.
+
+    Results are ranked best match first with the matched words bracketed in
+    each 'snippet'. The response's 'next_cursor' is passed back as 'cursor'
+    to fetch the next page; it is empty after the last page.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the search 'query' and
+            optional 'cursor' and 'limit'.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    query = data.get("query")
+    cursor = data.get("cursor") or ""
+    limit = data.get("limit") or MESSAGE_SEARCH_DEFAULT_LIMIT
+    if not isinstance(query, str) or not query.strip():
+        send_error(context.conn, "Search query is required.")
+        return
+    if not isinstance(cursor, str) or not isinstance(limit, int) or limit < 0:
+        send_error(context.conn, "Invalid search request.")
+        return
+
+    try:
+        rows, next_cursor = search_messages(
+            context.username, query, cursor, min(limit, MESSAGE_SEARCH_MAX_LIMIT)
+        )
+    except ValueError as e:
+        send_error(context.conn, str(e))
+        return
+
+    send_success(
+        context.conn,
+        {
+            "action": "search_results",
+            "query": query,
+            "results": [
+                {
+                    "id": message_id,
+                    "from": sender,
+                    "to": receiver,
+                    "snippet": snippet,
+                    "timestamp": timestamp,
+                }
+                for message_id, sender, receiver, snippet, timestamp in rows
+            ],
+            "next_cursor": next_cursor,
+        },
+    )
+
+
+def handle_get_conversation(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request for a page of the caller's conversation with one peer.
+
+    Pages are walked backwards with 'before_id'; the response carries
+    'next_before_id' for the next page, or 0 once the start is reached.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the peer and optional
+            'before_id' and 'limit'.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    peer = data.get("peer")
+    if not peer:
+        send_error(context.conn, "Peer username is required.")
+        return
+    limit = _parse_page_limit(context, data)
+    if limit is None:
+        return
+    before_id = _parse_before_id(context, data)
+    if before_id is None:
+        return
+
+    conversation_id = get_conversation_id(context.username, peer)
+    rows = []
+    if conversation_id is not None:
+        rows = get_conversation_messages(
+            conversation_id, before_id=before_id or None, limit=limit
+        )
+    messages = [
+        {"id": msg_id, "from": sender, "message": content, "timestamp": timestamp}
+        for msg_id, sender, content, timestamp in rows
+    ]
+    send_success(
+        context.conn,
+        {
+            "action": "conversation",
+            "peer": peer,
+            "conversation_id": conversation_id or 0,
+            "messages": messages,
+            "next_before_id": rows[0][0] if rows and len(rows) == limit else 0,
+        },
+    )
+
+
+def handle_list_conversations(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request for the caller's conversations, most recently active
+    first, each with its last message and the caller's unread count.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing an optional 'limit'.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+    limit = _parse_page_limit(context, data)
+    if limit is None:
+        return
+
+    conversations = [
+        {
+            "conversation_id": conversation_id,
+            "peer": peer,
+            "last_message_id": last_id,
+            "last_from": last_sender,
+            "last_message": last_content,
+            "last_timestamp": last_timestamp,
+            "unread_count": unread_count,
+        }
+        for (
+            conversation_id,
+            peer,
+            last_id,
+            last_sender,
+            last_content,
+            last_timestamp,
+            unread_count,
+        ) in list_conversations(context.username, limit=limit)
+    ]
+    send_success(
+        context.conn,
+        {"action": "conversation_list", "conversations": conversations},
+    )
+
+
+def _remove_online_room_memberships(context: ClientContext) -> None:
+    """
+    Drops a user from the online member sets of their rooms.
+    Must be called with online_users_lock held.
+
+    :param context: The context of the client going offline.
+    :type context: ClientContext
+    :return: None
+    """
+    for room_id in context.room_ids:
+        members = online_room_members.get(room_id)
+        if members:
+            members.discard(context.username)
+            if not members:
+                del online_room_members[room_id]
+
+
+def _parse_page_limit(context: ClientContext, data: Dict[str, Any]) -> Optional[int]:
+    """
+    Reads the optional page size of a paged history request.
+
+    :param context: The client connection context.
+    :type context: ClientContext
+    :param data: The request data, optionally containing an integer 'limit'.
+    :type data: Dict[str, Any]
+    :return: The page size capped at HISTORY_MAX_LIMIT, or None if an error response was sent.
+    :rtype: Optional[int]
+    """
+    limit = data.get("limit") or HISTORY_DEFAULT_LIMIT
+    if not isinstance(limit, int) or limit < 0:
+        send_error(context.conn, "Invalid history limit.")
+        return None
+    return min(limit, HISTORY_MAX_LIMIT)
+
+
+def _parse_before_id(context: ClientContext, data: Dict[str, Any]) -> Optional[int]:
+    """
+    Reads the optional message ID a paged history request starts before.
+
+    :param context: The client connection context.
+    :type context: ClientContext
+    :param data: The request data, optionally containing a positive integer
+        'before_id'.
+    :type data: Dict[str, Any]
+    :return: The message ID, 0 to start from the newest message (also what
+        the custom protocol sends when it is unset), or None if an error
+        response was sent.
+    :rtype: Optional[int]
+    """
+    before_id = data.get("before_id") or 0
+    if not isinstance(before_id, int) or isinstance(before_id, bool) or before_id < 0:
+        send_error(context.conn, "Invalid 'before_id'.")
+        return None
+    return before_id
+
+
+def _parse_room_id(context: ClientContext, data: Dict[str, Any]) -> Optional[int]:
+    """
+    Validates the common preconditions of room actions.
+
+    :param context: The client connection context.
+    :type context: ClientContext
+    :param data: The request data, expected to contain an integer 'room_id'.
+    :type data: Dict[str, Any]
+    :return: The room ID, or None if an error response was sent.
+    :rtype: Optional[int]
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return None
+    room_id = data.get("room_id")
+    if not isinstance(room_id, int):
+        send_error(context.conn, "Invalid room ID format.")
+        return None
+    return room_id
+
+
+def handle_create_room(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request to create a group chat or broadcast channel.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room name and kind.
+
+    Returns:
+        None
+    """
+    if not context.authenticated:
+        send_error(context.conn, "Authentication required. Please log in first.")
+        return
+
+    name = data.get("name")
+    kind = data.get("kind") or "group"
+    if not name:
+        send_error(context.conn, "Room name is required.")
+        return
+    if kind not in ROOM_KINDS:
+        send_error(context.conn, f"Room kind must be one of {', '.join(ROOM_KINDS)}.")
+        return
+
+    room_id = create_room(name, context.username, kind)
+    if room_id is None:
+        send_error(context.conn, f"Room '{name}' already exists.")
+        return
+
+    context.room_ids.add(room_id)
+    with online_users_lock:
+        online_room_members.setdefault(room_id, set()).add(context.username)
+    send_success(
+        context.conn,
+        {
+            "action": "confirm_create_room",
+            "room_id": room_id,
+            "name": name,
+            "kind": kind,
+            "message": f"Room '{name}' created.",
+        },
+    )
+
+
+def handle_join_room(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request to join a room.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room ID.
+
+    Returns:
+        None
+    """
+    room_id = _parse_room_id(context, data)
+    if room_id is None:
+        return
+
+    room = get_room(room_id)
+    if not room:
+        send_error(context.conn, "Room not found.")
+        return
+
+    add_room_member(room_id, context.username)
+    context.room_ids.add(room_id)
+    with online_users_lock:
+        online_room_members.setdefault(room_id, set()).add(context.username)
+    _, name, _, kind = room
+    send_success(
+        context.conn,
+        {
+            "action": "confirm_join_room",
+            "room_id": room_id,
+            "name": name,
+            "kind": kind,
+            "message": f"Joined room '{name}'.",
+        },
+    )
+
+
+def handle_leave_room(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request to leave a room.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room ID.
+
+    Returns:
+        None
+    """
+    room_id = _parse_room_id(context, data)
+    if room_id is None:
+        return
+
+    if not remove_room_member(room_id, context.username):
+        send_error(context.conn, "You are not a member of this room.")
+        return
+
+    context.room_ids.discard(room_id)
+    with online_users_lock:
+        members = online_room_members.get(room_id)
+        if members:
+            members.discard(context.username)
+            if not members:
+                del online_room_members[room_id]
+    send_success(
+        context.conn,
+        {"action": "confirm_leave_room", "room_id": room_id, "message": "Left room."},
+    )
+
+
+def handle_send_room_message(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a message to a room. The message is stored once and pushed,
+    encoded once, to the members that are currently online.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room ID and message.
+
+    Returns:
+        None
+    """
+    room_id = _parse_room_id(context, data)
+    if room_id is None:
+        return
+
+    message_text: str = data.get("message", "")
+    if not message_text:
+        send_error(context.conn, "Empty message cannot be sent.")
+        return
+    if room_id not in context.room_ids:
+        send_error(context.conn, "You are not a member of this room.")
+        return
+
+    room = get_room(room_id)
+    if not room:
+        send_error(context.conn, "Room not found.")
+        return
+    _, name, owner, kind = room
+    if kind == "channel" and owner != context.username:
+        send_error(context.conn, "Only the channel owner can post to a channel.")
+        return
+
+    id: int = insert_room_message(room_id, context.username, message_text)
+    timestamp = datetime.utcnow().isoformat() + "Z"
+
+    with online_users_lock:
+        receivers = [
+            username
+            for username in online_room_members.get(room_id, ())
+            if username != context.username
+        ]
+    delivered = push_to_users(
+        receivers,
+        {
+            "action": "received_room_message",
+            "room_id": room_id,
+            "id": id,
+            "from": context.username,
+            "message": message_text,
+            "timestamp": timestamp,
+        },
+    )
+    logging.info(f"Room message {id} pushed to {delivered} online member(s).")
+
+    send_success(
+        context.conn,
+        {
+            "action": "confirm_send_room_message",
+            "room_id": room_id,
+            "id": id,
+            "message": message_text,
+            "timestamp": timestamp,
+        },
+    )
+
+
+def handle_get_room_history(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request for a page of a room's history.
+
+    Pages are walked backwards with 'before_id'; the response carries
+    'next_before_id' for the next page, or 0 once the start is reached.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room ID and
+            optional 'before_id' and 'limit'.
+
+    Returns:
+        None
+    """
+    room_id = _parse_room_id(context, data)
+    if room_id is None:
+        return
+    if room_id not in context.room_ids:
+        send_error(context.conn, "You are not a member of this room.")
+        return
+
+    limit = _parse_page_limit(context, data)
+    if limit is None:
+        return
+
+    before_id = _parse_before_id(context, data)
+    if before_id is None:
+        return
+    rows = get_room_history(room_id, before_id=before_id or None, limit=limit)
+    messages = [
+        {"id": msg_id, "from": sender, "message": content, "timestamp": timestamp}
+        for msg_id, sender, content, timestamp in rows
+    ]
+    send_success(
+        context.conn,
+        {
+            "action": "room_history",
+            "room_id": room_id,
+            "messages": messages,
+            "next_before_id": rows[0][0] if len(rows) == limit else 0,
+            "last_read_id": get_room_read_cursor(room_id, context.username) or 0,
+        },
+    )
+
+
+def handle_mark_room_read(context: ClientContext, data: Dict[str, Any]) -> None:
+    """
+    Handles a request to advance the caller's read cursor in a room.
+
+    Args:
+        context (ClientContext): The client connection context.
+        data (Dict[str, Any]): A dictionary containing the room ID and the
+            ID of the newest message read.
+
+    Returns:
+        None
+    """
+    room_id = _parse_room_id(context, data)
+    if room_id is None:
+        return
+    if room_id not in context.room_ids:
+        send_error(context.conn, "You are not a member of this room.")
+        return
+
+    last_read_id = data.get("last_read_id")
+    if not isinstance(last_read_id, int):
+        send_error(context.conn, "Invalid message ID format.")
+        return
+
+    mark_room_read(room_id, context.username, last_read_id)
+    send_success(
+        context.conn,
+        {
+            "action": "confirm_mark_room_read",
+            "room_id": room_id,
+            "message": "Room marked as read.",
+        },
+    )
+
+
 ACTION_HANDLERS = {
+    "batch": handle_batch,
     "register": handle_register,
     "login": handle_login,
     "send_message": handle_send_message,
+    "ack_delivered": handle_ack_delivered,
     "mark_as_read": handle_mark_as_read,
+    "mark_conversation_read": handle_mark_conversation_read,
     "delete_account": handle_delete_account,
     "set_n_unread_messages": handle_set_n_unread_messages,
     "echo": handle_echo,
@@ -575,4 +1668,23 @@ ACTION_HANDLERS = {
     "get_recent_messages": handle_recent_messages,
     "delete_message": handle_delete_message,
     "get_users": handle_get_users,
+    "search_users": handle_search_users,
+    "search_messages": handle_search_messages,
+    "get_conversation": handle_get_conversation,
+    "list_conversations": handle_list_conversations,
+    "create_room": handle_create_room,
+    "join_room": handle_join_room,
+    "leave_room": handle_leave_room,
+    "send_room_message": handle_send_room_message,
+    "get_room_history": handle_get_room_history,
+    "mark_room_read": handle_mark_room_read,
 }
+
+# Pings silent connections and reaps dead ones; server.main starts its thread
+heartbeat = Heartbeat(send_ping=_send_ping, on_reap=_reap_connection)
+
+# Per-client, per-action request budgets, checked by dispatch
+rate_limiter = RateLimiter()
+
+# Runs handlers off the connection threads, bounding concurrent storage work
+worker_pool = WorkerPool()
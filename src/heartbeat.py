@@ -0,0 +1,264 @@
+# heartbeat.py
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+import metrics
+
+# Seconds of silence after which a connection is pinged; 0 disables pings
+PING_INTERVAL = float(os.environ.get("PING_INTERVAL", "30"))
+# Seconds of silence after which a connection is closed; 0 disables reaping
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", "90"))
+# Timer wheel resolution in seconds; checks run up to one tick late
+HEARTBEAT_TICK = float(os.environ.get("HEARTBEAT_TICK", "1"))
+# Slots per wheel revolution; longer delays wait out whole revolutions
+WHEEL_SLOTS = 512
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel. Scheduling and expiring a timer cost O(1) however
+    many are pending, so one thread can time every connection.
+
+    Timers cannot be cancelled; owners skip stale ones when they fire. Not
+    thread-safe: callers hold a lock.
+    """
+
+    def __init__(self, tick: float, slots: int = WHEEL_SLOTS, now: float = 0.0) -> None:
+        """
+        Initializes the TimerWheel object.
+
+        :param tick: Seconds covered by one slot.
+        :param slots: Slots per revolution.
+        :param now: The current time, from the clock later passed to advance.
+        """
+        self.tick = tick
+        # Each entry is [remaining revolutions, item]
+        self._slots: List[List[list]] = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._time = now
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, item: Any, deadline: float) -> None:
+        """
+        Schedules item to be returned by the first advance reaching deadline.
+
+        Args:
+            item (Any): The item to expire.
+            deadline (float): When it expires; past deadlines expire next tick.
+        """
+        ticks = max(1, math.ceil((deadline - self._time) / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot].append([(ticks - 1) // len(self._slots), item])
+        self._count += 1
+
+    def advance(self, now: float) -> List[Any]:
+        """
+        Moves the wheel forward to now.
+
+        Args:
+            now (float): The current time.
+
+        Returns:
+            List[Any]: The items whose deadline passed, in no particular order.
+        """
+        expired = []
+        while self._time + self.tick <= now:
+            self._time += self.tick
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            entries = self._slots[self._cursor]
+            if not entries:
+                continue
+            waiting = []
+            for entry in entries:
+                if entry[0]:
+                    entry[0] -= 1
+                    waiting.append(entry)
+                else:
+                    expired.append(entry[1])
+            self._slots[self._cursor] = waiting
+        self._count -= len(expired)
+        return expired
+
+
+class Liveness:
+    """
+    Liveness of one connection. Its reader thread calls Heartbeat.touch on
+    every frame, which is a single attribute store.
+    """
+
+    __slots__ = ("conn", "owner", "last_seen", "pinged_at", "closed")
+
+    def __init__(self, conn: Any, owner: Any, now: float) -> None:
+        self.conn = conn
+        self.owner = owner
+        self.last_seen = now
+        self.pinged_at = -math.inf
+        self.closed = False
+
+
+class Heartbeat:
+    """
+    Pings connections that have been silent for ping_interval seconds and
+    reaps those silent for idle_timeout seconds, from one thread and one
+    timer wheel for all connections.
+
+    Frames do not move timers: a timer that fires for a connection that was
+    heard from meanwhile is simply rescheduled from its last activity.
+    """
+
+    def __init__(
+        self,
+        ping_interval: float = PING_INTERVAL,
+        idle_timeout: float = IDLE_TIMEOUT,
+        tick: float = HEARTBEAT_TICK,
+        send_ping: Optional[Callable[[Liveness], None]] = None,
+        on_reap: Optional[Callable[[Liveness], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Initializes the Heartbeat object.
+
+        :param ping_interval: Seconds of silence before each ping; 0 disables pings.
+        :param idle_timeout: Seconds of silence before reaping; 0 disables reaping.
+        :param tick: Timer wheel resolution in seconds.
+        :param send_ping: Sends a ping on a connection; must not block.
+        :param on_reap: Closes a connection that timed out.
+        :param clock: Monotonic time source.
+        """
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.send_ping = send_ping
+        self.on_reap = on_reap
+        self._clock = clock
+        self._wheel = TimerWheel(tick, now=clock())
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ping_interval > 0 or self.idle_timeout > 0
+
+    def register(self, conn: Any, owner: Any = None) -> Liveness:
+        """
+        Starts tracking a connection.
+
+        Args:
+            conn (Any): The connection.
+            owner (Any): Passed along to the callbacks, e.g. the client context.
+
+        Returns:
+            Liveness: The record to touch on activity and unregister on close.
+        """
+        liveness = Liveness(conn, owner, self._clock())
+        deadline = self._next_check(liveness)
+        if deadline is not None:
+            with self._lock:
+                self._wheel.schedule(liveness, deadline)
+                metrics.set_gauge("heartbeat.tracked", len(self._wheel))
+        return liveness
+
+    def touch(self, liveness: Liveness) -> None:
+        """
+        Records activity on a connection.
+        """
+        liveness.last_seen = self._clock()
+
+    @staticmethod
+    def unregister(liveness: Liveness) -> None:
+        """
+        Stops tracking a connection; its timer is dropped when it fires.
+        """
+        liveness.closed = True
+
+    def _next_check(self, liveness: Liveness) -> Optional[float]:
+        """
+        Returns when the connection next needs a look, or None if never.
+        """
+        deadlines = []
+        if self.idle_timeout > 0:
+            deadlines.append(liveness.last_seen + self.idle_timeout)
+        if self.ping_interval > 0:
+            deadlines.append(max(liveness.last_seen, liveness.pinged_at) + self.ping_interval)
+        return min(deadlines) if deadlines else None
+
+    def run_once(self) -> None:
+        """
+        Pings and reaps the connections whose timers expired, then
+        reschedules those still alive.
+        """
+        now = self._clock()
+        with self._lock:
+            expired = self._wheel.advance(now)
+
+        pings: List[Liveness] = []
+        reaped: List[Liveness] = []
+        for liveness in expired:
+            if liveness.closed:
+                continue
+            silence = now - liveness.last_seen
+            if self.idle_timeout > 0 and silence >= self.idle_timeout:
+                liveness.closed = True
+                reaped.append(liveness)
+            elif (
+                self.ping_interval > 0
+                and silence >= self.ping_interval
+                and now - liveness.pinged_at >= self.ping_interval
+            ):
+                liveness.pinged_at = now
+                pings.append(liveness)
+
+        with self._lock:
+            for liveness in expired:
+                if not liveness.closed:
+                    self._wheel.schedule(liveness, self._next_check(liveness))
+            metrics.set_gauge("heartbeat.tracked", len(self._wheel))
+
+        # Callbacks run outside the lock; a slow socket must not stall registration
+        for liveness in pings:
+            try:
+                if self.send_ping is not None:
+                    self.send_ping(liveness)
+            except Exception as e:
+                logging.info(f"Ping failed: {e}")
+        for liveness in reaped:
+            try:
+                if self.on_reap is not None:
+                    self.on_reap(liveness)
+            except Exception as e:
+                logging.error(f"Reaping an idle connection failed: {e}")
+        metrics.increment("heartbeat.pings", len(pings))
+        metrics.increment("heartbeat.reaped", len(reaped))
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._wheel.tick):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Heartbeat run failed: {e}")
+
+    def start(self) -> Optional[threading.Thread]:
+        """
+        Starts the background heartbeat thread, unless pings and reaping are
+        both disabled or it already runs.
+
+        Returns:
+            Optional[threading.Thread]: The thread, or None if disabled.
+        """
+        if not self.enabled:
+            return None
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,80 @@
+# maintenance.py
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import metrics
+from storage import get_storage
+
+# Read messages older than this many days move to the archive; 0 disables archiving
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "90"))
+# Seconds between maintenance runs
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", "3600"))
+# Free pages released per run, so a run never stalls writers for long
+VACUUM_PAGES_PER_RUN = int(os.environ.get("VACUUM_PAGES_PER_RUN", "2000"))
+
+
+def run_maintenance(
+    retention_days: int = RETENTION_DAYS, vacuum_pages: int = VACUUM_PAGES_PER_RUN
+) -> int:
+    """
+    Runs one maintenance pass on the active storage engine: archives old
+    read messages, then compacts what is left.
+
+    Args:
+        retention_days (int): The retention period in days; 0 skips archiving.
+        vacuum_pages (int): The most free pages to release; 0 releases all.
+
+    Returns:
+        int: The number of messages archived.
+    """
+    started = time.monotonic()
+    storage = get_storage()
+    archived = storage.archive_read_messages(retention_days) if retention_days > 0 else 0
+    storage.compact(vacuum_pages)
+
+    metrics.increment("maintenance.runs")
+    metrics.increment("maintenance.archived_messages", archived)
+    metrics.set_gauge("maintenance.last_run_seconds", time.monotonic() - started)
+    return archived
+
+
+class MaintenanceThread(threading.Thread):
+    """
+    Daemon thread that runs maintenance every 'interval' seconds until stopped.
+    """
+
+    def __init__(self, interval: int = MAINTENANCE_INTERVAL) -> None:
+        super().__init__(name="maintenance", daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                run_maintenance()
+            except Exception as e:
+                # A failed run is retried on the next interval
+                logging.error(f"Maintenance run failed: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def start_maintenance(interval: int = MAINTENANCE_INTERVAL) -> Optional[MaintenanceThread]:
+    """
+    Starts the background maintenance thread.
+
+    Args:
+        interval (int): Seconds between runs; 0 disables maintenance.
+
+    Returns:
+        Optional[MaintenanceThread]: The started thread, or None if disabled.
+    """
+    if interval <= 0:
+        return None
+    thread = MaintenanceThread(interval)
+    thread.start()
+    return thread
@@ -0,0 +1,469 @@
+# memory_storage.py
+import bisect
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from storage import Storage
+
+_WORD = re.compile(r"\w+")
+
+
+class _Message:
+    """
+    A stored direct message.
+    """
+
+    __slots__ = (
+        "id",
+        "sender",
+        "receiver",
+        "content",
+        "timestamp",
+        "read",
+        "delivered",
+        "conversation_id",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        sender: str,
+        receiver: str,
+        content: str,
+        timestamp: str,
+        conversation_id: int,
+    ) -> None:
+        self.id = id
+        self.sender = sender
+        self.receiver = receiver
+        self.content = content
+        self.timestamp = timestamp
+        self.read = False
+        self.delivered = False
+        self.conversation_id = conversation_id
+
+
+def _remove_id(ids: List[int], message_id: int) -> None:
+    """
+    Removes an ID from a sorted list of IDs, if present.
+    """
+    index = bisect.bisect_left(ids, message_id)
+    if index < len(ids) and ids[index] == message_id:
+        del ids[index]
+
+
+class MemoryStorage(Storage):
+    """
+    Storage engine that keeps everything in process memory.
+
+    Messages live in a dict by ID with sorted ID lists as indexes: per
+    conversation, per participant and per receiver for unread and
+    undelivered messages. Nothing is persisted, which makes it suited to
+    tests and to profiling the network and codec layers in isolation.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the MemoryStorage object.
+        """
+        self._lock = threading.RLock()
+        # Users: username -> [password_hash, n_unread_messages]
+        self._users: Dict[str, list] = {}
+        self._usernames: List[str] = []  # Sorted, for prefix search
+        self._users_version = 0
+
+        self._messages: Dict[int, _Message] = {}
+        self._next_message_id = 1
+        self._by_user: Dict[str, List[int]] = {}
+        self._unread: Dict[str, List[int]] = {}
+        self._undelivered: Dict[str, List[int]] = {}
+
+        # Conversations: (user_a, user_b) -> id, and per id its pair and message IDs
+        self._conversation_ids: Dict[Tuple[str, str], int] = {}
+        self._conversation_pairs: Dict[int, Tuple[str, str]] = {}
+        self._conversation_messages: Dict[int, List[int]] = {}
+        self._user_conversations: Dict[str, Set[int]] = {}
+
+        # Rooms: id -> (id, name, owner, kind)
+        self._rooms: Dict[int, Tuple[int, str, str, str]] = {}
+        self._room_names: Set[str] = set()
+        self._room_members: Dict[int, Dict[str, int]] = {}  # room -> member -> cursor
+        self._room_messages: Dict[int, List[Tuple[int, str, str, str]]] = {}
+        self._next_room_message_id = 1
+
+    @staticmethod
+    def _timestamp() -> str:
+        return datetime.utcnow().isoformat() + "Z"  # UTC time in ISO format
+
+    # Users
+
+    def create_user(self, username: str, password_hash: str) -> bool:
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = [password_hash, 0]
+            bisect.insort(self._usernames, username)
+            self._users_version += 1
+            return True
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        with self._lock:
+            user = self._users.get(username)
+            return user[0] if user else None
+
+    def delete_user(self, username: str) -> bool:
+        with self._lock:
+            if self._users.pop(username, None) is None:
+                return False
+            del self._usernames[bisect.bisect_left(self._usernames, username)]
+            self._users_version += 1
+
+            for message_id in list(self._by_user.get(username, [])):
+                message = self._messages.get(message_id)
+                if message is not None and message.sender == username:
+                    self._delete_message(message)
+            for conversation_id in self._user_conversations.pop(username, set()):
+                pair = self._conversation_pairs.pop(conversation_id)
+                self._conversation_ids.pop(pair, None)
+                self._conversation_messages.pop(conversation_id, None)
+                for user in pair:
+                    if user != username:
+                        self._user_conversations.get(user, set()).discard(conversation_id)
+            for members in self._room_members.values():
+                members.pop(username, None)
+            return True
+
+    def get_user_info(self, username: str) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            user = self._users.get(username)
+            return (username, user[1]) if user else None
+
+    def set_n_unread_messages(self, username: str, n_unread_messages: int) -> bool:
+        with self._lock:
+            if username in self._users:
+                self._users[username][1] = n_unread_messages
+            return True
+
+    def get_all_users_except(self, username: str) -> List[str]:
+        with self._lock:
+            return [user for user in self._usernames if user != username]
+
+    def search_users(
+        self, prefix: str, limit: int = 20, exclude: Optional[str] = None
+    ) -> Tuple[List[str], int]:
+        with self._lock:
+            matches = []
+            index = bisect.bisect_left(self._usernames, prefix)
+            while index < len(self._usernames) and len(matches) < limit:
+                username = self._usernames[index]
+                if not username.startswith(prefix):
+                    break
+                if username != exclude:
+                    matches.append(username)
+                index += 1
+            return matches, self._users_version
+
+    # Direct messages
+
+    def _conversation(self, user1: str, user2: str) -> int:
+        """
+        Returns the ID of the conversation between two users, creating it if
+        needed. Caller holds the lock.
+        """
+        pair = (user1, user2) if user1 <= user2 else (user2, user1)
+        conversation_id = self._conversation_ids.get(pair)
+        if conversation_id is None:
+            conversation_id = len(self._conversation_pairs) + 1
+            while conversation_id in self._conversation_pairs:
+                conversation_id += 1
+            self._conversation_ids[pair] = conversation_id
+            self._conversation_pairs[conversation_id] = pair
+            self._conversation_messages[conversation_id] = []
+            for user in pair:
+                self._user_conversations.setdefault(user, set()).add(conversation_id)
+        return conversation_id
+
+    def insert_message(self, sender: str, content: str, receiver: str) -> int:
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            conversation_id = self._conversation(sender, receiver)
+            self._messages[message_id] = _Message(
+                message_id, sender, receiver, content, self._timestamp(), conversation_id
+            )
+            # IDs only grow, so appending keeps every index sorted
+            self._conversation_messages[conversation_id].append(message_id)
+            self._by_user.setdefault(sender, []).append(message_id)
+            if receiver != sender:
+                self._by_user.setdefault(receiver, []).append(message_id)
+            self._unread.setdefault(receiver, []).append(message_id)
+            self._undelivered.setdefault(receiver, []).append(message_id)
+            return message_id
+
+    def get_recent_messages(
+        self, user_id: str, limit: int = 50
+    ) -> List[Tuple[str, str, str, str, int]]:
+        with self._lock:
+            rows = []
+            for message_id in reversed(self._by_user.get(user_id, [])):
+                if len(rows) >= limit:
+                    break
+                message = self._messages[message_id]
+                if message.read:
+                    rows.append(
+                        (message.sender, message.content, message.receiver, message.timestamp, message.id)
+                    )
+            return rows[::-1]
+
+    def get_unread_messages(
+        self, user_id: str, limit: int = 20
+    ) -> List[Tuple[int, str, str, str]]:
+        with self._lock:
+            return [
+                (m.id, m.sender, m.content, m.timestamp)
+                for m in (self._messages[i] for i in self._unread.get(user_id, [])[:limit])
+            ]
+
+    def get_undelivered_messages(self, user_id: str) -> List[Tuple[str, str, str, int]]:
+        with self._lock:
+            return [
+                (m.sender, m.content, m.timestamp, m.id)
+                for m in (self._messages[i] for i in self._undelivered.get(user_id, []))
+            ]
+
+    def mark_messages_delivered(
+        self, user_id: str, message_ids: Optional[List[int]] = None
+    ) -> int:
+        with self._lock:
+            undelivered = self._undelivered.get(user_id, [])
+            if message_ids is None:
+                delivered, undelivered[:] = list(undelivered), []
+            else:
+                delivered = []
+                for message_id in message_ids:
+                    index = bisect.bisect_left(undelivered, message_id)
+                    if index < len(undelivered) and undelivered[index] == message_id:
+                        delivered.append(undelivered.pop(index))
+            for message_id in delivered:
+                self._messages[message_id].delivered = True
+            return len(delivered)
+
+    def _mark_read(self, message: _Message) -> None:
+        """
+        Marks one message read. Caller holds the lock.
+        """
+        if not message.read:
+            message.read = True
+            _remove_id(self._unread.get(message.receiver, []), message.id)
+
+    def get_login_bootstrap(
+        self, username: str, default_limit: int = 50
+    ) -> Tuple[List[Tuple[int, str, str, str]], List[Tuple[str, str, str, str, int]], List[str]]:
+        # The lock is reentrant: one hold makes the three reads consistent
+        with self._lock:
+            return super().get_login_bootstrap(username, default_limit)
+
+    def mark_messages_as_read(self, message_ids: List[int]) -> None:
+        with self._lock:
+            for message_id in message_ids:
+                message = self._messages.get(message_id)
+                if message is not None:
+                    self._mark_read(message)
+
+    def mark_conversation_read(self, username: str, peer: str, last_read_id: int) -> None:
+        with self._lock:
+            unread = self._unread.get(username, [])
+            end = bisect.bisect_right(unread, last_read_id)
+            for message_id in unread[:end]:
+                message = self._messages[message_id]
+                if message.sender == peer:
+                    self._mark_read(message)
+
+    def _delete_message(self, message: _Message) -> None:
+        """
+        Removes a message from the store and every index. Caller holds the lock.
+        """
+        del self._messages[message.id]
+        for index in (
+            self._conversation_messages.get(message.conversation_id, []),
+            self._by_user.get(message.sender, []),
+            self._by_user.get(message.receiver, []),
+            self._unread.get(message.receiver, []),
+            self._undelivered.get(message.receiver, []),
+        ):
+            _remove_id(index, message.id)
+
+    def delete_message(self, message_id: int) -> bool:
+        with self._lock:
+            message = self._messages.get(message_id)
+            if message is not None:
+                self._delete_message(message)
+            return True
+
+    def search_messages(
+        self, username: str, text: str, cursor: str = "", limit: int = 20
+    ) -> Tuple[List[Tuple[int, str, str, str, str]], str]:
+        terms = {word.lower() for word in text.split()}
+        if not terms or limit <= 0:
+            return [], ""
+        after = (float("-inf"), 0)
+        if cursor:
+            try:
+                rank_text, id_text = cursor.split(":")
+                after = (float(rank_text), int(id_text))
+            except ValueError:
+                raise ValueError("Invalid search cursor.")
+
+        with self._lock:
+            matches = []
+            for message_id in self._by_user.get(username, []):
+                message = self._messages[message_id]
+                words = [word.lower() for word in _WORD.findall(message.content)]
+                if not terms.issubset(words):
+                    continue
+                # More occurrences rank first; ranks sort ascending like BM25's
+                rank = -float(sum(word in terms for word in words))
+                if (rank, message.id) > after:
+                    matches.append((rank, message))
+        matches.sort(key=lambda match: (match[0], match[1].id))
+
+        page = matches[:limit]
+        rows = [
+            (
+                message.id,
+                message.sender,
+                message.receiver,
+                _WORD.sub(
+                    lambda m: f"[{m.group()}]" if m.group().lower() in terms else m.group(),
+                    message.content,
+                ),
+                message.timestamp,
+            )
+            for _, message in page
+        ]
+        next_cursor = f"{page[-1][0]!r}:{page[-1][1].id}" if len(matches) > limit else ""
+        return rows, next_cursor
+
+    # Conversations
+
+    def get_conversation_id(self, user1: str, user2: str) -> Optional[int]:
+        with self._lock:
+            pair = (user1, user2) if user1 <= user2 else (user2, user1)
+            return self._conversation_ids.get(pair)
+
+    def get_conversation_messages(
+        self, conversation_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        with self._lock:
+            ids = self._conversation_messages.get(conversation_id, [])
+            end = bisect.bisect_left(ids, before_id) if before_id else len(ids)
+            return [
+                (m.id, m.sender, m.content, m.timestamp)
+                for m in (self._messages[i] for i in ids[max(end - limit, 0) : end])
+            ]
+
+    def list_conversations(
+        self, username: str, limit: int = 50
+    ) -> List[Tuple[int, str, int, str, str, str, int]]:
+        with self._lock:
+            rows = []
+            for conversation_id in self._user_conversations.get(username, set()):
+                user_a, user_b = self._conversation_pairs[conversation_id]
+                peer = user_b if user_a == username else user_a
+                ids = self._conversation_messages[conversation_id]
+                last = self._messages[ids[-1]] if ids else None
+                unread = sum(
+                    1
+                    for message_id in self._unread.get(username, [])
+                    if self._messages[message_id].conversation_id == conversation_id
+                )
+                rows.append(
+                    (
+                        conversation_id,
+                        peer,
+                        last.id if last else 0,
+                        last.sender if last else "",
+                        last.content if last else "",
+                        last.timestamp if last else "",
+                        unread,
+                    )
+                )
+            rows.sort(key=lambda row: row[2], reverse=True)
+            return rows[:limit]
+
+    # Rooms
+
+    def create_room(self, name: str, owner: str, kind: str = "group") -> Optional[int]:
+        with self._lock:
+            if name in self._room_names:
+                return None
+            room_id = len(self._rooms) + 1
+            while room_id in self._rooms:
+                room_id += 1
+            self._rooms[room_id] = (room_id, name, owner, kind)
+            self._room_names.add(name)
+            self._room_members[room_id] = {owner: 0}
+            self._room_messages[room_id] = []
+            return room_id
+
+    def get_room(self, room_id: int) -> Optional[Tuple[int, str, str, str]]:
+        with self._lock:
+            return self._rooms.get(room_id)
+
+    def add_room_member(self, room_id: int, username: str) -> bool:
+        with self._lock:
+            members = self._room_members.setdefault(room_id, {})
+            if username in members:
+                return False
+            messages = self._room_messages.get(room_id, [])
+            members[username] = messages[-1][0] if messages else 0
+            return True
+
+    def remove_room_member(self, room_id: int, username: str) -> bool:
+        with self._lock:
+            return self._room_members.get(room_id, {}).pop(username, None) is not None
+
+    def get_room_members(self, room_id: int) -> List[str]:
+        with self._lock:
+            return list(self._room_members.get(room_id, {}))
+
+    def get_user_rooms(self, username: str) -> List[Tuple[int, str, str]]:
+        with self._lock:
+            return [
+                (room_id, name, kind)
+                for room_id, name, _, kind in sorted(self._rooms.values())
+                if username in self._room_members.get(room_id, {})
+            ]
+
+    def insert_room_message(self, room_id: int, sender: str, content: str) -> int:
+        with self._lock:
+            message_id = self._next_room_message_id
+            self._next_room_message_id += 1
+            self._room_messages.setdefault(room_id, []).append(
+                (message_id, sender, content, self._timestamp())
+            )
+            return message_id
+
+    def get_room_history(
+        self, room_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        with self._lock:
+            messages = self._room_messages.get(room_id, [])
+            end = (
+                bisect.bisect_left(messages, (before_id,)) if before_id else len(messages)
+            )
+            return messages[max(end - limit, 0) : end]
+
+    def mark_room_read(self, room_id: int, username: str, last_read_id: int) -> None:
+        with self._lock:
+            members = self._room_members.get(room_id, {})
+            if username in members:
+                messages = self._room_messages.get(room_id)
+                newest = messages[-1][0] if messages else 0
+                members[username] = max(members[username], min(last_read_id, newest))
+
+    def get_room_read_cursor(self, room_id: int, username: str) -> Optional[int]:
+        with self._lock:
+            return self._room_members.get(room_id, {}).get(username)
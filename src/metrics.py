@@ -0,0 +1,82 @@
+# metrics.py
+import threading
+from typing import Dict, Union
+
+Number = Union[int, float]
+
+# Process-wide metrics. Counters only go up; gauges hold the latest value.
+_counters: Dict[str, Number] = {}
+_gauges: Dict[str, Number] = {}
+_lock = threading.Lock()
+
+
+def increment(name: str, value: Number = 1) -> None:
+    """
+    Adds value to a counter, creating it at zero if needed.
+
+    Args:
+        name (str): The counter name, dotted by subsystem (e.g. "message_cache.hits").
+        value (Number): The amount to add. Defaults to 1.
+
+    Returns:
+        None
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Number) -> None:
+    """
+    Sets a gauge to its current value.
+
+    Args:
+        name (str): The gauge name.
+        value (Number): The current value.
+
+    Returns:
+        None
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def get(name: str, default: Number = 0) -> Number:
+    """
+    Retrieves the current value of a counter or gauge.
+
+    Args:
+        name (str): The metric name.
+        default (Number): Returned if the metric was never recorded.
+
+    Returns:
+        Number: The metric value.
+    """
+    with _lock:
+        if name in _counters:
+            return _counters[name]
+        return _gauges.get(name, default)
+
+
+def snapshot() -> Dict[str, Number]:
+    """
+    Returns a copy of all counters and gauges.
+
+    Returns:
+        Dict[str, Number]: Metric names mapped to their values.
+    """
+    with _lock:
+        values = dict(_counters)
+        values.update(_gauges)
+        return values
+
+
+def reset() -> None:
+    """
+    Clears all metrics. Intended for tests.
+
+    Returns:
+        None
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -0,0 +1,108 @@
+# rate_limit.py
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import metrics
+
+# Requests per second and burst size per action. Actions not listed use
+# DEFAULT_RATE_LIMIT; a rate of 0 leaves an action unlimited.
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "send_message": (5, 20),
+    "send_room_message": (5, 20),
+    "get_recent_messages": (2, 10),
+    "get_unread_messages": (2, 10),
+    "get_conversation": (5, 20),
+    "get_room_history": (5, 20),
+    "search_messages": (1, 5),
+    "search_users": (5, 20),
+    "login": (1, 5),
+    "register": (0.2, 3),
+}
+DEFAULT_RATE_LIMIT: Tuple[float, int] = (20, 50)
+# JSON object overriding entries, e.g. {"send_message": [10, 40]}
+for _action, _limit in json.loads(os.environ.get("RATE_LIMITS", "{}")).items():
+    RATE_LIMITS[_action] = (_limit[0], _limit[1])
+
+
+class RateLimiter:
+    """
+    Token buckets per (client, action), stored as one float each: the time
+    at which the bucket will be full again (the GCRA form of a token bucket).
+    Refill happens lazily on the next check, so idle clients cost nothing,
+    and full buckets hold no state at all.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, int]]] = None,
+        default: Tuple[float, int] = DEFAULT_RATE_LIMIT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Initializes the RateLimiter object.
+
+        :param limits: (requests per second, burst) per action; defaults to RATE_LIMITS.
+        :param default: The limit of actions not in limits.
+        :param clock: Monotonic time source.
+        """
+        # Per action: (seconds per token, seconds of credit a full bucket holds)
+        self._limits = {
+            action: self._interval(limit)
+            for action, limit in (RATE_LIMITS if limits is None else limits).items()
+        }
+        self._default = self._interval(default)
+        self._clock = clock
+        # (client, action) -> time the bucket is full again; absent means full
+        self._full_at: Dict[Tuple[Hashable, str], float] = {}
+        self._sweep_size = 1024
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _interval(limit: Tuple[float, int]) -> Optional[Tuple[float, float]]:
+        rate, burst = limit
+        if rate <= 0:
+            return None
+        return 1.0 / rate, max(burst, 1) / rate
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+    def check(self, client: Hashable, action: str) -> float:
+        """
+        Takes one token from the client's bucket for an action.
+
+        Args:
+            client (Hashable): Whose bucket, e.g. a username.
+            action (str): The requested action.
+
+        Returns:
+            float: 0 if the request may run, else the seconds until it may.
+        """
+        limit = self._limits.get(action, self._default)
+        if limit is None:
+            return 0.0
+        interval, capacity = limit
+        now = self._clock()
+        key = (client, action)
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now)
+            wait = full_at + interval - now - capacity
+            if wait > 0:
+                metrics.increment("rate_limit.rejected")
+                return wait
+            self._full_at[key] = full_at + interval
+            if len(self._full_at) >= self._sweep_size:
+                self._sweep(now)
+        return 0.0
+
+    def _sweep(self, now: float) -> None:
+        """
+        Forgets buckets that refilled, which read the same as absent ones.
+        Runs whenever the table doubles, so its cost is O(1) per check.
+        Caller holds the lock.
+        """
+        self._full_at = {key: full_at for key, full_at in self._full_at.items() if full_at > now}
+        self._sweep_size = max(1024, 2 * len(self._full_at))
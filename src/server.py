@@ -1,7 +1,14 @@
 # server.py
+import os
+import signal
 import socket
 import threading
-from handlers import handle_client_connection
+import time
+from typing import Dict, Optional
+import metrics
+from handlers import close_all_connections, handle_client_connection, heartbeat, worker_pool
+from maintenance import start_maintenance
+from storage import STORAGE_ENGINE, create_storage, set_storage
 import logging
 import sys
 
@@ -16,25 +23,373 @@ logging.basicConfig(
 HOST = "0.0.0.0"
 PORT = 8000
 
+# Admission control; each connection holds a thread, so these cap threads too
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", "10000"))
+MAX_CONNECTIONS_PER_IP = int(os.environ.get("MAX_CONNECTIONS_PER_IP", "100"))
+# Connections still in the HTTP upgrade; a reconnect storm queues here first
+MAX_PENDING_HANDSHAKES = int(os.environ.get("MAX_PENDING_HANDSHAKES", "256"))
+# Seconds a client has to complete the upgrade
+HANDSHAKE_TIMEOUT = float(os.environ.get("HANDSHAKE_TIMEOUT", "5"))
+# Kernel queue of connections not yet accepted
+LISTEN_BACKLOG = int(os.environ.get("LISTEN_BACKLOG", "1024"))
+# Seconds rejected clients are asked to wait before retrying
+RETRY_AFTER = 5
+
+# Seconds open connections get to finish their requests on shutdown
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "10"))
+# How often the accept loop checks whether it should stop, in seconds
+ACCEPT_POLL_INTERVAL = 0.5
+# Seconds the accept loop pauses after a failed accept, e.g. when out of
+# file descriptors, so it does not spin while the condition lasts
+ACCEPT_ERROR_BACKOFF = 0.1
+# Unix socket path for hot restarts: a new server started with the same path
+# takes over the listening socket from the running one; unset disables it
+HANDOFF_SOCKET = os.environ.get("HANDOFF_SOCKET", "")
+# Seconds a new server waits for the running one to hand over
+HANDOFF_TIMEOUT = 5.0
+
+SERVICE_UNAVAILABLE_RESPONSE = (
+    "HTTP/1.1 503 Service Unavailable\r\n"
+    f"Retry-After: {RETRY_AFTER}\r\n"
+    "Content-Length: 0\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+).encode("ascii")
+
+
+class AdmissionController:
+    """
+    Decides which accepted connections get a handler thread, capping the
+    total, the connections per client IP and those still handshaking.
+    Every decision is counted in metrics under "admission.".
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_per_ip: int = MAX_CONNECTIONS_PER_IP,
+        max_pending_handshakes: int = MAX_PENDING_HANDSHAKES,
+    ) -> None:
+        """
+        Initializes the AdmissionController object.
+
+        :param max_connections: Most open connections; 0 means unlimited.
+        :param max_per_ip: Most open connections per client IP; 0 means unlimited.
+        :param max_pending_handshakes: Most connections still handshaking; 0 means unlimited.
+        """
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.max_pending_handshakes = max_pending_handshakes
+        self.connections = 0
+        self.handshaking = 0
+        self._per_ip: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, ip: str) -> Optional[str]:
+        """
+        Admits a new connection into the handshake phase.
+
+        Args:
+            ip (str): The client IP address.
+
+        Returns:
+            Optional[str]: None if admitted, else why it was rejected:
+                "max_connections", "per_ip" or "handshake_queue".
+        """
+        with self._lock:
+            if self.max_connections and self.connections >= self.max_connections:
+                reason = "max_connections"
+            elif self.max_per_ip and self._per_ip.get(ip, 0) >= self.max_per_ip:
+                reason = "per_ip"
+            elif (
+                self.max_pending_handshakes
+                and self.handshaking >= self.max_pending_handshakes
+            ):
+                reason = "handshake_queue"
+            else:
+                reason = None
+                self.connections += 1
+                self.handshaking += 1
+                self._per_ip[ip] = self._per_ip.get(ip, 0) + 1
+            self._update_gauges()
+        metrics.increment(f"admission.rejected.{reason}" if reason else "admission.accepted")
+        return reason
+
+    def handshake_done(self, ok: bool) -> None:
+        """
+        Moves an admitted connection out of the handshake phase.
+
+        Args:
+            ok (bool): Whether the upgrade succeeded.
+        """
+        with self._lock:
+            self.handshaking -= 1
+            self._update_gauges()
+        if not ok:
+            metrics.increment("admission.handshake_failed")
+
+    def release(self, ip: str, handshaking: bool = False) -> None:
+        """
+        Frees the slot of a closed connection.
+
+        Args:
+            ip (str): The client IP address.
+            handshaking (bool): True if it closed before handshake_done.
+        """
+        with self._lock:
+            self.connections -= 1
+            if handshaking:
+                self.handshaking -= 1
+            remaining = self._per_ip.get(ip, 0) - 1
+            if remaining > 0:
+                self._per_ip[ip] = remaining
+            else:
+                self._per_ip.pop(ip, None)
+            self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("admission.connections", self.connections)
+        metrics.set_gauge("admission.handshaking", self.handshaking)
+
+
+def reject(conn: socket.socket) -> None:
+    """
+    Sheds a connection with an HTTP 503 before any upgrade, without ever
+    blocking the accept loop.
+
+    Args:
+        conn (socket.socket): The connection to turn away.
+    """
+    try:
+        conn.setblocking(False)
+        conn.send(SERVICE_UNAVAILABLE_RESPONSE)
+        conn.shutdown(socket.SHUT_WR)
+        # Drain the request if it already arrived; closing with unread data
+        # resets the connection and the client might never see the 503
+        conn.recv(4096)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+
+def serve_client(
+    conn: socket.socket, addr: tuple, admission: AdmissionController
+) -> None:
+    """
+    Runs an admitted connection and frees its admission slot afterwards.
+
+    Args:
+        conn (socket.socket): The admitted connection.
+        addr (tuple): The client address.
+        admission (AdmissionController): The controller that admitted it.
+    """
+    handshaking = True
+
+    def on_handshake(ok: bool) -> None:
+        nonlocal handshaking
+        handshaking = False
+        admission.handshake_done(ok)
+
+    try:
+        handle_client_connection(conn, addr, on_handshake=on_handshake)
+    finally:
+        admission.release(addr[0], handshaking)
+
+
+def accept_loop(
+    listener: socket.socket,
+    admission: AdmissionController,
+    stopping: Optional[threading.Event] = None,
+) -> None:
+    """
+    Accepts connections until stopping is set, starting a thread for each
+    admitted one and answering the rest with a 503.
+
+    Args:
+        listener (socket.socket): The listening socket; give it a timeout so
+            the loop notices stopping while no client connects.
+        admission (AdmissionController): Decides which connections to serve.
+        stopping (Optional[threading.Event]): Ends the loop once set.
+    """
+    while stopping is None or not stopping.is_set():
+        try:
+            conn, addr = listener.accept()
+        except socket.timeout:
+            continue
+        except OSError as e:
+            if listener.fileno() == -1:
+                raise  # Closed under us; there is nothing left to accept
+            # EMFILE/ENFILE or a connection aborted in the backlog: the
+            # listener is fine, so wait briefly and keep serving
+            metrics.increment("admission.accept_errors")
+            logging.warning(f"Accept failed: {e}")
+            if stopping is not None:
+                stopping.wait(ACCEPT_ERROR_BACKOFF)
+            else:
+                time.sleep(ACCEPT_ERROR_BACKOFF)
+            continue
+        reason = admission.admit(addr[0])
+        if reason is not None:
+            logging.warning(f"Rejected connection from {addr}: {reason}")
+            reject(conn)
+            continue
+        # Cleared by handle_client_connection once the upgrade is done
+        conn.settimeout(HANDSHAKE_TIMEOUT or None)
+        threading.Thread(
+            target=serve_client, args=(conn, addr, admission), daemon=True
+        ).start()
+
+
+class HandoffServer(threading.Thread):
+    """
+    Serves the listening socket to the next server process over a Unix
+    socket. The descriptor travels as SCM_RIGHTS ancillary data, so the
+    listening socket and its backlog outlive this process: a deploy never
+    refuses a connection. Once the new process confirms it is accepting,
+    stopping is set and this process shuts down gracefully.
+    """
+
+    def __init__(self, path: str, listener: socket.socket, stopping: threading.Event) -> None:
+        super().__init__(name="handoff", daemon=True)
+        self.path = path
+        self.listener = listener
+        self.stopping = stopping
+        self.handed_off = False
+        # A stale path from a crashed server would make bind fail
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(1)
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return  # Closed by stop()
+            with conn:
+                try:
+                    conn.settimeout(HANDOFF_TIMEOUT)
+                    socket.send_fds(conn, [b"listener"], [self.listener.fileno()])
+                    if conn.recv(16) != b"ready":
+                        continue
+                except OSError as e:
+                    logging.error(f"Handoff failed: {e}")
+                    continue
+            logging.warning("Listening socket handed off; shutting down.")
+            self.handed_off = True
+            self.stopping.set()
+        self.stop()
+
+    def stop(self) -> None:
+        # The path is left alone: by now it may belong to the new server
+        self._server.close()
+
+
+def take_over_listener(path: str) -> Optional[socket.socket]:
+    """
+    Asks a running server for its listening socket.
+
+    Args:
+        path (str): The running server's handoff Unix socket.
+
+    Returns:
+        Optional[socket.socket]: The listening socket, or None if no server
+            answered on path.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(HANDOFF_TIMEOUT)
+            conn.connect(path)
+            _, fds, _, _ = socket.recv_fds(conn, 16, 1)
+            if not fds:
+                return None
+            listener = socket.socket(fileno=fds[0])
+            # Both processes accept until the old one sees this and stops
+            conn.sendall(b"ready")
+            return listener
+    except OSError:
+        return None
+
+
+def open_listener() -> socket.socket:
+    """
+    Opens the listening socket, taking it over from a running server when
+    HANDOFF_SOCKET names one.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    listener = take_over_listener(HANDOFF_SOCKET) if HANDOFF_SOCKET else None
+    if listener is not None:
+        print("[*] Took over the listening socket from the running server")
+        return listener
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((HOST, PORT))
+    listener.listen(LISTEN_BACKLOG)
+    return listener
+
+
+def shutdown(storage, maintenance: Optional[threading.Thread]) -> None:
+    """
+    Winds the server down once it stopped accepting: lets open connections
+    finish their requests and sends them close frames, then stops the worker
+    and background threads and flushes queued database writes.
+
+    Args:
+        storage (Storage): The storage engine to close.
+        maintenance (Optional[threading.Thread]): The maintenance thread, if any.
+    """
+    cut_off = close_all_connections(SHUTDOWN_TIMEOUT)
+    if cut_off:
+        logging.warning(f"{cut_off} connections did not close in time.")
+    worker_pool.shutdown()
+    heartbeat.stop()
+    if maintenance is not None:
+        maintenance.stop()
+    # Stops the shard writer threads after their queued writes commit
+    storage.close()
+    print("[*] Server stopped")
+
 
 def main():
     """
     Main server function:
-      1. Creates a TCP socket on HOST:PORT.
-      2. Accepts connections in a loop.
-      3. Spawns a new thread to handle each connected client.
-    """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen()
-        print(f"[*] WebSocket server listening on {HOST}:{PORT}")
+      1. Opens the storage engine named by STORAGE_ENGINE.
+      2. Creates a TCP socket on HOST:PORT, or takes it over from a running
+         server through HANDOFF_SOCKET.
+      3. Accepts connections in a loop, shedding them with a 503 past the
+         admission limits.
+      4. Spawns a new thread to handle each admitted client.
+      5. On SIGTERM or SIGINT, or once a newer server took over, stops
+         accepting and shuts down gracefully.
+    """
+    storage = create_storage(STORAGE_ENGINE)
+    storage.initialize()
+    set_storage(storage)
+
+    stopping = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.set())
 
-        while True:
-            conn, addr = s.accept()
-            threading.Thread(
-                target=handle_client_connection, args=(conn, addr), daemon=True
-            ).start()
+    with open_listener() as listener:
+        listener.settimeout(ACCEPT_POLL_INTERVAL)
+        print(f"[*] WebSocket server listening on {HOST}:{PORT}")
+        handoff = None
+        if HANDOFF_SOCKET:
+            handoff = HandoffServer(HANDOFF_SOCKET, listener, stopping)
+            handoff.start()
+        maintenance = start_maintenance()
+        heartbeat.start()
+        accept_loop(listener, AdmissionController(), stopping)
+        if handoff is not None:
+            handoff.stop()
+    # Closing our descriptor leaves the socket open if another server has it
+    shutdown(storage, maintenance)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+# shards.py
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_POOL_SIZE = 4  # Reader connections kept open per shard
+BUSY_TIMEOUT = 5.0  # Seconds a connection waits for another writer's lock
+
+# Sentinel asking a writer thread to exit
+_STOP = object()
+
+
+class Shard:
+    """
+    One SQLite file with a pool of reader connections and a single writer
+    thread. Every write to the file runs on the writer thread, one
+    transaction at a time, so writers never contend for the file lock.
+    """
+
+    def __init__(self, index: int, path: str, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        """
+        Initializes the Shard object. Connections and the writer thread are
+        created on first use.
+
+        :param index: The shard's position in the router.
+        :type index: int
+        :param path: The SQLite file of the shard.
+        :type path: str
+        :param pool_size: The maximum number of open reader connections.
+        :type pool_size: int
+        """
+        self.index = index
+        self.path = path
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._writes: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+
+    def read(self, fn: Callable[[sqlite3.Cursor], T]) -> T:
+        """
+        Runs fn with a cursor on a pooled reader connection.
+
+        Args:
+            fn (Callable[[sqlite3.Cursor], T]): Issues the reads and returns their result.
+
+        Returns:
+            T: The value returned by fn.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                return fn(conn.cursor())
+            finally:
+                # End the implicit read transaction before pooling the connection
+                conn.rollback()
+                if self._closed:
+                    conn.close()
+                else:
+                    self._readers.put(conn)
+        finally:
+            self._slots.release()
+
+    def write(self, fn: Callable[[sqlite3.Cursor], T]) -> T:
+        """
+        Runs fn as one transaction on the shard's writer thread and waits for it.
+        The transaction is committed if fn returns and rolled back if it raises.
+
+        Args:
+            fn (Callable[[sqlite3.Cursor], T]): Issues the writes and returns a result.
+
+        Returns:
+            T: The value returned by fn.
+
+        Raises:
+            Exception: Whatever fn raised.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Shard {self.index} is closed.")
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._run_writer, name=f"shard-{self.index}-writer", daemon=True
+                )
+                self._writer.start()
+            self._writes.put((fn, future))
+        return future.result()
+
+    def _run_writer(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                item = self._writes.get()
+                if item is _STOP:
+                    return
+                fn, future = item
+                try:
+                    result = fn(conn.cursor())
+                    conn.commit()
+                except BaseException as e:
+                    conn.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Stops the writer thread after queued writes finish and closes idle
+        reader connections. Readers in use are closed when returned.
+        """
+        with self._lock:
+            self._closed = True
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._writes.put(_STOP)
+        if writer is not None:
+            writer.join()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ShardRouter:
+    """
+    Maps conversations and message IDs to shards.
+
+    A conversation lives entirely on the shard chosen by a hash of its two
+    participants, together with its summary row and read cursors. Message IDs
+    carry their shard in the low bits, (sequence << shard_bits) | shard, with
+    the sequence allocated here so IDs stay globally increasing. With one
+    shard the encoding is the identity and SQLite assigns IDs as before.
+    """
+
+    def __init__(self, db_file: str, count: int = 1, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        """
+        Initializes the ShardRouter object.
+
+        :param db_file: The main database file, which is also shard 0.
+        :type db_file: str
+        :param count: The number of shards. It must stay the same for the life
+            of a data set, since it is part of every message ID.
+        :type count: int
+        :param pool_size: The reader connections kept per shard.
+        :type pool_size: int
+        """
+        if count < 1:
+            raise ValueError("Shard count must be at least 1.")
+        self.count = count
+        self.bits = (count - 1).bit_length()
+        root, ext = os.path.splitext(db_file)
+        self.shards = [
+            Shard(i, db_file if i == 0 else f"{root}-shard{i}{ext}", pool_size)
+            for i in range(count)
+        ]
+        self._sequence: Optional[int] = None
+        self._sequence_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def shard_for_pair(self, user1: str, user2: str) -> Shard:
+        """
+        Returns the shard holding the conversation between two users.
+        """
+        if self.count == 1:
+            return self.shards[0]
+        user_a, user_b = (user1, user2) if user1 <= user2 else (user2, user1)
+        key = f"{user_a}\0{user_b}".encode("utf-8")
+        return self.shards[zlib.crc32(key) % self.count]
+
+    def shard_for_id(self, encoded_id: int) -> Shard:
+        """
+        Returns the shard of a message or conversation ID.
+        """
+        # IDs that were never issued may carry an out-of-range shard; they
+        # route somewhere harmless and match nothing there
+        return self.shards[(encoded_id & ((1 << self.bits) - 1)) % self.count]
+
+    def encode(self, local_id: int, shard: Shard) -> int:
+        """
+        Turns a shard-local row ID into a global ID.
+        """
+        return (local_id << self.bits) | shard.index
+
+    def decode(self, encoded_id: int) -> Tuple[int, Shard]:
+        """
+        Splits a global ID into its shard-local row ID and shard.
+        """
+        return encoded_id >> self.bits, self.shard_for_id(encoded_id)
+
+    def next_message_id(self, shard: Shard) -> Optional[int]:
+        """
+        Allocates the ID of a new message on a shard, or returns None to let
+        SQLite assign it when there is a single shard.
+        """
+        if self.count == 1:
+            return None
+        with self._sequence_lock:
+            if self._sequence is None:
+                self._sequence = max(
+                    s.read(lambda c: c.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0])
+                    for s in self.shards
+                ) >> self.bits
+            self._sequence += 1
+            return self.encode(self._sequence, shard)
+
+    def map(self, fn: Callable[[Shard], T]) -> List[T]:
+        """
+        Runs fn on every shard, concurrently when there are several, and
+        returns the results in shard order.
+        """
+        if self.count == 1:
+            return [fn(self.shards[0])]
+        with self._sequence_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.count, thread_name_prefix="shard-query"
+                )
+            executor = self._executor
+        return list(executor.map(fn, self.shards))
+
+    def close(self) -> None:
+        """
+        Closes every shard and the query threads.
+        """
+        for shard in self.shards:
+            shard.close()
+        with self._sequence_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
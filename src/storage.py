@@ -0,0 +1,472 @@
+# storage.py
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+# The engine used when none was configured: "sqlite" or "memory"
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "sqlite")
+
+
+class Storage(ABC):
+    """
+    Interface of a storage engine for users, direct messages and rooms.
+
+    Handlers reach the active engine through the module-level functions
+    below, so engines can be swapped at startup without touching them.
+    Rows are returned as plain tuples in the shapes documented here; every
+    list of messages is sorted from oldest to newest.
+    """
+
+    def initialize(self) -> None:
+        """
+        Prepares the engine for use, e.g. creating tables. Called once at startup.
+        """
+
+    def close(self) -> None:
+        """
+        Releases the engine's resources.
+        """
+
+    # Users
+
+    @abstractmethod
+    def create_user(self, username: str, password_hash: str) -> bool:
+        """
+        Stores a new user. Returns False if the username is taken.
+        """
+
+    @abstractmethod
+    def get_password_hash(self, username: str) -> Optional[str]:
+        """
+        Returns a user's password hash, or None if the user does not exist.
+        """
+
+    @abstractmethod
+    def delete_user(self, username: str) -> bool:
+        """
+        Deletes a user with the messages they sent, their conversations and
+        room memberships. Returns False if the user does not exist.
+        """
+
+    @abstractmethod
+    def get_user_info(self, username: str) -> Optional[Tuple[str, int]]:
+        """
+        Returns (username, n_unread_messages), or None if the user does not exist.
+        """
+
+    @abstractmethod
+    def set_n_unread_messages(self, username: str, n_unread_messages: int) -> bool:
+        """
+        Updates a user's preferred number of unread messages to fetch.
+        """
+
+    @abstractmethod
+    def get_all_users_except(self, username: str) -> List[str]:
+        """
+        Returns every username except the given one, in alphabetical order.
+        """
+
+    @abstractmethod
+    def search_users(
+        self, prefix: str, limit: int = 20, exclude: Optional[str] = None
+    ) -> Tuple[List[str], int]:
+        """
+        Returns up to 'limit' usernames starting with 'prefix' in alphabetical
+        order, and a version that changes whenever a user is added or removed.
+        """
+
+    # Direct messages
+
+    @abstractmethod
+    def insert_message(self, sender: str, content: str, receiver: str) -> int:
+        """
+        Stores a new unread, undelivered message and returns its ID. IDs increase.
+        """
+
+    @abstractmethod
+    def get_recent_messages(
+        self, user_id: str, limit: int = 50
+    ) -> List[Tuple[str, str, str, str, int]]:
+        """
+        Returns the newest 'limit' read messages the user sent or received as
+        (sender, content, receiver, timestamp, id).
+        """
+
+    @abstractmethod
+    def get_unread_messages(
+        self, user_id: str, limit: int = 20
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        Returns the oldest 'limit' unread messages sent to the user as
+        (id, sender, content, timestamp).
+        """
+
+    @abstractmethod
+    def get_undelivered_messages(self, user_id: str) -> List[Tuple[str, str, str, int]]:
+        """
+        Returns every undelivered message sent to the user as
+        (sender, content, timestamp, id).
+        """
+
+    @abstractmethod
+    def mark_messages_delivered(
+        self, user_id: str, message_ids: Optional[List[int]] = None
+    ) -> int:
+        """
+        Marks the given messages sent to the user, or all of them when
+        message_ids is None, as delivered. IDs of messages sent to others are
+        ignored. Returns the number that became delivered.
+        """
+
+    def get_login_bootstrap(
+        self, username: str, default_limit: int = 50
+    ) -> Tuple[List[Tuple[int, str, str, str]], List[Tuple[str, str, str, str, int]], List[str]]:
+        """
+        Returns what a client shows right after login: the unread and the
+        recent messages, as many of each as the user's n_unread_messages
+        (or default_limit), and every other username, in the formats of
+        get_unread_messages, get_recent_messages and get_all_users_except.
+        Engines override this to read all three consistently in one go.
+        """
+        info = self.get_user_info(username)
+        limit = (info[1] if info else 0) or default_limit
+        return (
+            self.get_unread_messages(username, limit),
+            self.get_recent_messages(username, limit),
+            self.get_all_users_except(username),
+        )
+
+    @abstractmethod
+    def mark_messages_as_read(self, message_ids: List[int]) -> None:
+        """
+        Marks the given messages as read. Unknown IDs are ignored.
+        """
+
+    @abstractmethod
+    def mark_conversation_read(self, username: str, peer: str, last_read_id: int) -> None:
+        """
+        Marks every message from peer to username up to last_read_id as read.
+        """
+
+    @abstractmethod
+    def delete_message(self, message_id: int) -> bool:
+        """
+        Deletes a message. Returns False only if the deletion failed.
+        """
+
+    @abstractmethod
+    def search_messages(
+        self, username: str, text: str, cursor: str = "", limit: int = 20
+    ) -> Tuple[List[Tuple[int, str, str, str, str]], str]:
+        """
+        Searches the messages the user sent or received for all words of
+        'text', best matches first. Returns (id, sender, receiver, snippet,
+        timestamp) rows with matches bracketed in the snippet, and the
+        cursor of the next page or "". Raises ValueError for a bad cursor.
+        """
+
+    # Conversations
+
+    @abstractmethod
+    def get_conversation_id(self, user1: str, user2: str) -> Optional[int]:
+        """
+        Returns the ID of the conversation between two users, or None.
+        """
+
+    @abstractmethod
+    def get_conversation_messages(
+        self, conversation_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        Returns up to 'limit' messages of a conversation with IDs below
+        before_id (or the newest) as (id, sender, content, timestamp).
+        """
+
+    @abstractmethod
+    def list_conversations(
+        self, username: str, limit: int = 50
+    ) -> List[Tuple[int, str, int, str, str, str, int]]:
+        """
+        Returns the user's conversations, most recently active first, as
+        (conversation_id, peer, last_message_id, last_sender, last_content,
+        last_timestamp, unread_count).
+        """
+
+    # Rooms
+
+    @abstractmethod
+    def create_room(self, name: str, owner: str, kind: str = "group") -> Optional[int]:
+        """
+        Creates a room with its owner as first member. Returns its ID, or
+        None if the name is taken.
+        """
+
+    @abstractmethod
+    def get_room(self, room_id: int) -> Optional[Tuple[int, str, str, str]]:
+        """
+        Returns (id, name, owner, kind), or None if the room does not exist.
+        """
+
+    @abstractmethod
+    def add_room_member(self, room_id: int, username: str) -> bool:
+        """
+        Adds a member whose read cursor starts at the room's latest message.
+        Returns False if they already are a member.
+        """
+
+    @abstractmethod
+    def remove_room_member(self, room_id: int, username: str) -> bool:
+        """
+        Removes a member. Returns False if they were not a member.
+        """
+
+    @abstractmethod
+    def get_room_members(self, room_id: int) -> List[str]:
+        """
+        Returns the usernames of a room's members.
+        """
+
+    @abstractmethod
+    def get_user_rooms(self, username: str) -> List[Tuple[int, str, str]]:
+        """
+        Returns (id, name, kind) of every room the user is a member of.
+        """
+
+    @abstractmethod
+    def insert_room_message(self, room_id: int, sender: str, content: str) -> int:
+        """
+        Stores a room message and returns its ID.
+        """
+
+    @abstractmethod
+    def get_room_history(
+        self, room_id: int, before_id: Optional[int] = None, limit: int = 50
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        Returns up to 'limit' room messages with IDs below before_id (or the
+        newest) as (id, sender, content, timestamp).
+        """
+
+    @abstractmethod
+    def mark_room_read(self, room_id: int, username: str, last_read_id: int) -> None:
+        """
+        Advances a member's read cursor. Cursors never move backwards.
+        """
+
+    @abstractmethod
+    def get_room_read_cursor(self, room_id: int, username: str) -> Optional[int]:
+        """
+        Returns a member's read cursor, or None if they are not a member.
+        """
+
+    # Maintenance
+
+    def archive_read_messages(self, retention_days: int) -> int:
+        """
+        Moves read messages older than the retention period out of live
+        storage. Returns the number moved; engines without an archive move none.
+        """
+        return 0
+
+    def compact(self, max_pages: int = 0) -> None:
+        """
+        Reclaims space left by deletes, if the engine needs it.
+        """
+
+
+def create_storage(engine: str = STORAGE_ENGINE) -> Storage:
+    """
+    Creates a storage engine by name.
+
+    Args:
+        engine (str): "sqlite" or "memory".
+
+    Returns:
+        Storage: The new, uninitialized engine.
+
+    Raises:
+        ValueError: If the engine is unknown.
+    """
+    if engine == "sqlite":
+        from database import SQLiteStorage
+
+        return SQLiteStorage()
+    if engine == "memory":
+        from memory_storage import MemoryStorage
+
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage engine: {engine}")
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    Returns the active storage engine, creating and initializing the
+    configured one on first use.
+
+    Returns:
+        Storage: The active engine.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                storage = create_storage()
+                storage.initialize()
+                _storage = storage
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]) -> None:
+    """
+    Makes an initialized engine the active one, e.g. at server startup or
+    in tests. None resets to the configured default on next use.
+
+    Args:
+        storage (Optional[Storage]): The engine.
+
+    Returns:
+        None
+    """
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+# Shortcuts to the active engine, so callers can import plain functions
+
+
+def create_user(username: str, password_hash: str) -> bool:
+    return get_storage().create_user(username, password_hash)
+
+
+def get_password_hash(username: str) -> Optional[str]:
+    return get_storage().get_password_hash(username)
+
+
+def delete_user(username: str) -> bool:
+    return get_storage().delete_user(username)
+
+
+def get_user_info(username: str) -> Optional[Tuple[str, int]]:
+    return get_storage().get_user_info(username)
+
+
+def set_n_unread_messages(username: str, n_unread_messages: int) -> bool:
+    return get_storage().set_n_unread_messages(username, n_unread_messages)
+
+
+def get_all_users_except(username: str) -> List[str]:
+    return get_storage().get_all_users_except(username)
+
+
+def search_users(
+    prefix: str, limit: int = 20, exclude: Optional[str] = None
+) -> Tuple[List[str], int]:
+    return get_storage().search_users(prefix, limit, exclude)
+
+
+def insert_message(sender: str, content: str, receiver: str) -> int:
+    return get_storage().insert_message(sender, content, receiver)
+
+
+def get_recent_messages(user_id: str, limit: int = 50) -> List[Tuple[str, str, str, str, int]]:
+    return get_storage().get_recent_messages(user_id, limit)
+
+
+def get_unread_messages(user_id: str, limit: int = 20) -> List[Tuple[int, str, str, str]]:
+    return get_storage().get_unread_messages(user_id, limit)
+
+
+def get_undelivered_messages(user_id: str) -> List[Tuple[str, str, str, int]]:
+    return get_storage().get_undelivered_messages(user_id)
+
+
+def mark_messages_delivered(user_id: str, message_ids: Optional[List[int]] = None) -> int:
+    return get_storage().mark_messages_delivered(user_id, message_ids)
+
+
+def get_login_bootstrap(
+    username: str, default_limit: int = 50
+) -> Tuple[List[Tuple[int, str, str, str]], List[Tuple[str, str, str, str, int]], List[str]]:
+    return get_storage().get_login_bootstrap(username, default_limit)
+
+
+def mark_messages_as_read(message_ids: List[int]) -> None:
+    get_storage().mark_messages_as_read(message_ids)
+
+
+def mark_conversation_read(username: str, peer: str, last_read_id: int) -> None:
+    get_storage().mark_conversation_read(username, peer, last_read_id)
+
+
+def delete_message(message_id: int) -> bool:
+    return get_storage().delete_message(message_id)
+
+
+def search_messages(
+    username: str, text: str, cursor: str = "", limit: int = 20
+) -> Tuple[List[Tuple[int, str, str, str, str]], str]:
+    return get_storage().search_messages(username, text, cursor, limit)
+
+
+def get_conversation_id(user1: str, user2: str) -> Optional[int]:
+    return get_storage().get_conversation_id(user1, user2)
+
+
+def get_conversation_messages(
+    conversation_id: int, before_id: Optional[int] = None, limit: int = 50
+) -> List[Tuple[int, str, str, str]]:
+    return get_storage().get_conversation_messages(conversation_id, before_id, limit)
+
+
+def list_conversations(
+    username: str, limit: int = 50
+) -> List[Tuple[int, str, int, str, str, str, int]]:
+    return get_storage().list_conversations(username, limit)
+
+
+def create_room(name: str, owner: str, kind: str = "group") -> Optional[int]:
+    return get_storage().create_room(name, owner, kind)
+
+
+def get_room(room_id: int) -> Optional[Tuple[int, str, str, str]]:
+    return get_storage().get_room(room_id)
+
+
+def add_room_member(room_id: int, username: str) -> bool:
+    return get_storage().add_room_member(room_id, username)
+
+
+def remove_room_member(room_id: int, username: str) -> bool:
+    return get_storage().remove_room_member(room_id, username)
+
+
+def get_room_members(room_id: int) -> List[str]:
+    return get_storage().get_room_members(room_id)
+
+
+def get_user_rooms(username: str) -> List[Tuple[int, str, str]]:
+    return get_storage().get_user_rooms(username)
+
+
+def insert_room_message(room_id: int, sender: str, content: str) -> int:
+    return get_storage().insert_room_message(room_id, sender, content)
+
+
+def get_room_history(
+    room_id: int, before_id: Optional[int] = None, limit: int = 50
+) -> List[Tuple[int, str, str, str]]:
+    return get_storage().get_room_history(room_id, before_id, limit)
+
+
+def mark_room_read(room_id: int, username: str, last_read_id: int) -> None:
+    get_storage().mark_room_read(room_id, username, last_read_id)
+
+
+def get_room_read_cursor(room_id: int, username: str) -> Optional[int]:
+    return get_storage().get_room_read_cursor(room_id, username)
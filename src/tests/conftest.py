@@ -10,11 +10,38 @@ import time
 import server  # Assuming server.py is in the root directory
 import logging
 import os
+from memory_storage import MemoryStorage
+from storage import set_storage
 
 if not os.environ.get("PROTOCOL_FILE"):
     os.environ["PROTOCOL_FILE"] = "./configs/protocol.json"
 
 
+@pytest.fixture(autouse=True)
+def memory_storage():
+    """
+    Fixture giving each test a fresh in-memory storage engine, so tests
+    never touch the database files unless they ask for SQLite.
+    """
+    storage = MemoryStorage()
+    set_storage(storage)
+    yield storage
+    set_storage(None)
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter():
+    """
+    Fixture giving each test fresh rate-limit buckets, so requests made by
+    earlier tests never count against later ones.
+    """
+    from rate_limit import RateLimiter
+
+    limiter = RateLimiter()
+    with patch("handlers.rate_limiter", limiter):
+        yield limiter
+
+
 @pytest.fixture(scope="session")
 def websocket_server():
     """
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import struct
+import pytest
+import async_client
+from async_client import AsyncWebSocketClient, shared_codec
+from utils import generate_accept_key
+
+
+class FakeServer:
+    """Minimal WebSocket server: echoes requests back with their req_id."""
+
+    def __init__(self):
+        self.connections = 0
+        self.writers = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def frame(message):
+        payload = json.dumps(message).encode()
+        if len(payload) <= 125:
+            return bytes((0x81, len(payload))) + payload
+        return bytes((0x81, 126)) + struct.pack(">H", len(payload)) + payload
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        request = await reader.readuntil(b"\r\n\r\n")
+        key = [
+            line.split(": ", 1)[1]
+            for line in request.decode().split("\r\n")
+            if line.lower().startswith("sec-websocket-key")
+        ][0]
+        # The greeting push shares a segment with the handshake response
+        writer.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                f"Sec-WebSocket-Accept: {generate_accept_key(key)}\r\n\r\n"
+            ).encode()
+            + self.frame({"action": "hello", "connection": self.connections})
+        )
+        try:
+            while True:
+                b1, b2 = await reader.readexactly(2)
+                length = b2 & 0x7F
+                if length == 126:
+                    (length,) = struct.unpack(">H", await reader.readexactly(2))
+                message = json.loads(await reader.readexactly(length))
+                if message.get("action") == "drop":
+                    writer.close()
+                    return
+                if message.get("action") == "slow":
+                    continue  # Never answered
+                reply = {"action": "confirm_" + message["action"], "status": "success"}
+                if "req_id" in message:
+                    reply["req_id"] = message["req_id"]
+                writer.write(self.frame(reply))
+        except asyncio.IncompleteReadError:
+            pass
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_shared_codec_is_reused():
+    assert shared_codec("json") is shared_codec("json")
+
+
+def test_pipelined_requests_and_pushes():
+    async def scenario():
+        server = FakeServer()
+        port = await server.start()
+        client = AsyncWebSocketClient("127.0.0.1", port, mode="json")
+        assert await client.connect()
+
+        # Bytes sent with the handshake response are not lost
+        assert (await client.receive(timeout=5))["action"] == "hello"
+        replies = await asyncio.gather(
+            *(client.request({"action": f"echo{i}"}) for i in range(20))
+        )
+        assert [reply["action"] for reply in replies] == [
+            f"confirm_echo{i}" for i in range(20)
+        ]
+
+        await client.send({"action": "plain"})
+        assert (await client.receive(timeout=5))["action"] == "confirm_plain"
+
+        await client.close()
+        assert await client.receive() is None
+        await server.stop()
+
+    run(scenario())
+
+
+def test_request_timeout():
+    async def scenario():
+        server = FakeServer()
+        port = await server.start()
+        client = AsyncWebSocketClient("127.0.0.1", port, mode="json")
+        assert await client.connect()
+        with pytest.raises(asyncio.TimeoutError):
+            await client.request({"action": "slow"}, timeout=0.05)
+        assert client._pending == {}
+        await client.close()
+        await server.stop()
+
+    run(scenario())
+
+
+def test_connect_failure_returns_false():
+    async def scenario():
+        server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        client = AsyncWebSocketClient("127.0.0.1", port, mode="json", reconnect=False)
+        assert await client.connect(timeout=1) is False
+
+    run(scenario())
+
+
+def test_reconnects_after_drop(monkeypatch):
+    monkeypatch.setattr(async_client, "RECONNECT_INITIAL_DELAY", 0.01)
+    reconnected = []
+
+    async def on_reconnect(client):
+        reconnected.append(await client.request({"action": "login"}))
+
+    async def scenario():
+        server = FakeServer()
+        port = await server.start()
+        client = AsyncWebSocketClient(
+            "127.0.0.1", port, mode="json", on_reconnect=on_reconnect
+        )
+        assert await client.connect()
+        assert (await client.receive(timeout=5))["connection"] == 1
+
+        pending = asyncio.ensure_future(client.request({"action": "slow"}))
+        await asyncio.sleep(0.05)
+        await client.send({"action": "drop"})
+        with pytest.raises(ConnectionError):
+            await pending
+
+        assert (await client.receive(timeout=5))["connection"] == 2
+        while not reconnected:
+            await asyncio.sleep(0.01)
+        assert reconnected[0]["action"] == "confirm_login"
+        assert (await client.request({"action": "echo"}))["action"] == "confirm_echo"
+
+        await client.close()
+        await server.stop()
+
+    run(scenario())
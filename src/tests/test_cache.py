@@ -0,0 +1,158 @@
+import pytest
+
+import metrics
+from cache import MessageCache, UserDirectory, MESSAGE_OVERHEAD_BYTES
+
+
+def message(id, sender="alice", receiver="bob", content="hi"):
+    return (id, sender, receiver, content, "2024-01-01T00:00:00Z")
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def cache():
+    return MessageCache(max_bytes=1024 * 1024, tail_size=3)
+
+
+def test_miss_then_hit(cache):
+    """Test that a filled list is served and lookups are counted."""
+    assert cache.get_unread("bob", 3) is None
+    cache.fill_unread("bob", cache.version("bob"), [message(1), message(2)], 3)
+
+    assert cache.get_unread("bob", 3) == [message(1), message(2)]
+    assert cache.hits == 1 and cache.misses == 1
+    assert metrics.get("message_cache.hits") == 1
+    assert metrics.get("message_cache.hit_ratio") == 0.5
+
+
+def test_incomplete_list_only_serves_covered_requests(cache):
+    """Test that a full tail may be missing older rows beyond it."""
+    recent = [message(i) for i in range(1, 4)]
+    cache.fill_recent("bob", cache.version("bob"), recent, 3)
+
+    assert cache.get_recent("bob", 2) == recent[1:]
+    assert cache.get_recent("bob", 3) == recent
+    assert cache.get_recent("bob", 4) is None
+
+
+def test_fill_discarded_after_racing_write(cache):
+    """Test that a load that overlapped a write is not cached."""
+    version = cache.version("bob")
+    cache.on_insert(message(1))
+    cache.fill_unread("bob", version, [], 3)
+
+    assert cache.get_unread("bob", 3) is None
+
+
+def test_insert_appends_to_complete_unread(cache):
+    """Test that inserts are written through to the receiver's unread list."""
+    cache.fill_unread("bob", cache.version("bob"), [message(1)], 3)
+    cache.on_insert(message(2))
+    cache.on_insert(message(2))  # Duplicate write-through is ignored
+
+    assert [m[0] for m in cache.get_unread("bob", 3)] == [1, 2]
+
+
+def test_out_of_order_inserts_are_kept_in_order(cache):
+    """Test that a write-through arriving after a newer one is not dropped."""
+    cache.fill_unread("bob", cache.version("bob"), [], 3)
+    cache.on_insert(message(11))
+    cache.on_insert(message(10))
+    cache.on_insert(message(10))
+
+    assert [m[0] for m in cache.get_unread("bob", 3)] == [10, 11]
+
+
+def test_read_moves_messages_to_recent(cache):
+    """Test that reads move messages from unread to recent for both users."""
+    cache.fill_unread("bob", cache.version("bob"), [message(1), message(2)], 3)
+    cache.fill_recent("bob", cache.version("bob"), [], 3)
+    cache.fill_recent("alice", cache.version("alice"), [], 3)
+
+    cache.on_read("bob", "alice", message_ids=[1])
+
+    assert cache.get_unread("bob", 3) == [message(2)]
+    assert cache.get_recent("bob", 3) == [message(1)]
+    assert cache.get_recent("alice", 3) == [message(1)]
+
+
+def test_read_without_cached_unread_invalidates(cache):
+    """Test that reads the cache cannot mirror drop both users' entries."""
+    cache.fill_recent("alice", cache.version("alice"), [], 3)
+    cache.on_read("bob", "alice", up_to_id=5)
+
+    assert cache.get_recent("alice", 3) is None
+
+
+def test_delete_removes_message(cache):
+    """Test that deletes are written through to both users."""
+    cache.fill_unread("bob", cache.version("bob"), [message(1), message(2)], 3)
+    cache.on_delete(1, "alice", "bob")
+
+    assert cache.get_unread("bob", 3) == [message(2)]
+
+
+def test_lru_eviction_under_budget():
+    """Test that the least recently used entry is evicted when over budget."""
+    size = MESSAGE_OVERHEAD_BYTES + len("".join(message(1)[1:]))
+    cache = MessageCache(max_bytes=2 * size, tail_size=3)
+    for user in ("u1", "u2"):
+        cache.fill_unread(user, cache.version(user), [message(1)], 3)
+    cache.get_unread("u1", 3)  # u2 is now least recently used
+    cache.fill_unread("u3", cache.version("u3"), [message(1)], 3)
+
+    assert len(cache) == 2
+    assert cache.get_unread("u2", 3) is None
+    assert cache.get_unread("u1", 3) is not None
+    assert metrics.get("message_cache.evictions") == 1
+
+
+def test_disabled_cache():
+    """Test that a zero budget disables caching."""
+    cache = MessageCache(max_bytes=0)
+    cache.fill_unread("bob", cache.version("bob"), [message(1)], 3)
+
+    assert cache.get_unread("bob", 3) is None
+    assert len(cache) == 0
+
+
+def test_user_directory_prefix_search():
+    """Test that the directory searches by prefix and follows changes."""
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return ["carol", "alice", "bob", "alan"]
+
+    directory = UserDirectory()
+    users, version = directory.search(loader, "al", 10)
+    assert users == ["alan", "alice"]
+    assert directory.search(loader, "", 2, exclude="alan")[0] == ["alice", "bob"]
+    assert len(loads) == 1
+
+    directory.add("alex")
+    users, new_version = directory.search(loader, "al", 10)
+    assert users == ["alan", "alex", "alice"]
+    assert new_version > version
+
+    directory.remove("alan")
+    assert directory.search(loader, "al", 10)[0] == ["alex", "alice"]
+    assert len(loads) == 1
+
+
+def test_user_directory_discards_racing_load():
+    """Test that a load overlapping a change is not kept."""
+    directory = UserDirectory()
+
+    def loader():
+        directory.add("late")
+        return ["early"]
+
+    assert directory.load(loader)[0] == ["early"]
+    assert directory.load(lambda: ["early", "late"])[0] == ["early", "late"]
@@ -12,6 +12,8 @@ def mock_socket():
         socket_instance = Mock()
         mock.return_value = socket_instance
         socket_instance.__bool__ = lambda self: True
+        # The server closed its side, as it does after a close frame
+        socket_instance.recv.return_value = b""
         yield socket_instance
 
 
@@ -86,10 +88,10 @@ class TestWebSocketClient:
 
         assert result is True
         mock_socket.connect.assert_called_once_with(("test_host", 8000))
-        assert mock_socket.send.called
+        assert mock_socket.sendall.called
 
         # Verify handshake request format
-        sent_data = mock_socket.send.call_args[0][0].decode()
+        sent_data = mock_socket.sendall.call_args[0][0].decode()
         assert "GET / HTTP/1.1" in sent_data
         assert "Upgrade: websocket" in sent_data
         assert "Connection: Upgrade" in sent_data
@@ -137,13 +139,101 @@ class TestWebSocketClient:
         response = client.receive()
 
         assert response == expected_response
-        mock_websocket_util.read_ws_frame.assert_called_once_with(client.socket)
+        mock_websocket_util.read_ws_frame.assert_called_once_with(
+            client.socket, on_control=client._on_control
+        )
 
-    def test_close(self, client, mock_socket):
+    def test_close(self, client, mock_socket, mock_websocket_util):
         client.socket = mock_socket
         client.close()
+        mock_websocket_util.build_close_frame.assert_called_once_with(1000, "")
+        mock_socket.sendall.assert_called_once_with(
+            mock_websocket_util.build_close_frame.return_value
+        )
         mock_socket.close.assert_called_once()
 
+    def test_server_close_is_echoed_once(self, client, mock_socket):
+        client.socket = mock_socket
+        client.websocket = WebSocketUtil(mode="json")
+        client._on_control(WebSocketUtil.WS_OPCODE_CLOSE, b"\x03\xe9bye")
+        client.close()
+        mock_socket.sendall.assert_called_once_with(b"\x88\x02\x03\xe9")
+
+    def test_request_futures_resolve_by_req_id(
+        self, client, mock_socket, mock_websocket_util
+    ):
+        client.socket = mock_socket
+        first = client.request({"action": "get_users"})
+        second = client.request({"action": "echo", "message": "hi"})
+        sent = [c[0][1] for c in mock_websocket_util.send_ws_frame.call_args_list]
+        assert [m["req_id"] for m in sent] == [1, 2]
+
+        # Replies may arrive out of order, interleaved with pushes
+        mock_websocket_util.read_ws_frame.side_effect = [
+            {"action": "confirm_echo", "req_id": 2},
+            {"action": "received_message", "id": 5},
+            {"action": "user_list", "req_id": 1},
+            None,
+        ]
+        assert client.receive() == {"action": "received_message", "id": 5}
+        assert second.result(timeout=0)["action"] == "confirm_echo"
+        assert not first.done()
+
+        pending = client.request({"action": "get_users"})
+        assert client.receive() is None
+        assert first.result(timeout=0)["action"] == "user_list"
+        with pytest.raises(ConnectionError):
+            pending.result(timeout=0)
+
+    def test_auto_batching(self, mock_socket, mock_websocket_util):
+        client = WebSocketClient(host="test_host", port=8000, mode="json", batch_window=60)
+        client.socket = mock_socket
+        client.send({"action": "get_users"})
+        client.send({"action": "get_recent_messages"})
+        mock_websocket_util.send_ws_frame.assert_not_called()
+        client.flush()
+        mock_websocket_util.send_ws_frame.assert_called_once_with(
+            mock_socket,
+            {
+                "action": "batch",
+                "requests": [{"action": "get_users"}, {"action": "get_recent_messages"}],
+            },
+        )
+
+        # A lone message in the window is sent unwrapped
+        client.send({"action": "echo"})
+        client.flush()
+        assert mock_websocket_util.send_ws_frame.call_args[0][1] == {"action": "echo"}
+
+    def test_receive_unpacks_batch_response(self, client, mock_websocket_util):
+        future = client.request({"action": "echo"})
+        mock_websocket_util.read_ws_frame.side_effect = [
+            {
+                "action": "batch_response",
+                "responses": [{"action": "confirm_echo", "req_id": 1}, {"action": "user_list"}],
+            },
+        ]
+        assert client.receive() == {"action": "user_list"}
+        assert future.result(timeout=0)["action"] == "confirm_echo"
+
+    def test_acks_are_batched(self, client, mock_socket, mock_websocket_util):
+        client.socket = mock_socket
+        with patch("client.ACK_BATCH_SIZE", 4):
+            client.ack([1, 2])
+            mock_websocket_util.send_ws_frame.assert_not_called()
+            client.ack([3, 4])
+        mock_websocket_util.send_ws_frame.assert_called_once_with(
+            mock_socket, {"action": "ack_delivered", "ids": [1, 2, 3, 4]}
+        )
+
+    def test_close_flushes_pending_acks(self, client, mock_socket, mock_websocket_util):
+        client.socket = mock_socket
+        client.ack([7])
+        client.close()
+        mock_websocket_util.send_ws_frame.assert_called_once_with(
+            mock_socket, {"action": "ack_delivered", "ids": [7]}
+        )
+
     def test_full_message_flow(self, client, mock_socket, mock_websocket_util):
         # Setup mock responses
         mock_socket.recv.return_value = (
@@ -233,7 +323,9 @@ class TestWebSocketClientCustomProtocol:
         response = custom_client.receive()
 
         assert response == decoded_msg
-        mock_websocket_util.read_ws_frame.assert_called_once_with(custom_client.socket)
+        mock_websocket_util.read_ws_frame.assert_called_once_with(
+            custom_client.socket, on_control=custom_client._on_control
+        )
 
     def test_send_complex_message_custom(
         self, custom_client, mock_websocket_util, mock_custom_protocol
@@ -1,7 +1,12 @@
 import pytest
 import sqlite3
-from datetime import datetime
+from unittest.mock import patch
+from datetime import datetime, timedelta
 import os
+import archive
+import database
+from cache import message_cache, user_directory
+from storage import set_storage
 from database import (
     initialize_database,
     insert_message,
@@ -10,21 +15,50 @@ from database import (
     mark_messages_delivered,
     get_unread_messages,
     mark_messages_as_read,
+    mark_conversation_read,
     get_user_info,
     set_n_unread_messages,
     delete_message,
     get_all_users_except,
+    search_users,
+    search_messages,
+    archive_read_messages,
+    compact_database,
+    get_conversation_id,
+    get_conversation_messages,
+    list_conversations,
+    create_room,
+    get_room,
+    add_room_member,
+    remove_room_member,
+    get_room_members,
+    get_user_rooms,
+    insert_room_message,
+    get_room_history,
+    mark_room_read,
+    get_room_read_cursor,
     DB_FILE,
 )
 
 
+class _AnyTimestamp:
+    def __eq__(self, other):
+        return isinstance(other, str) and other.endswith("Z")
+
+
+ANY_TS = _AnyTimestamp()
+
+
 @pytest.fixture(autouse=True)
 def setup_teardown():
     """Setup test database before each test and cleanup after."""
     # Setup
     if os.path.exists(DB_FILE):
         os.remove(DB_FILE)
+    message_cache.clear()
+    user_directory.invalidate()
     initialize_database()
+    set_storage(database.SQLiteStorage())
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
 
@@ -190,3 +224,497 @@ def test_non_existent_user():
 
     users = get_all_users_except("non_existent_user")
     assert len(users) == 2  # should still return all users
+
+
+def test_create_and_join_room():
+    """Test room creation and membership management."""
+    room_id = create_room("general", "test_user1")
+    assert room_id is not None
+    assert get_room(room_id) == (room_id, "general", "test_user1", "group")
+    assert create_room("general", "test_user2") is None  # names are unique
+
+    assert add_room_member(room_id, "test_user2") is True
+    assert add_room_member(room_id, "test_user2") is False
+    assert sorted(get_room_members(room_id)) == ["test_user1", "test_user2"]
+    assert get_user_rooms("test_user2") == [(room_id, "general", "group")]
+
+    assert remove_room_member(room_id, "test_user2") is True
+    assert remove_room_member(room_id, "test_user2") is False
+    assert get_user_rooms("test_user2") == []
+
+
+def test_room_messages_stored_once_with_history_paging():
+    """Test that room messages are stored once and paged newest-first."""
+    room_id = create_room("news", "test_user1", kind="channel")
+    add_room_member(room_id, "test_user2")
+    ids = [insert_room_message(room_id, "test_user1", f"Post {i}") for i in range(5)]
+
+    conn = sqlite3.connect(DB_FILE)
+    count = conn.execute("SELECT COUNT(*) FROM room_messages").fetchone()[0]
+    conn.close()
+    assert count == 5
+
+    page = get_room_history(room_id, limit=2)
+    assert [row[2] for row in page] == ["Post 3", "Post 4"]
+    page = get_room_history(room_id, before_id=page[0][0], limit=2)
+    assert [row[2] for row in page] == ["Post 1", "Post 2"]
+    page = get_room_history(room_id, before_id=page[0][0], limit=2)
+    assert [row[0] for row in page] == ids[:1]
+
+
+def test_room_read_cursor_is_monotonic():
+    """Test that room read cursors start at the latest message and never move back."""
+    room_id = create_room("cursor", "test_user1")
+    first = insert_room_message(room_id, "test_user1", "before join")
+    add_room_member(room_id, "test_user2")
+    assert get_room_read_cursor(room_id, "test_user2") == first
+
+    second = insert_room_message(room_id, "test_user1", "after join")
+    mark_room_read(room_id, "test_user2", second)
+    mark_room_read(room_id, "test_user2", first)
+    assert get_room_read_cursor(room_id, "test_user2") == second
+    assert get_room_read_cursor(room_id, "nobody") is None
+
+    mark_room_read(room_id, "test_user2", second + 100)
+    assert get_room_read_cursor(room_id, "test_user2") == second
+    third = insert_room_message(room_id, "test_user1", "still unread")
+    assert get_room_read_cursor(room_id, "test_user2") < third
+
+
+@pytest.fixture
+def cursor_mode(monkeypatch):
+    """Switch read tracking to per-conversation cursors."""
+    monkeypatch.setattr(database, "READ_TRACKING", "cursor")
+
+
+def test_cursor_mode_unread_and_recent(cursor_mode):
+    """Test that cursor mode derives read state without touching message rows."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(3)]
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids
+
+    mark_conversation_read("test_user2", "test_user1", ids[1])
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids[2:]
+    assert [row[4] for row in get_recent_messages("test_user1")] == ids[:2]
+
+    # Cursors are monotonic
+    mark_conversation_read("test_user2", "test_user1", ids[0])
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids[2:]
+
+    conn = sqlite3.connect(DB_FILE)
+    flagged = conn.execute(
+        "SELECT COUNT(*) FROM messages WHERE read_status = 1"
+    ).fetchone()[0]
+    conn.close()
+    assert flagged == 0
+
+
+def test_cursor_mode_read_past_the_end_is_clamped(cursor_mode):
+    """Test that a cursor sent past the newest message does not cover later ones."""
+    first = insert_message("test_user1", "hi", "test_user2")
+    mark_conversation_read("test_user2", "test_user1", first + 1000)
+    later = insert_message("test_user1", "still unread", "test_user2")
+
+    assert [row[0] for row in get_unread_messages("test_user2")] == [later]
+
+
+def test_cursor_mode_mark_messages_as_read(cursor_mode):
+    """Test that marking IDs read in cursor mode advances per-conversation cursors."""
+    a = insert_message("test_user1", "to 2", "test_user2")
+    b = insert_message("test_user2", "to 1", "test_user1")
+    c = insert_message("test_user1", "to 2 again", "test_user2")
+
+    mark_messages_as_read([a, b])
+    assert [row[0] for row in get_unread_messages("test_user2")] == [c]
+    assert get_unread_messages("test_user1") == []
+
+
+def test_delete_user_removes_cursors_on_them(cursor_mode):
+    """Test that deleting a user also drops the cursors peers keep on them."""
+    message_id = insert_message("test_user1", "hi", "test_user2")
+    mark_conversation_read("test_user2", "test_user1", message_id)
+    insert_message("test_user2", "hi back", "test_user1")
+
+    assert database.delete_user("test_user1") is True
+    conn = sqlite3.connect(DB_FILE)
+    cursors = conn.execute("SELECT username, peer FROM read_cursors").fetchall()
+    conn.close()
+    assert cursors == []
+
+
+def test_status_mode_mark_conversation_read():
+    """Test that mark_conversation_read works with read_status tracking."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(3)]
+
+    mark_conversation_read("test_user2", "test_user1", ids[1])
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids[2:]
+
+
+def test_conversation_summary_rows():
+    """Test that conversation summaries track the last message and unread counts."""
+    a = insert_message("test_user1", "first", "test_user2")
+    b = insert_message("test_user1", "second", "test_user2")
+    c = insert_message("test_user2", "reply", "test_user1")
+
+    conversation_id = get_conversation_id("test_user2", "test_user1")
+    assert conversation_id == get_conversation_id("test_user1", "test_user2")
+    assert list_conversations("test_user2") == [
+        (conversation_id, "test_user1", c, "test_user2", "reply", ANY_TS, 2)
+    ]
+    assert list_conversations("test_user1")[0][6] == 1
+
+    mark_messages_as_read([a, a, c])
+    assert list_conversations("test_user2")[0][6] == 1
+    assert list_conversations("test_user1")[0][6] == 0
+
+    # Deleting the last message rolls the summary back to the previous one
+    delete_message(c)
+    summary = list_conversations("test_user2")[0]
+    assert summary[2:5] == (b, "test_user1", "second")
+
+
+def test_conversation_summary_in_cursor_mode(cursor_mode):
+    """Test that unread counts follow read cursors."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(4)]
+    assert list_conversations("test_user2")[0][6] == 4
+
+    mark_conversation_read("test_user2", "test_user1", ids[1])
+    assert list_conversations("test_user2")[0][6] == 2
+
+    delete_message(ids[3])
+    assert list_conversations("test_user2")[0][6] == 1
+
+
+def test_conversation_paging():
+    """Test cursor paging within a single conversation."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(5)]
+    insert_message("test_user1", "other thread", "test_user1")
+
+    conversation_id = get_conversation_id("test_user1", "test_user2")
+    page = get_conversation_messages(conversation_id, limit=3)
+    assert [row[0] for row in page] == ids[2:]
+    page = get_conversation_messages(conversation_id, before_id=page[0][0], limit=3)
+    assert [row[0] for row in page] == ids[:2]
+
+
+def test_conversations_backfilled_for_old_databases():
+    """Test that messages stored before conversations existed get one assigned."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("DROP TABLE messages")
+    conn.execute("DROP TABLE conversations")
+    conn.execute(
+        """
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            read_status INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    conn.execute(
+        "INSERT INTO messages (sender, receiver, content, timestamp) "
+        "VALUES ('test_user1', 'test_user2', 'old', 't')"
+    )
+    conn.commit()
+    conn.close()
+
+    initialize_database()
+
+    conversation_id = get_conversation_id("test_user1", "test_user2")
+    assert conversation_id is not None
+    assert list_conversations("test_user2")[0][4:] == ("old", "t", 1)
+
+
+def test_history_served_from_warm_cache():
+    """Test that repeated history reads hit the cache and stay write-through."""
+    msg_id1 = insert_message("test_user1", "Hello!", "test_user2")
+    assert [row[0] for row in get_unread_messages("test_user2")] == [msg_id1]
+    hits = message_cache.hits
+
+    msg_id2 = insert_message("test_user1", "Again", "test_user2")
+    assert [row[0] for row in get_unread_messages("test_user2")] == [msg_id1, msg_id2]
+    assert message_cache.hits == hits + 1
+
+    get_recent_messages("test_user2")
+    mark_messages_as_read([msg_id1])
+    assert [row[4] for row in get_recent_messages("test_user2")] == [msg_id1]
+    assert [row[0] for row in get_unread_messages("test_user2")] == [msg_id2]
+    assert message_cache.hits == hits + 3
+
+
+def test_search_users_follows_registration():
+    """Test that prefix search sees users added and removed through users.py."""
+    from users import register_user, delete_account
+
+    assert search_users("test_", exclude="test_user1")[0] == ["test_user2"]
+    register_user("test_user3", "pw")
+    assert search_users("test_", limit=5)[0] == ["test_user1", "test_user2", "test_user3"]
+    assert get_all_users_except("test_user1") == ["test_user2", "test_user3"]
+
+    delete_account("test_user2")
+    assert search_users("test_")[0] == ["test_user1", "test_user3"]
+
+
+def test_search_messages_ranked_and_paged():
+    """Test full-text search with snippets and cursor pagination."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute(
+        "INSERT INTO users (username, password_hash) VALUES (?, ?)", ("outsider", "h")
+    )
+    conn.commit()
+    conn.close()
+    ids = [
+        insert_message("test_user1", "lunch tomorrow?", "test_user2"),
+        insert_message("test_user2", "lunch lunch lunch", "test_user1"),
+        insert_message("test_user2", "dinner instead", "test_user1"),
+        insert_message("outsider", "lunch with me", "test_user2"),
+    ]
+
+    rows, cursor = search_messages("test_user1", "lunch", limit=1)
+    assert [row[0] for row in rows] == [ids[1]]  # Most matches ranks first
+    assert rows[0][3] == "[lunch] [lunch] [lunch]"
+    rows, cursor = search_messages("test_user1", "lunch", cursor, limit=1)
+    assert [row[0] for row in rows] == [ids[0]]
+    assert cursor == ""
+
+    # Other users' conversations are not searched, and deletes are unindexed
+    assert len(search_messages("test_user2", "lunch")[0]) == 3
+    delete_message(ids[1])
+    assert [row[0] for row in search_messages("test_user1", "lunch")[0]] == [ids[0]]
+
+    # FTS5 syntax in user input is treated as text
+    assert search_messages("test_user1", 'lunch" OR "dinner')[0] == []
+    with pytest.raises(ValueError):
+        search_messages("test_user1", "lunch", "bogus")
+
+
+def test_search_messages_matches_whole_usernames():
+    """Test that a search is restricted to exact participants inside the index."""
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany(
+        "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+        [("x_test", "h"), ("user1_y", "h")],
+    )
+    conn.commit()
+    conn.close()
+    # Tokenized as words, "x_test user1_y" would contain "test user1"
+    insert_message("x_test", "lunch here", "user1_y")
+    own = insert_message("test_user2", "lunch there", "test_user1")
+
+    assert [row[0] for row in search_messages("test_user1", "lunch")[0]] == [own]
+    assert [row[1] for row in search_messages("user1_y", "lunch")[0]] == ["x_test"]
+
+
+def test_search_index_upgraded_from_content_only():
+    """Test that an index without participants is rebuilt on startup."""
+    message_id = insert_message("test_user1", "lunch tomorrow?", "test_user2")
+    conn = sqlite3.connect(DB_FILE)
+    for statement in database._FTS_DROP:
+        conn.execute(statement)
+    conn.execute(
+        "CREATE VIRTUAL TABLE messages_fts USING fts5("
+        "content, content='messages', content_rowid='id')"
+    )
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+    initialize_database()
+    assert [row[0] for row in search_messages("test_user2", "lunch")[0]] == [message_id]
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    """Write archive partitions to a temporary directory."""
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_archive_read_messages(archive_dir):
+    """Test that old read messages move to the archive and stay pageable."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(4)]
+    mark_messages_as_read(ids[:3])
+    conversation_id = get_conversation_id("test_user1", "test_user2")
+
+    later = datetime.utcnow() + timedelta(days=40)
+    assert archive_read_messages(30, batch_size=2, now=later) == 3
+    assert archive_read_messages(30, now=later) == 0
+    assert len(list(archive_dir.glob("messages-*.db"))) == 1
+
+    # Only the unread message is left in the live table
+    conn = sqlite3.connect(DB_FILE)
+    assert conn.execute("SELECT id FROM messages").fetchall() == [(ids[3],)]
+    conn.close()
+
+    page = get_conversation_messages(conversation_id, limit=2)
+    assert [row[0] for row in page] == ids[2:]
+    assert page[0][2] == "Msg 2"
+    page = get_conversation_messages(conversation_id, before_id=ids[2], limit=5)
+    assert [row[0] for row in page] == ids[:2]
+
+    compact_database()
+    conn = sqlite3.connect(DB_FILE)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.close()
+
+
+def test_archive_pages_open_only_partitions_holding_the_conversation(archive_dir):
+    """Test that archived pages skip partitions without the conversation."""
+    archive.write_messages(
+        [
+            (1, 7, "test_user1", "test_user2", "old", "2024-01-05T00:00:00Z"),
+            (2, 8, "test_user1", "test_user3", "other", "2024-02-05T00:00:00Z"),
+            (3, 7, "test_user2", "test_user1", "newer", "2024-03-05T00:00:00Z"),
+        ]
+    )
+    with patch.object(archive, "_partition_path", wraps=archive._partition_path) as opened:
+        page = archive.get_conversation_messages(7, 2**63 - 1, 10)
+    assert [row[0] for row in page] == [1, 3]
+    assert [c.args[0] for c in opened.call_args_list] == ["2024-03", "2024-01"]
+
+    # Archives written before the index get one built on first use
+    (archive_dir / "index.db").unlink()
+    assert archive.get_conversation_messages(8, 2**63 - 1, 10)[0][2] == "other"
+
+
+def test_unarchived_conversation_skips_archive(archive_dir):
+    """Test that a short page does not look in the archive if nothing was archived."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(2)]
+    conversation_id = get_conversation_id("test_user1", "test_user2")
+    with patch.object(archive, "get_conversation_messages") as archived:
+        page = get_conversation_messages(conversation_id, limit=5)
+    assert [row[0] for row in page] == ids
+    archived.assert_not_called()
+
+
+def test_archive_keeps_recent_and_unread(archive_dir):
+    """Test that messages inside the retention period or unread are kept."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(2)]
+    mark_messages_as_read(ids[:1])
+
+    assert archive_read_messages(30) == 0
+    assert archive_read_messages(30, now=datetime.utcnow() + timedelta(days=40)) == 1
+
+
+def test_archive_cursor_mode(archive_dir, cursor_mode):
+    """Test that cursor mode archives messages up to the read cursor."""
+    ids = [insert_message("test_user1", f"Msg {i}", "test_user2") for i in range(3)]
+    mark_conversation_read("test_user2", "test_user1", ids[1])
+
+    later = datetime.utcnow() + timedelta(days=40)
+    assert archive_read_messages(30, now=later) == 2
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids[2:]
+
+
+def test_archive_interleaved_with_unread(archive_dir):
+    """Test that paging merges archived messages lying between live ones."""
+    ids = []
+    for i in range(3):
+        ids.append(insert_message("test_user1", f"Read {i}", "test_user2"))
+        ids.append(insert_message("test_user2", f"Unread {i}", "test_user1"))
+    mark_messages_as_read(ids[0::2])
+    conversation_id = get_conversation_id("test_user1", "test_user2")
+
+    later = datetime.utcnow() + timedelta(days=40)
+    assert archive_read_messages(30, now=later) == 3
+
+    seen, before_id = [], None
+    while True:
+        page = get_conversation_messages(conversation_id, before_id=before_id, limit=2)
+        if not page:
+            break
+        assert [row[0] for row in page] == sorted(row[0] for row in page)
+        seen = [row[0] for row in page] + seen
+        before_id = page[0][0]
+    assert seen == ids
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    """Spread messages over four shard files."""
+    monkeypatch.setattr(database, "MESSAGE_SHARDS", 4)
+    initialize_database()
+    conn = sqlite3.connect(DB_FILE)
+    conn.executemany(
+        "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+        [(f"peer{i}", "hash") for i in range(8)],
+    )
+    conn.commit()
+    conn.close()
+    yield database._shards()
+    database._shards().close()
+    database._router = None
+    for i in range(1, 4):
+        if os.path.exists(f"chat_app-shard{i}.db"):
+            os.remove(f"chat_app-shard{i}.db")
+
+
+def test_sharded_messages(sharded):
+    """Test that cross-shard reads merge per-shard results in ID order."""
+    ids = [insert_message(f"peer{i}", f"hello {i}", "test_user1") for i in range(8)]
+    assert ids == sorted(ids)
+    assert len({sharded.shard_for_id(message_id).index for message_id in ids}) > 1
+
+    assert [row[0] for row in get_unread_messages("test_user1")] == ids
+    assert [row[0] for row in get_unread_messages("test_user1", limit=3)] == ids[:3]
+
+    mark_messages_as_read(ids[:6])
+    assert [row[4] for row in get_recent_messages("test_user1", limit=4)] == ids[2:6]
+    assert [row[0] for row in get_unread_messages("test_user1")] == ids[6:]
+
+    conversations = list_conversations("test_user1")
+    assert [row[2] for row in conversations] == ids[::-1]
+    conversation_id = get_conversation_id("peer3", "test_user1")
+    assert conversation_id == conversations[4][0]
+    assert [row[0] for row in get_conversation_messages(conversation_id)] == [ids[3]]
+
+    assert len(search_messages("test_user1", "hello")[0]) == 8
+    assert delete_message(ids[3])
+    assert get_conversation_messages(conversation_id) == []
+    assert [row[3] for row in get_undelivered_messages("test_user1")] == ids[:3] + ids[4:]
+
+
+def test_sharded_search_paging(sharded):
+    """Test that paging a search across shards returns every hit exactly once."""
+    ids = [
+        insert_message(f"peer{i % 8}", "lunch " * (1 + i % 3) + "filler " * i, "test_user1")
+        for i in range(24)
+    ]
+    assert len({sharded.shard_for_id(message_id).index for message_id in ids}) > 1
+
+    seen, cursor = [], ""
+    while True:
+        rows, cursor = search_messages("test_user1", "lunch", cursor, limit=5)
+        seen.extend(row[0] for row in rows)
+        if not cursor:
+            break
+    assert sorted(seen) == ids
+
+    with pytest.raises(ValueError):
+        search_messages("test_user1", "lunch", "-1.0:1")
+
+
+def test_user_and_room_writes_use_the_main_writer(sharded):
+    """Test that users, settings and rooms are written by shard 0's writer thread."""
+    main = sharded.shards[0]
+    with patch.object(main, "write", wraps=main.write) as write:
+        assert database.create_user("carol", "hash")
+        assert not database.create_user("carol", "hash")
+        set_n_unread_messages("carol", 5)
+        room_id = create_room("lobby", "carol")
+        add_room_member(room_id, "test_user1")
+        insert_room_message(room_id, "carol", "hi")
+    assert write.call_count == 6
+    assert get_user_info("carol") == ("carol", 5)
+    assert get_room_members(room_id) == ["carol", "test_user1"]
+
+
+def test_sharded_conversation_read(sharded, cursor_mode):
+    """Test that a conversation's cursor lives on the conversation's shard."""
+    initialize_database()
+    ids = [insert_message("peer1", f"Msg {i}", "test_user2") for i in range(3)]
+    mark_conversation_read("test_user2", "peer1", ids[1])
+    assert [row[0] for row in get_unread_messages("test_user2")] == ids[2:]
@@ -145,8 +145,24 @@ class TestMessagesContainer:
 
 class TestChatBox:
 
-    def test_update_user_list(self, chat_box):
-        """Test updating user list."""
-        test_users = ["user1", "user2", "user3"]
-        chat_box.update_user_list(test_users)
-        assert chat_box.selected_user.get() == "user1"
+    def test_search_users_by_prefix(self, chat_box):
+        """Test that recipients are searched by the typed prefix."""
+        chat_box.selected_user.set("us")
+        with patch.object(chat_box.master, "send_message_via_ws") as mock_send:
+            chat_box.search_users()
+        mock_send.assert_called_once_with(
+            {"action": "search_users", "prefix": "us", "limit": 10}
+        )
+
+    def test_show_and_select_suggestions(self, chat_box):
+        """Test listing search results and picking one."""
+        chat_box.selected_user.set("us")
+        chat_box.show_suggestions("u", ["u1"])  # Stale: typed on since
+        assert chat_box.suggestions.size() == 0
+        chat_box.show_suggestions("us", ["user1", "user2"])
+        assert chat_box.suggestions.get(0, tk.END) == ("user1", "user2")
+
+        chat_box.suggestions.selection_set(1)
+        chat_box.select_suggestion()
+        assert chat_box.selected_user.get() == "user2"
+        assert chat_box.suggestions.size() == 0
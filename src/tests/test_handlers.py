@@ -1,4 +1,8 @@
 import pytest
+import socket
+import struct
+import threading
+import time
 from unittest.mock import Mock, patch, MagicMock
 from datetime import datetime
 
@@ -10,7 +14,10 @@ from handlers import (
     handle_login,
     handle_register,
     handle_send_message,
+    handle_ack_delivered,
+    handle_batch,
     handle_mark_as_read,
+    handle_mark_conversation_read,
     handle_set_n_unread_messages,
     handle_unknown_action,
     handle_echo,
@@ -18,10 +25,28 @@ from handlers import (
     handle_unread_messages,
     handle_delete_message,
     handle_get_users,
+    handle_search_users,
+    handle_search_messages,
     handle_delete_account,
+    handle_create_room,
+    handle_join_room,
+    handle_send_room_message,
+    handle_get_room_history,
+    handle_mark_room_read,
+    handle_get_conversation,
+    handle_list_conversations,
+    push_to_users,
     online_users,
     online_users_lock,
+    online_room_members,
+    _reap_connection,
+    close_all_connections,
+    dispatch,
 )
+import handlers
+from heartbeat import Liveness
+from custom_protocol import MessageDecodeError
+from utils import WS_CLOSE_GOING_AWAY
 
 
 @pytest.fixture
@@ -58,7 +83,9 @@ def mock_database():
         "handlers.register_user"
     ) as mock_reg, patch("handlers.insert_message") as mock_insert, patch(
         "handlers.mark_messages_as_read"
-    ) as mock_mark_read:
+    ) as mock_mark_read, patch(
+        "handlers.get_user_rooms", return_value=[]
+    ):
         mock_auth.return_value = True
         mock_reg.return_value = (True, "Registration successful")
         mock_insert.return_value = 1
@@ -150,6 +177,302 @@ class TestHandleSendMessage:
         assert "authentication" in sent_data["message"].lower()
 
 
+class TestDeliveryAcks:
+    def test_login_replays_undelivered(self, client_context, mock_websocket):
+        undelivered = [("alice", "hi", "t1", 3), ("bob", "yo", "t2", 8)]
+        with patch("handlers.authenticate_user", return_value=True), patch(
+            "handlers.get_user_rooms", return_value=[]
+        ), patch(
+            "handlers.get_undelivered_messages", return_value=undelivered
+        ), patch.dict("handlers.online_users", {}, clear=True):
+            handle_login(
+                client_context, {"action": "login", "username": "carol", "password": "pw"}
+            )
+
+        sent = [call[0][1] for call in mock_websocket.send_ws_frame.call_args_list]
+        assert [frame["action"] for frame in sent] == ["confirm_login", "undelivered_messages"]
+        assert sent[1]["messages"] == [
+            {"id": 3, "from": "alice", "message": "hi", "timestamp": "t1"},
+            {"id": 8, "from": "bob", "message": "yo", "timestamp": "t2"},
+        ]
+
+    def test_ack_marks_delivered_without_reply(self, authenticated_context, mock_websocket):
+        with patch("handlers.mark_messages_delivered", return_value=2) as mock_mark:
+            handle_ack_delivered(
+                authenticated_context, {"action": "ack_delivered", "ids": [3, 8]}
+            )
+        mock_mark.assert_called_once_with("test_user", [3, 8])
+        mock_websocket.send_ws_frame.assert_not_called()
+
+    def test_ack_rejects_invalid_ids(self, authenticated_context, mock_websocket):
+        with patch("handlers.mark_messages_delivered") as mock_mark:
+            handle_ack_delivered(
+                authenticated_context, {"action": "ack_delivered", "ids": "3"}
+            )
+            handle_ack_delivered(
+                authenticated_context,
+                {"action": "ack_delivered", "ids": list(range(501))},
+            )
+        mock_mark.assert_not_called()
+        sent = [call[0][1] for call in mock_websocket.send_ws_frame.call_args_list]
+        assert [frame["status"] for frame in sent] == ["error", "error"]
+
+
+class TestHeartbeat:
+    def test_ping_is_answered_with_pong(self):
+        server_sock, client_sock = socket.socketpair()
+        with patch("handlers.perform_handshake", return_value=True):
+            thread = threading.Thread(
+                target=handle_client_connection, args=(server_sock, ("127.0.0.1", 1))
+            )
+            thread.start()
+            client_sock.sendall(b"\x89\x82abcd" + bytes((ord("h") ^ 0x61, ord("i") ^ 0x62)))
+            assert client_sock.recv(16) == b"\x8a\x02hi"
+            client_sock.sendall(b"\x88\x00")  # Close
+            thread.join(5)
+        client_sock.close()
+        assert not thread.is_alive()
+
+    def test_reaping_removes_presence_and_wakes_reader(self, mock_addr):
+        server_sock, client_sock = socket.socketpair()
+        context = ClientContext(server_sock, mock_addr)
+        context.authenticated = True
+        context.username = "idle_user"
+        with patch.dict("handlers.online_users", {"idle_user": server_sock}, clear=True):
+            _reap_connection(Liveness(server_sock, context, 0.0))
+            assert "idle_user" not in online_users
+        # The reader blocked on this socket sees end of stream
+        assert server_sock.recv(1) == b""
+        server_sock.close()
+        client_sock.close()
+
+    def test_ping_is_skipped_while_a_frame_is_being_sent(self, mock_addr):
+        server_sock, client_sock = socket.socketpair()
+        liveness = Liveness(server_sock, ClientContext(server_sock, mock_addr), 0.0)
+        client_sock.setblocking(False)
+        with handlers.websocket.send_lock(server_sock):
+            handlers._send_ping(liveness)
+            with pytest.raises(BlockingIOError):
+                client_sock.recv(16)
+        handlers._send_ping(liveness)
+        assert client_sock.recv(16) == handlers._PING_FRAME
+        server_sock.close()
+        client_sock.close()
+
+
+class TestShutdown:
+    def test_close_all_connections_sends_going_away(self):
+        server_sock, client_sock = socket.socketpair()
+        with patch("handlers.perform_handshake", return_value=True), patch(
+            "handlers.going_away", threading.Event()
+        ):
+            thread = threading.Thread(
+                target=handle_client_connection, args=(server_sock, ("127.0.0.1", 1))
+            )
+            thread.start()
+            while not handlers.open_connections:
+                time.sleep(0.01)
+            assert close_all_connections(5) == 0
+            thread.join(5)
+        assert not thread.is_alive()
+        assert not handlers.open_connections
+        frame = client_sock.recv(64)
+        client_sock.close()
+        assert frame[0] == 0x88
+        assert struct.unpack("!H", frame[2:4])[0] == WS_CLOSE_GOING_AWAY
+
+
+class TestCloseHandshake:
+    def _serve(self, frames):
+        server_sock, client_sock = socket.socketpair()
+        with patch("handlers.perform_handshake", return_value=True):
+            thread = threading.Thread(
+                target=handle_client_connection, args=(server_sock, ("127.0.0.1", 1))
+            )
+            thread.start()
+            client_sock.sendall(frames)
+            client_sock.shutdown(socket.SHUT_WR)
+            thread.join(5)
+        assert not thread.is_alive()
+        received = client_sock.recv(256)
+        client_sock.close()
+        return received
+
+    def test_close_frame_is_echoed(self):
+        frame = self._serve(b"\x88\x02" + struct.pack("!H", 1000))
+        assert frame == b"\x88\x02" + struct.pack("!H", 1000)
+
+    def test_protocol_error_closes_with_1002(self):
+        frame = self._serve(b"\x80\x02{}")  # Continuation without a start
+        assert frame[0] == 0x88
+        assert struct.unpack("!H", frame[2:4])[0] == 1002
+
+
+class TestFailedRequests:
+    def test_failing_handler_is_answered_with_error(self, authenticated_context, mock_websocket):
+        failing = Mock(side_effect=TypeError("bad before_id"))
+        with patch.dict("handlers.ACTION_HANDLERS", {"echo": failing}):
+            dispatch(authenticated_context, {"action": "echo", "req_id": 7})
+
+        reply = mock_websocket.send_ws_frame.call_args[0][1]
+        assert reply["status"] == "error"
+        assert reply["req_id"] == 7
+
+    def test_failing_request_closes_with_1011(self):
+        server_sock, client_sock = socket.socketpair()
+        with patch("handlers.perform_handshake", return_value=True), patch.object(
+            handlers.websocket, "decode_payload", return_value={"action": "echo"}
+        ), patch("handlers.dispatch", side_effect=RuntimeError("boom")):
+            thread = threading.Thread(
+                target=handle_client_connection, args=(server_sock, ("127.0.0.1", 1))
+            )
+            thread.start()
+            client_sock.sendall(b"\x81\x02{}")
+            thread.join(5)
+        assert not thread.is_alive()
+        frame = client_sock.recv(256)
+        client_sock.close()
+        assert frame[0] == 0x88
+        assert struct.unpack("!H", frame[2:4])[0] == 1011
+
+    def test_undecodable_field_closes_with_1007(self, authenticated_context):
+        failing = Mock(side_effect=MessageDecodeError("Malformed field 'message'"))
+        with patch.dict("handlers.ACTION_HANDLERS", {"echo": failing}), patch(
+            "handlers._abort_connection"
+        ) as abort:
+            handlers._run_request(authenticated_context, {"action": "echo"})
+
+        abort.assert_called_once()
+        assert abort.call_args[0][1] == 1007
+
+
+class TestRateLimit:
+    def test_limited_request_is_refused_with_retry_after(
+        self, authenticated_context, mock_websocket, rate_limiter
+    ):
+        echo = Mock()
+        with patch.dict("handlers.ACTION_HANDLERS", {"echo": echo}), patch.object(
+            rate_limiter, "check", side_effect=[0, 1.5]
+        ):
+            dispatch(authenticated_context, {"action": "echo", "message": "a", "req_id": 1})
+            dispatch(authenticated_context, {"action": "echo", "message": "b", "req_id": 2})
+
+        assert echo.call_count == 1
+        reply = mock_websocket.send_ws_frame.call_args[0][1]
+        assert reply["action"] == "rate_limited"
+        assert reply["status"] == "error"
+        assert reply["limited_action"] == "echo"
+        assert reply["retry_after_ms"] == 1500
+        assert reply["req_id"] == 2
+
+
+class TestLoginBootstrap:
+    def test_bootstrap_replaces_confirm_login(self, client_context, mock_websocket):
+        bootstrap = (
+            [(3, "alice", "hi", "t1")],
+            [("carol", "old", "alice", "t0", 1)],
+            ["alice", "bob"],
+        )
+        with patch("handlers.authenticate_user", return_value=True), patch(
+            "handlers.get_user_rooms", return_value=[]
+        ), patch(
+            "handlers.get_login_bootstrap", return_value=bootstrap
+        ) as mock_bootstrap, patch(
+            "handlers.get_undelivered_messages", return_value=[]
+        ), patch.dict("handlers.online_users", {}, clear=True):
+            handle_login(
+                client_context,
+                {"action": "login", "username": "carol", "password": "pw", "bootstrap": 1},
+            )
+
+        mock_bootstrap.assert_called_once_with("carol")
+        sent = [call[0][1] for call in mock_websocket.send_ws_frame.call_args_list]
+        assert len(sent) == 1
+        assert sent[0]["action"] == "login_bootstrap"
+        assert sent[0]["username"] == "carol"
+        assert sent[0]["unread"] == [
+            {"id": 3, "from": "alice", "message": "hi", "timestamp": "t1"}
+        ]
+        assert sent[0]["recent"] == [
+            {"from": "carol", "message": "old", "timestamp": "t0", "id": 1}
+        ]
+        assert sent[0]["users"] == ["alice", "bob"]
+
+
+class TestRequestIds:
+    def test_replies_echo_req_id_but_pushes_do_not(self, mock_websocket):
+        sender_conn, receiver_conn = Mock(), Mock()
+        frames = [
+            {"action": "send_message", "receiver": "bob", "message": "hi", "req_id": 9},
+            {"action": "nope", "req_id": 10},
+            None,
+        ]
+        mock_websocket.read_ws_frame.side_effect = frames
+        with patch("handlers.perform_handshake", return_value=True), patch(
+            "handlers.insert_message", return_value=1
+        ), patch.dict("handlers.online_users", {"bob": receiver_conn}, clear=True):
+            context_patch = patch(
+                "handlers.ClientContext",
+                side_effect=lambda conn, addr: _authenticated(conn, addr),
+            )
+            with context_patch:
+                handle_client_connection(sender_conn, ("127.0.0.1", 1))
+
+        sent = [(c[0][0], c[0][1]) for c in mock_websocket.send_ws_frame.call_args_list]
+        push = [frame for conn, frame in sent if conn is receiver_conn]
+        replies = [frame for conn, frame in sent if conn is sender_conn]
+        assert "req_id" not in push[0]
+        assert [(f["action"], f["req_id"]) for f in replies] == [
+            ("confirm_send_message", 9),
+            ("error", 10),
+        ]
+
+
+class TestBatch:
+    def test_batch_replies_in_one_frame(self, authenticated_context, mock_websocket):
+        data = {
+            "action": "batch",
+            "req_id": 1,
+            "requests": [
+                {"action": "echo", "message": "a", "req_id": 2},
+                {"action": "ack_delivered", "ids": []},
+                {"action": "nope", "req_id": 3},
+                {"action": "get_users"},
+            ],
+        }
+        with patch("handlers.get_all_users_except", return_value=["bob"]):
+            handle_batch(authenticated_context, data)
+
+        mock_websocket.send_ws_frame.assert_called_once()
+        sent = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent["action"] == "batch_response"
+        assert sent["req_id"] == 1
+        assert [(r["action"], r.get("req_id")) for r in sent["responses"]] == [
+            ("confirm_echo", 2),
+            ("error", 3),
+            ("user_list", None),
+        ]
+
+    def test_batch_rejects_nesting_and_oversize(self, authenticated_context, mock_websocket):
+        handle_batch(
+            authenticated_context,
+            {"action": "batch", "requests": [{"action": "batch", "requests": []}]},
+        )
+        handle_batch(
+            authenticated_context,
+            {"action": "batch", "requests": [{"action": "echo"}] * 51},
+        )
+        sent = [c[0][1] for c in mock_websocket.send_ws_frame.call_args_list]
+        assert [frame["status"] for frame in sent] == ["error", "error"]
+
+
+def _authenticated(conn, addr):
+    context = ClientContext(conn, addr)
+    context.authenticated = True
+    context.username = "alice"
+    return context
+
+
 class TestHandleMarkAsRead:
     def test_mark_messages_read_success(
         self, authenticated_context, mock_websocket, mock_database
@@ -174,6 +497,27 @@ class TestHandleMarkAsRead:
         assert "should be a list" in sent_data["message"]
 
 
+class TestHandleMarkConversationRead:
+    def test_mark_conversation_read(self, authenticated_context, mock_websocket):
+        data = {"action": "mark_conversation_read", "peer": "alice", "last_read_id": 9}
+        with patch("handlers.mark_conversation_read") as mock_mark:
+            handle_mark_conversation_read(authenticated_context, data)
+            mock_mark.assert_called_once_with("test_user", "alice", 9)
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "success"
+        assert sent_data["action"] == "confirm_mark_conversation_read"
+
+    def test_mark_conversation_read_invalid_id(
+        self, authenticated_context, mock_websocket
+    ):
+        data = {"action": "mark_conversation_read", "peer": "alice"}
+        handle_mark_conversation_read(authenticated_context, data)
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+
 class TestHandleSetNUnreadMessages:
     def test_missing_n_unread_messages(self, authenticated_context, mock_websocket):
         data = {"action": "set_n_unread_messages"}
@@ -353,6 +697,61 @@ class TestHandleGetUsers:
             assert sent_data["users"] == fake_users
 
 
+class TestHandleSearchUsers:
+    def test_search_users_success(self, authenticated_context, mock_websocket):
+        with patch(
+            "handlers.search_users", return_value=(["alice", "alan"], 7)
+        ) as mock_search:
+            handle_search_users(
+                authenticated_context, {"action": "search_users", "prefix": "al", "limit": 500}
+            )
+            mock_search.assert_called_once_with("al", 100, exclude="test_user")
+            sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+            assert sent_data["action"] == "user_search"
+            assert sent_data["users"] == ["alice", "alan"]
+            assert sent_data["version"] == 7
+
+    def test_search_users_invalid_limit(self, authenticated_context, mock_websocket):
+        handle_search_users(
+            authenticated_context, {"action": "search_users", "prefix": "a", "limit": "x"}
+        )
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+
+class TestHandleSearchMessages:
+    def test_search_messages_success(self, authenticated_context, mock_websocket):
+        rows = [(3, "bob", "test_user", "[lunch]?", "t1")]
+        with patch(
+            "handlers.search_messages", return_value=(rows, "-1.5:3")
+        ) as mock_search:
+            handle_search_messages(
+                authenticated_context, {"action": "search_messages", "query": "lunch"}
+            )
+            mock_search.assert_called_once_with("test_user", "lunch", "", 20)
+            sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+            assert sent_data["action"] == "search_results"
+            assert sent_data["results"] == [
+                {"id": 3, "from": "bob", "to": "test_user", "snippet": "[lunch]?", "timestamp": "t1"}
+            ]
+            assert sent_data["next_cursor"] == "-1.5:3"
+
+    def test_search_messages_requires_query(self, authenticated_context, mock_websocket):
+        handle_search_messages(authenticated_context, {"action": "search_messages", "query": " "})
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+    def test_search_messages_bad_cursor(self, authenticated_context, mock_websocket):
+        with patch("handlers.search_messages", side_effect=ValueError("Invalid search cursor.")):
+            handle_search_messages(
+                authenticated_context,
+                {"action": "search_messages", "query": "a", "cursor": "x"},
+            )
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+        assert "cursor" in sent_data["message"]
+
+
 class TestHandleDeleteAccount:
     def test_delete_account_unauthenticated(self, client_context, mock_websocket):
         data = {"action": "delete_account"}
@@ -379,6 +778,233 @@ class TestHandleDeleteAccount:
                 assert authenticated_context.username not in online_users
 
 
+class TestPushToUsers:
+    def test_push_encodes_once_for_online_users(self, mock_websocket):
+        conns = {"alice": Mock(), "bob": Mock()}
+        with patch.dict("handlers.online_users", conns, clear=True):
+            delivered = push_to_users(
+                ["alice", "bob", "offline_user"], {"action": "received_message"}
+            )
+
+        assert delivered == 2
+        mock_websocket.prepare_frame.assert_called_once()
+        assert mock_websocket.prepare_frame.call_args[0][0]["status"] == "success"
+        frame = mock_websocket.prepare_frame.return_value
+        sent_to = [c[0] for c in mock_websocket.send_prepared.call_args_list]
+        assert sent_to == [(conns["alice"], frame), (conns["bob"], frame)]
+
+    def test_push_skips_encoding_when_nobody_is_online(self, mock_websocket):
+        with patch.dict("handlers.online_users", {}, clear=True):
+            assert push_to_users(["alice"], {"action": "received_message"}) == 0
+        mock_websocket.prepare_frame.assert_not_called()
+
+    def test_push_failure_is_isolated(self, mock_websocket):
+        conns = {"alice": Mock(), "bob": Mock()}
+        mock_websocket.send_prepared.side_effect = [BrokenPipeError("gone"), None]
+        with patch.dict("handlers.online_users", conns, clear=True):
+            delivered = push_to_users(["alice", "bob"], {"action": "received_message"})
+
+        assert delivered == 1
+        assert mock_websocket.send_prepared.call_count == 2
+
+
+class TestConversations:
+    def test_get_conversation_page(self, authenticated_context, mock_websocket):
+        rows = [(3, "alice", "a", "t1"), (4, "test_user", "b", "t2")]
+        data = {"action": "get_conversation", "peer": "alice", "before_id": 9, "limit": 2}
+        with patch("handlers.get_conversation_id", return_value=12), patch(
+            "handlers.get_conversation_messages", return_value=rows
+        ) as mock_page:
+            handle_get_conversation(authenticated_context, data)
+            mock_page.assert_called_once_with(12, before_id=9, limit=2)
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "conversation"
+        assert sent_data["conversation_id"] == 12
+        assert [m["id"] for m in sent_data["messages"]] == [3, 4]
+        assert sent_data["next_before_id"] == 3
+
+    def test_get_conversation_without_history(
+        self, authenticated_context, mock_websocket
+    ):
+        data = {"action": "get_conversation", "peer": "stranger"}
+        with patch("handlers.get_conversation_id", return_value=None), patch(
+            "handlers.get_conversation_messages"
+        ) as mock_page:
+            handle_get_conversation(authenticated_context, data)
+            mock_page.assert_not_called()
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["messages"] == []
+        assert sent_data["next_before_id"] == 0
+
+    def test_get_conversation_rejects_invalid_before_id(
+        self, authenticated_context, mock_websocket
+    ):
+        data = {"action": "get_conversation", "peer": "alice", "before_id": "9"}
+        with patch("handlers.get_conversation_id", return_value=12), patch(
+            "handlers.get_conversation_messages"
+        ) as mock_page:
+            handle_get_conversation(authenticated_context, data)
+            mock_page.assert_not_called()
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+    def test_list_conversations(self, authenticated_context, mock_websocket):
+        rows = [(12, "alice", 4, "alice", "hi", "t", 2)]
+        with patch("handlers.list_conversations", return_value=rows) as mock_list:
+            handle_list_conversations(
+                authenticated_context, {"action": "list_conversations", "limit": 500}
+            )
+            mock_list.assert_called_once_with("test_user", limit=200)
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "conversation_list"
+        assert sent_data["conversations"] == [
+            {
+                "conversation_id": 12,
+                "peer": "alice",
+                "last_message_id": 4,
+                "last_from": "alice",
+                "last_message": "hi",
+                "last_timestamp": "t",
+                "unread_count": 2,
+            }
+        ]
+
+
+class TestRooms:
+    def test_login_registers_room_presence(self, client_context, mock_websocket):
+        data = {"action": "login", "username": "test_user", "password": "pw"}
+        with patch("handlers.authenticate_user", return_value=True), patch(
+            "handlers.get_user_rooms", return_value=[(7, "general", "group")]
+        ), patch.dict("handlers.online_users", {}, clear=True), patch.dict(
+            "handlers.online_room_members", {}, clear=True
+        ):
+            handle_login(client_context, data)
+            assert online_room_members[7] == {"test_user"}
+        assert client_context.room_ids == {7}
+
+    def test_create_room(self, authenticated_context, mock_websocket):
+        data = {"action": "create_room", "name": "general", "kind": "channel"}
+        with patch("handlers.create_room", return_value=3) as mock_create, patch.dict(
+            "handlers.online_room_members", {}, clear=True
+        ):
+            handle_create_room(authenticated_context, data)
+            mock_create.assert_called_once_with("general", "test_user", "channel")
+            assert online_room_members[3] == {"test_user"}
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "confirm_create_room"
+        assert sent_data["room_id"] == 3
+        assert 3 in authenticated_context.room_ids
+
+    def test_create_room_invalid_kind(self, authenticated_context, mock_websocket):
+        handle_create_room(
+            authenticated_context,
+            {"action": "create_room", "name": "general", "kind": "forum"},
+        )
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+    def test_join_missing_room(self, authenticated_context, mock_websocket):
+        with patch("handlers.get_room", return_value=None):
+            handle_join_room(authenticated_context, {"action": "join_room", "room_id": 9})
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+        assert "not found" in sent_data["message"].lower()
+
+    def test_send_room_message_fans_out_to_online_members(
+        self, authenticated_context, mock_websocket
+    ):
+        authenticated_context.room_ids = {5}
+        data = {"action": "send_room_message", "room_id": 5, "message": "Hi all"}
+        with patch(
+            "handlers.get_room", return_value=(5, "general", "owner", "group")
+        ), patch("handlers.insert_room_message", return_value=42), patch(
+            "handlers.push_to_users", return_value=2
+        ) as mock_push, patch.dict(
+            "handlers.online_room_members",
+            {5: {"test_user", "alice", "bob"}},
+            clear=True,
+        ):
+            handle_send_room_message(authenticated_context, data)
+
+        receivers, payload = mock_push.call_args[0]
+        assert sorted(receivers) == ["alice", "bob"]
+        assert payload["action"] == "received_room_message"
+        assert payload["id"] == 42
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "confirm_send_room_message"
+
+    def test_send_room_message_requires_membership(
+        self, authenticated_context, mock_websocket
+    ):
+        data = {"action": "send_room_message", "room_id": 5, "message": "Hi"}
+        with patch("handlers.insert_room_message") as mock_insert:
+            handle_send_room_message(authenticated_context, data)
+        mock_insert.assert_not_called()
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert "not a member" in sent_data["message"]
+
+    def test_only_owner_posts_to_channel(self, authenticated_context, mock_websocket):
+        authenticated_context.room_ids = {5}
+        data = {"action": "send_room_message", "room_id": 5, "message": "Hi"}
+        with patch(
+            "handlers.get_room", return_value=(5, "news", "owner", "channel")
+        ), patch("handlers.insert_room_message") as mock_insert:
+            handle_send_room_message(authenticated_context, data)
+        mock_insert.assert_not_called()
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["status"] == "error"
+
+    def test_get_room_history_paging(self, authenticated_context, mock_websocket):
+        authenticated_context.room_ids = {5}
+        rows = [(10, "alice", "a", "t1"), (11, "bob", "b", "t2")]
+        data = {"action": "get_room_history", "room_id": 5, "before_id": 0, "limit": 2}
+        with patch("handlers.get_room_history", return_value=rows) as mock_history, patch(
+            "handlers.get_room_read_cursor", return_value=11
+        ):
+            handle_get_room_history(authenticated_context, data)
+            mock_history.assert_called_once_with(5, before_id=None, limit=2)
+
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "room_history"
+        assert [m["id"] for m in sent_data["messages"]] == [10, 11]
+        assert sent_data["next_before_id"] == 10
+        assert sent_data["last_read_id"] == 11
+
+    def test_get_room_history_rejects_invalid_before_id(
+        self, authenticated_context, mock_websocket
+    ):
+        authenticated_context.room_ids = {5}
+        for before_id in ("10", -1, 2.5):
+            data = {"action": "get_room_history", "room_id": 5, "before_id": before_id}
+            with patch("handlers.get_room_history") as mock_history:
+                handle_get_room_history(authenticated_context, data)
+            mock_history.assert_not_called()
+            sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+            assert sent_data["status"] == "error"
+
+    def test_mark_room_read_requires_membership(
+        self, authenticated_context, mock_websocket
+    ):
+        data = {"action": "mark_room_read", "room_id": 5, "last_read_id": 10}
+        with patch("handlers.mark_room_read") as mock_mark:
+            handle_mark_room_read(authenticated_context, data)
+        mock_mark.assert_not_called()
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert "not a member" in sent_data["message"]
+
+        authenticated_context.room_ids = {5}
+        with patch("handlers.mark_room_read") as mock_mark:
+            handle_mark_room_read(authenticated_context, data)
+        mock_mark.assert_called_once_with(5, authenticated_context.username, 10)
+        sent_data = mock_websocket.send_ws_frame.call_args[0][1]
+        assert sent_data["action"] == "confirm_mark_room_read"
+
+
 @pytest.mark.asyncio
 async def test_handle_client_connection(mock_conn, mock_addr, mock_websocket):
     with patch("handlers.perform_handshake") as mock_handshake:
@@ -0,0 +1,74 @@
+import metrics
+from heartbeat import Heartbeat, TimerWheel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel_expires_at_deadlines():
+    wheel = TimerWheel(tick=1.0, slots=8, now=0.0)
+    wheel.schedule("soon", 2.5)
+    wheel.schedule("late", 21.0)  # More than two revolutions away
+    wheel.schedule("past", -5.0)
+    assert len(wheel) == 3
+
+    assert wheel.advance(0.5) == []
+    assert wheel.advance(1.0) == ["past"]
+    assert wheel.advance(3.0) == ["soon"]
+    assert wheel.advance(20.0) == []
+    assert wheel.advance(21.0) == ["late"]
+    assert len(wheel) == 0
+
+
+def make_heartbeat(clock, pings, reaped):
+    return Heartbeat(
+        ping_interval=30,
+        idle_timeout=90,
+        tick=1.0,
+        send_ping=lambda liveness: pings.append(liveness.conn),
+        on_reap=lambda liveness: reaped.append(liveness.conn),
+        clock=clock,
+    )
+
+
+def test_silent_connection_is_pinged_then_reaped():
+    clock, pings, reaped = FakeClock(), [], []
+    heartbeat = make_heartbeat(clock, pings, reaped)
+    heartbeat.register("silent")
+    before = metrics.get("heartbeat.reaped")
+
+    for _ in range(95):
+        clock.now += 1
+        heartbeat.run_once()
+
+    # Pinged every ping interval of silence, reaped at the idle timeout
+    assert pings == ["silent", "silent"]
+    assert reaped == ["silent"]
+    assert metrics.get("heartbeat.reaped") == before + 1
+
+
+def test_active_and_closed_connections_are_left_alone():
+    clock, pings, reaped = FakeClock(), [], []
+    heartbeat = make_heartbeat(clock, pings, reaped)
+    active = heartbeat.register("active")
+    closed = heartbeat.register("closed")
+    heartbeat.unregister(closed)
+
+    for second in range(200):
+        clock.now += 1
+        if second % 20 == 0:
+            heartbeat.touch(active)
+        heartbeat.run_once()
+
+    assert pings == []
+    assert reaped == []
+
+
+def test_disabled_heartbeat_does_not_start():
+    heartbeat = Heartbeat(ping_interval=0, idle_timeout=0)
+    assert heartbeat.start() is None
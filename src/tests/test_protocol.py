@@ -3,9 +3,11 @@
 import pytest
 import struct
 import sys
+from collections.abc import Mapping
+from unittest.mock import patch
 
 
-from custom_protocol import Encoder, load_protocols, Decoder
+from custom_protocol import Encoder, load_protocols, Decoder, MessageDecodeError
 
 
 @pytest.fixture(scope="module")
@@ -183,6 +185,252 @@ def test_encode_decode_message_with_object(encoder_decoder):
     ), "Decoded message does not match the original."
 
 
+def test_encode_decode_room_history(encoder_decoder):
+    """
+    Integration Test: Encode and decode a room history page.
+    """
+    encoder, decoder = encoder_decoder
+
+    original_message = {
+        "action": "room_history",
+        "room_id": 4,
+        "messages": [
+            {"id": 10, "from": "bob", "message": "Hey!", "timestamp": "t1"},
+            {"id": 11, "from": "alice", "message": "Hi!", "timestamp": "t2"},
+        ],
+        "next_before_id": 10,
+        "last_read_id": 11,
+        "status": "success",
+    }
+
+    actual_encoded = encoder.encode_message(original_message)
+    decoded_message = decoder.decode_message(actual_encoded)
+    assert (
+        decoded_message == original_message
+    ), "Decoded message does not match the original."
+
+
+def test_encode_decode_user_search(encoder_decoder):
+    """
+    Integration Test: Encode and decode a user search result.
+    """
+    encoder, decoder = encoder_decoder
+
+    original_message = {
+        "action": "user_search",
+        "prefix": "al",
+        "users": ["alan", "alice"],
+        "version": 3,
+        "status": "success",
+    }
+
+    actual_encoded = encoder.encode_message(original_message)
+    decoded_message = decoder.decode_message(actual_encoded)
+    assert (
+        decoded_message == original_message
+    ), "Decoded message does not match the original."
+
+
+def test_encode_decode_search_results(encoder_decoder):
+    """
+    Integration Test: Encode and decode a page of message search results.
+    """
+    encoder, decoder = encoder_decoder
+
+    original_message = {
+        "action": "search_results",
+        "query": "lunch",
+        "results": [
+            {"id": 7, "from": "bob", "to": "alice", "snippet": "[lunch]?", "timestamp": "t1"},
+        ],
+        "next_cursor": "-1.25:7",
+        "status": "success",
+    }
+
+    actual_encoded = encoder.encode_message(original_message)
+    decoded_message = decoder.decode_message(actual_encoded)
+    assert (
+        decoded_message == original_message
+    ), "Decoded message does not match the original."
+
+
+def test_encode_decode_req_id(encoder_decoder):
+    """
+    Integration Test: An optional req_id survives a round trip and costs 4 bytes.
+    """
+    encoder, decoder = encoder_decoder
+
+    message = {"action": "login", "username": "Bob", "password": "pw"}
+    plain = encoder.encode_message(message)
+    tagged = encoder.encode_message({**message, "req_id": 70000})
+
+    assert len(tagged) == len(plain) + 4
+    assert decoder.decode_message(tagged) == {**message, "req_id": 70000}
+    assert "req_id" not in decoder.decode_message(plain)
+
+    with pytest.raises(ValueError):
+        encoder.encode_message({**message, "req_id": -1})
+
+
+def test_encode_decode_optional_field(encoder_decoder):
+    """
+    Integration Test: An optional field costs one byte when absent and is
+    left out of the decoded message.
+    """
+    encoder, decoder = encoder_decoder
+
+    message = {"action": "login", "username": "Bob", "password": "pw"}
+    plain = encoder.encode_message(message)
+    flagged = encoder.encode_message({**message, "bootstrap": 1, "req_id": 5})
+
+    assert decoder.decode_message(plain) == message
+    assert len(flagged) == len(plain) + 4 + 4
+    assert decoder.decode_message(flagged) == {**message, "bootstrap": 1, "req_id": 5}
+
+
+def test_encode_decode_batch(encoder_decoder):
+    """
+    Integration Test: A batch carries complete sub-messages of different actions.
+    """
+    encoder, decoder = encoder_decoder
+
+    original_message = {
+        "action": "batch_response",
+        "responses": [
+            {"action": "echo", "message": "hi", "req_id": 4},
+            {"action": "error", "message": "nope", "status": "error"},
+        ],
+        "status": "success",
+        "req_id": 3,
+    }
+
+    actual_encoded = encoder.encode_message(original_message)
+    decoded_message = decoder.decode_message(actual_encoded)
+    assert (
+        decoded_message == original_message
+    ), "Decoded message does not match the original."
+
+
+
+def test_decode_view_matches_decode_message(encoder_decoder):
+    """
+    A lazy view reads the same as the eagerly decoded message.
+    """
+    encoder, decoder = encoder_decoder
+
+    messages = [
+        {"action": "login", "username": "Bob", "password": "pw", "bootstrap": 1, "req_id": 5},
+        {"action": "login", "username": "Bob", "password": "pw"},
+        {"action": "mark_as_read", "message_ids": [1, 2, 3]},
+        {
+            "action": "room_history",
+            "room_id": 4,
+            "messages": [
+                {"id": 10, "from": "bob", "message": "Hey!", "timestamp": "t1"},
+                {"id": 11, "from": "alice", "message": "Hi!", "timestamp": "t2"},
+            ],
+            "next_before_id": 10,
+            "last_read_id": 11,
+            "status": "success",
+        },
+        {
+            "action": "batch",
+            "requests": [
+                {"action": "echo", "message": "hi", "req_id": 4},
+                {"action": "get_users"},
+            ],
+            "req_id": 3,
+        },
+    ]
+    for message in messages:
+        encoded = encoder.encode_message(message)
+        view = decoder.decode_view(bytearray(encoded))
+        assert view == decoder.decode_message(encoded) == message
+        assert dict(view) == message
+
+    assert "bootstrap" not in decoder.decode_view(encoder.encode_message(messages[1]))
+    assert isinstance(view["requests"][1], Mapping)
+
+
+def test_decode_view_decodes_only_what_is_read(encoder_decoder):
+    """
+    Fields and list elements are decoded on access, and only once.
+    """
+    encoder, decoder = encoder_decoder
+
+    message = {
+        "action": "room_history",
+        "room_id": 4,
+        "messages": [
+            {"id": i, "from": "bob", "message": "x" * i, "timestamp": "t"} for i in range(100)
+        ],
+        "next_before_id": 10,
+        "last_read_id": 11,
+        "status": "success",
+    }
+    view = decoder.decode_view(encoder.encode_message(message))
+
+    with patch.object(decoder, "decode_object", wraps=decoder.decode_object) as decode_object:
+        # Past the list, found by skipping over it
+        assert view["last_read_id"] == 11
+        messages = view["messages"]
+        assert len(messages) == 100
+        assert messages[-1]["id"] == 99
+        assert decode_object.call_count == 1
+        assert messages[:2] == message["messages"][:2]
+    assert view["messages"] is messages
+
+
+def test_decode_view_rejects_truncated_data(encoder_decoder):
+    """
+    A view checks up front that every field is there.
+    """
+    encoder, decoder = encoder_decoder
+
+    encoded = encoder.encode_message({"action": "mark_as_read", "message_ids": [1, 2, 3]})
+    with pytest.raises(ValueError):
+        decoder.decode_view(encoded[:-2])
+    with pytest.raises(ValueError):
+        decoder.decode_view(b"\xff")
+
+
+def test_decode_view_rejects_malformed_strings_and_nested_messages(encoder_decoder):
+    """
+    Strings and nested messages are checked up front as well; strings inside
+    lists of objects fail with MessageDecodeError when read.
+    """
+    encoder, decoder = encoder_decoder
+
+    login = encoder.encode_message({"action": "login", "username": "Bob", "password": "pw"})
+    bad_login = login.replace(b"Bob", b"B\xffb")
+    with pytest.raises(ValueError):
+        decoder.decode_view(bad_login)
+
+    def batch(*requests):
+        elements = b"".join(struct.pack("!I", len(r)) + r for r in requests)
+        action_id = decoder.action_ids["batch"]
+        return bytes([action_id]) + struct.pack("!H", len(requests)) + elements
+
+    assert decoder.decode_view(batch(login))["requests"][0]["username"] == "Bob"
+    with pytest.raises(ValueError):
+        decoder.decode_view(batch(login, bad_login))
+    with pytest.raises(ValueError):
+        decoder.decode_view(batch(login[:-2]))
+
+    history = encoder.encode_message({
+        "action": "room_history",
+        "room_id": 4,
+        "messages": [{"id": 10, "from": "bob", "message": "Hey!", "timestamp": "t1"}],
+        "next_before_id": 10,
+        "last_read_id": 11,
+        "status": "success",
+    })
+    view = decoder.decode_view(history.replace(b"Hey!", b"He\xff!"))
+    assert view["room_id"] == 4
+    with pytest.raises(MessageDecodeError):
+        view["messages"][0]
+
+
 # if name == "__main__":
 #     frame=bytearray(b'\x81\x87\xac:\xcf\x99\xad:\xce\xf8\xac;\xae')
 
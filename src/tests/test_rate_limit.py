@@ -0,0 +1,48 @@
+import pytest
+from rate_limit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_refill():
+    clock = FakeClock()
+    limiter = RateLimiter({"send_message": (2, 3)}, clock=clock)
+
+    assert [limiter.check("alice", "send_message") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("alice", "send_message") == pytest.approx(0.5)
+    # Other clients and actions have their own buckets
+    assert limiter.check("bob", "send_message") == 0
+
+    clock.now += 0.5
+    assert limiter.check("alice", "send_message") == 0
+    assert limiter.check("alice", "send_message") > 0
+
+    # Idle time refills up to the burst, never beyond
+    clock.now += 60
+    assert [limiter.check("alice", "send_message") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("alice", "send_message") > 0
+
+
+def test_default_and_unlimited_actions():
+    clock = FakeClock()
+    limiter = RateLimiter({"echo": (0, 0)}, default=(1, 1), clock=clock)
+
+    assert all(limiter.check("alice", "echo") == 0 for _ in range(100))
+    assert limiter.check("alice", "get_users") == 0
+    assert limiter.check("alice", "get_users") == pytest.approx(1.0)
+
+
+def test_refilled_buckets_are_forgotten():
+    clock = FakeClock()
+    limiter = RateLimiter({}, default=(10, 10), clock=clock)
+    for user in range(1023):
+        limiter.check(user, "echo")
+    clock.now += 1
+    limiter.check("late", "echo")  # Crosses the sweep threshold
+    assert len(limiter) == 1
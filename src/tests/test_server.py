@@ -0,0 +1,134 @@
+import os
+import socket
+import errno
+import threading
+from unittest.mock import Mock, patch
+
+import metrics
+from server import (
+    SERVICE_UNAVAILABLE_RESPONSE,
+    AdmissionController,
+    HandoffServer,
+    accept_loop,
+    reject,
+    serve_client,
+    take_over_listener,
+)
+
+
+def test_admission_limits():
+    admission = AdmissionController(max_connections=3, max_per_ip=2, max_pending_handshakes=2)
+    rejected = metrics.get("admission.rejected.per_ip")
+
+    assert admission.admit("10.0.0.1") is None
+    assert admission.admit("10.0.0.1") is None
+    assert admission.admit("10.0.0.1") == "per_ip"
+    assert metrics.get("admission.rejected.per_ip") == rejected + 1
+
+    # Both admitted connections are still handshaking
+    assert admission.admit("10.0.0.2") == "handshake_queue"
+    admission.handshake_done(True)
+    assert admission.admit("10.0.0.2") is None
+    assert admission.admit("10.0.0.3") == "max_connections"
+
+    admission.handshake_done(False)
+    admission.release("10.0.0.1")
+    assert admission.admit("10.0.0.1") is None
+    assert admission.connections == 3
+    assert metrics.get("admission.connections") == 3
+
+
+def test_reject_answers_503():
+    server_end, client_end = socket.socketpair()
+    client_end.sendall(b"GET / HTTP/1.1\r\n\r\n")
+    reject(server_end)
+    assert client_end.recv(1024) == SERVICE_UNAVAILABLE_RESPONSE
+    assert client_end.recv(1024) == b""
+    client_end.close()
+
+
+def test_serve_client_frees_slot_even_if_handshake_never_finishes():
+    admission = AdmissionController(max_connections=1, max_per_ip=1, max_pending_handshakes=1)
+    assert admission.admit("10.0.0.1") is None
+
+    with patch("server.handle_client_connection", side_effect=OSError("reset")):
+        try:
+            serve_client(None, ("10.0.0.1", 1), admission)
+        except OSError:
+            pass
+    assert (admission.connections, admission.handshaking) == (0, 0)
+
+    def upgrade(conn, addr, on_handshake):
+        on_handshake(True)
+
+    assert admission.admit("10.0.0.1") is None
+    with patch("server.handle_client_connection", side_effect=upgrade):
+        serve_client(None, ("10.0.0.1", 1), admission)
+    assert (admission.connections, admission.handshaking) == (0, 0)
+    assert admission.admit("10.0.0.1") is None
+
+
+def test_accept_loop_returns_once_stopping():
+    stopping = threading.Event()
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        listener.settimeout(0.01)
+        thread = threading.Thread(
+            target=accept_loop, args=(listener, AdmissionController(), stopping)
+        )
+        thread.start()
+        stopping.set()
+        thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_accept_loop_survives_accept_errors():
+    stopping = threading.Event()
+    listener = Mock()
+    listener.fileno.return_value = 3
+
+    failures = [
+        OSError(errno.EMFILE, "Too many open files"),
+        OSError(errno.ECONNABORTED, "Software caused connection abort"),
+    ]
+
+    def accept():
+        if failures:
+            raise failures.pop(0)
+        stopping.set()
+        raise socket.timeout()
+
+    listener.accept.side_effect = accept
+    errors = metrics.get("admission.accept_errors")
+    with patch("server.ACCEPT_ERROR_BACKOFF", 0):
+        accept_loop(listener, AdmissionController(), stopping)
+    assert listener.accept.call_count == 3
+    assert metrics.get("admission.accept_errors") == errors + 2
+
+
+def test_listener_handoff(tmp_path):
+    path = str(tmp_path / "handoff.sock")
+    stopping = threading.Event()
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        handoff = HandoffServer(path, listener, stopping)
+        handoff.start()
+
+        taken = take_over_listener(path)
+        assert stopping.wait(5)
+        handoff.join(5)
+        assert handoff.handed_off
+        address = listener.getsockname()
+
+    # The old server closed its descriptor; the socket keeps accepting
+    with taken, socket.create_connection(address, timeout=5):
+        taken.settimeout(5)
+        conn, _ = taken.accept()
+        conn.close()
+
+
+def test_take_over_listener_without_running_server(tmp_path):
+    assert take_over_listener(str(tmp_path / "missing.sock")) is None
+    assert not os.path.exists(tmp_path / "missing.sock")
@@ -0,0 +1,178 @@
+import pytest
+import database
+from cache import message_cache, user_directory
+from memory_storage import MemoryStorage
+from storage import create_storage
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def storage(request, tmp_path, monkeypatch):
+    """Each contract test runs against every engine; SQLite uses a temporary file."""
+    if request.param == "sqlite":
+        monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "chat_app.db"))
+        message_cache.clear()
+        user_directory.invalidate()
+    engine = create_storage(request.param)
+    engine.initialize()
+    engine.create_user("alice", "hash_a")
+    engine.create_user("bob", "hash_b")
+    yield engine
+    engine.close()
+    if request.param == "sqlite":
+        message_cache.clear()
+        user_directory.invalidate()
+
+
+def test_create_storage_unknown_engine():
+    with pytest.raises(ValueError):
+        create_storage("nope")
+    assert isinstance(create_storage("memory"), MemoryStorage)
+
+
+def test_users(storage):
+    assert storage.create_user("alice", "other") is False
+    assert storage.get_password_hash("alice") == "hash_a"
+    assert storage.get_password_hash("carol") is None
+    assert storage.get_all_users_except("alice") == ["bob"]
+
+    users, version = storage.search_users("b")
+    assert users == ["bob"]
+    storage.create_user("bart", "hash")
+    users, new_version = storage.search_users("b", exclude="bob")
+    assert users == ["bart"]
+    assert new_version != version
+
+    assert storage.get_user_info("alice") == ("alice", 0)
+    storage.set_n_unread_messages("alice", 7)
+    assert storage.get_user_info("alice") == ("alice", 7)
+
+
+def test_messages_lifecycle(storage):
+    first = storage.insert_message("alice", "hello bob", "bob")
+    second = storage.insert_message("alice", "are you there", "bob")
+    assert second > first
+
+    assert [row[0] for row in storage.get_unread_messages("bob")] == [first, second]
+    assert [row[3] for row in storage.get_undelivered_messages("bob")] == [first, second]
+    storage.mark_messages_delivered("bob")
+    assert storage.get_undelivered_messages("bob") == []
+
+    storage.mark_conversation_read("bob", "alice", first)
+    assert [row[0] for row in storage.get_unread_messages("bob")] == [second]
+    storage.mark_messages_as_read([second])
+    assert storage.get_unread_messages("bob") == []
+    recent = storage.get_recent_messages("alice")
+    assert [(row[0], row[1], row[4]) for row in recent] == [
+        ("alice", "hello bob", first),
+        ("alice", "are you there", second),
+    ]
+
+    assert storage.delete_message(first) is True
+    assert [row[4] for row in storage.get_recent_messages("bob")] == [second]
+
+
+def test_acknowledged_delivery(storage):
+    ids = [storage.insert_message("alice", f"m{i}", "bob") for i in range(3)]
+    other = storage.insert_message("bob", "not yours", "alice")
+
+    # Only the receiver's undelivered messages count
+    assert storage.mark_messages_delivered("bob", [ids[0], ids[2], other]) == 2
+    assert storage.mark_messages_delivered("bob", [ids[0]]) == 0
+    assert [row[3] for row in storage.get_undelivered_messages("bob")] == [ids[1]]
+    assert [row[3] for row in storage.get_undelivered_messages("alice")] == [other]
+    assert storage.mark_messages_delivered("bob") == 1
+    assert storage.get_undelivered_messages("bob") == []
+
+
+def test_login_bootstrap(storage):
+    ids = [storage.insert_message("alice", f"m{i}", "bob") for i in range(4)]
+    storage.mark_messages_as_read(ids[:2])
+    storage.set_n_unread_messages("bob", 1)
+
+    unread, recent, users = storage.get_login_bootstrap("bob")
+    assert unread == storage.get_unread_messages("bob", 1)
+    assert [row[0] for row in unread] == [ids[2]]
+    assert recent == storage.get_recent_messages("bob", 1)
+    assert [row[4] for row in recent] == [ids[1]]
+    assert users == ["alice"]
+
+    # Without a setting the default limit applies
+    unread, recent, _ = storage.get_login_bootstrap("alice", default_limit=3)
+    assert unread == []
+    assert [row[4] for row in recent] == ids[:2]
+
+
+def test_conversations(storage):
+    assert storage.get_conversation_id("alice", "bob") is None
+    ids = [storage.insert_message("alice", f"m{i}", "bob") for i in range(5)]
+    conversation_id = storage.get_conversation_id("bob", "alice")
+    assert conversation_id is not None
+
+    page = storage.get_conversation_messages(conversation_id, limit=2)
+    assert [row[0] for row in page] == ids[3:]
+    page = storage.get_conversation_messages(conversation_id, before_id=ids[3], limit=2)
+    assert [row[0] for row in page] == ids[1:3]
+
+    conversations = storage.list_conversations("bob")
+    assert len(conversations) == 1
+    assert conversations[0][1] == "alice"
+    assert conversations[0][2] == ids[-1]
+    assert conversations[0][6] == 5
+
+
+def test_search_messages(storage):
+    storage.insert_message("alice", "lunch today", "bob")
+    storage.insert_message("bob", "lunch lunch tomorrow", "alice")
+    storage.insert_message("alice", "dinner", "bob")
+
+    rows, cursor = storage.search_messages("bob", "lunch", limit=1)
+    assert len(rows) == 1
+    assert "[lunch]" in rows[0][3]
+    assert cursor != ""
+    more, cursor = storage.search_messages("bob", "lunch", cursor=cursor, limit=1)
+    assert len(more) == 1
+    assert more[0][0] != rows[0][0]
+    assert cursor == ""
+
+    with pytest.raises(ValueError):
+        storage.search_messages("bob", "lunch", cursor="bad")
+
+
+def test_rooms(storage):
+    room_id = storage.create_room("general", "alice")
+    assert storage.create_room("general", "bob") is None
+    assert storage.get_room(room_id) == (room_id, "general", "alice", "group")
+
+    first = storage.insert_room_message(room_id, "alice", "hi")
+    assert storage.add_room_member(room_id, "bob") is True
+    assert storage.add_room_member(room_id, "bob") is False
+    assert storage.get_room_read_cursor(room_id, "bob") == first
+    assert sorted(storage.get_room_members(room_id)) == ["alice", "bob"]
+    assert storage.get_user_rooms("bob") == [(room_id, "general", "group")]
+
+    second = storage.insert_room_message(room_id, "bob", "hey")
+    assert [row[0] for row in storage.get_room_history(room_id)] == [first, second]
+    assert [row[0] for row in storage.get_room_history(room_id, before_id=second)] == [first]
+
+    storage.mark_room_read(room_id, "bob", second)
+    storage.mark_room_read(room_id, "bob", first)
+    assert storage.get_room_read_cursor(room_id, "bob") == second
+    storage.mark_room_read(room_id, "bob", second + 100)
+    assert storage.get_room_read_cursor(room_id, "bob") == second
+
+    assert storage.remove_room_member(room_id, "bob") is True
+    assert storage.remove_room_member(room_id, "bob") is False
+    assert storage.get_room_read_cursor(room_id, "bob") is None
+
+
+def test_delete_user(storage):
+    storage.insert_message("alice", "bye", "bob")
+    room_id = storage.create_room("general", "bob")
+    storage.add_room_member(room_id, "alice")
+
+    assert storage.delete_user("alice") is True
+    assert storage.delete_user("alice") is False
+    assert storage.get_password_hash("alice") is None
+    assert storage.get_unread_messages("bob") == []
+    assert storage.get_conversation_id("alice", "bob") is None
+    assert storage.get_room_members(room_id) == ["bob"]
@@ -6,7 +6,6 @@ from users import (
     register_user,
     authenticate_user,
     delete_account,
-    DB_FILE,
 )
 
 
@@ -4,7 +4,17 @@ import base64
 import hashlib
 import struct
 import json
+import socket
+import threading
+import time
 from utils import (
+    WS_CLOSE_GOING_AWAY,
+    WS_CLOSE_INVALID_PAYLOAD,
+    WS_CLOSE_NO_STATUS,
+    WS_CLOSE_PROTOCOL_ERROR,
+    WS_CLOSE_TOO_BIG,
+    WS_CLOSE_UNSUPPORTED_DATA,
+    WebSocketError,
     WebSocketUtil,
     perform_handshake,
     generate_accept_key,
@@ -14,7 +24,17 @@ from utils import (
 
 @pytest.fixture
 def mock_conn():
-    return Mock()
+    conn = Mock()
+    conn.sendmsg.side_effect = lambda buffers: sum(len(b) for b in buffers)
+    conn.gettimeout.return_value = None
+    return conn
+
+
+def sent_bytes(conn):
+    """Concatenates everything written to a mock socket via sendmsg."""
+    return b"".join(
+        bytes(buf) for c in conn.sendmsg.call_args_list for buf in c[0][0]
+    )
 
 
 @pytest.fixture
@@ -74,6 +94,62 @@ class TestHandshake:
         assert result is False
 
 
+class TestHandshakeOverSocket:
+    REQUEST = (
+        b"GET /chat HTTP/1.1\r\n"
+        b"Host: server.example.com\r\n"
+        b"Upgrade: websocket\r\n"
+        b"Connection: keep-alive, Upgrade\r\n"
+        b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+        b"Sec-WebSocket-Version: 13\r\n\r\n"
+    )
+
+    def test_split_request_keeps_early_frames(self, websocket_util):
+        server, client = socket.socketpair()
+        frame = b'\x81\x08{"a": 1}'
+        # Segments split inside the blank line, with a frame right behind it
+        sender = threading.Thread(
+            target=lambda: [
+                (client.sendall(part), time.sleep(0.01))
+                for part in (self.REQUEST[:10], self.REQUEST[10:-3], self.REQUEST[-3:] + frame)
+            ]
+        )
+        sender.start()
+        assert perform_handshake(server) is True
+        sender.join()
+        assert client.recv(1024).startswith(b"HTTP/1.1 101 Switching Protocols")
+        assert websocket_util.read_ws_frame(server) == {"a": 1}
+        server.close()
+        client.close()
+
+    @pytest.mark.parametrize(
+        "request_bytes, status",
+        [
+            (REQUEST.replace(b"13", b"8"), b"426"),
+            (REQUEST.replace(b"websocket", b"h2c"), b"400"),
+            (REQUEST.replace(b"\r\n\r\n", b"\r\nX-Pad: " + b"x" * 9000 + b"\r\n\r\n"), b"431"),
+        ],
+    )
+    def test_bad_request_is_refused(self, request_bytes, status):
+        server, client = socket.socketpair()
+        client.sendall(request_bytes)
+        assert perform_handshake(server) is False
+        assert client.recv(64).split(b" ")[1] == status
+        server.close()
+        client.close()
+
+    def test_whole_request_must_arrive_in_time(self):
+        server, client = socket.socketpair()
+        server.settimeout(0.2)
+        client.sendall(self.REQUEST[:20])
+        started = time.monotonic()
+        assert perform_handshake(server) is False
+        assert time.monotonic() - started < 1
+        assert server.gettimeout() == 0.2
+        server.close()
+        client.close()
+
+
 class TestWebSocketUtil:
     def test_init_default_mode(self):
         ws_util = WebSocketUtil(mode="json")
@@ -92,8 +168,8 @@ class TestWebSocketUtil:
     def test_send_small_frame(self, websocket_util, mock_conn, sample_message):
         websocket_util.send_ws_frame(mock_conn, sample_message)
 
-        mock_conn.sendall.assert_called_once()
-        frame = mock_conn.sendall.call_args[0][0]
+        mock_conn.sendmsg.assert_called_once()
+        frame = sent_bytes(mock_conn)
 
         # Check frame format
         assert frame[0] == WebSocketUtil.WS_FIN_TEXT_FRAME
@@ -105,8 +181,8 @@ class TestWebSocketUtil:
 
         websocket_util.send_ws_frame(mock_conn, large_message)
 
-        mock_conn.sendall.assert_called_once()
-        frame = mock_conn.sendall.call_args[0][0]
+        mock_conn.sendmsg.assert_called_once()
+        frame = sent_bytes(mock_conn)
 
         # Check frame format
         assert frame[0] == WebSocketUtil.WS_FIN_TEXT_FRAME
@@ -165,7 +241,281 @@ class TestWebSocketUtil:
 
 
 def test_error_handling(websocket_util, mock_conn):
-    mock_conn.recv.side_effect = Exception("Connection error")
+    # Connection errors are not mistaken for a close
+    mock_conn.recv.side_effect = ConnectionResetError("Connection error")
+    with pytest.raises(ConnectionResetError):
+        websocket_util.read_ws_frame(mock_conn)
+
+    mock_conn.recv.side_effect = [bytes([0x81, 3]), b"{x]"]
+    with pytest.raises(WebSocketError) as error:
+        websocket_util.read_ws_frame(mock_conn)
+    assert error.value.code == WS_CLOSE_INVALID_PAYLOAD
+
+
+class TestFragmentation:
+    def _frame(self, first_byte, payload, mask_key=None):
+        header = bytes([first_byte])
+        if mask_key is None:
+            return header + bytes([len(payload)]) + payload
+        masked = bytes(b ^ mask_key[i % 4] for i, b in enumerate(payload))
+        return header + bytes([WebSocketUtil.WS_MASK_BIT | len(payload)]) + mask_key + masked
+
+    def _stream(self, data):
+        """Mock socket whose recv serves bytes from data in arbitrary splits."""
+        conn = Mock()
+        buf = bytearray(data)
+
+        def recv(n):
+            chunk = bytes(buf[: min(n, 3)])
+            del buf[: len(chunk)]
+            return chunk
+
+        conn.recv.side_effect = recv
+        return conn
+
+    def test_read_fragmented_message(self, websocket_util):
+        message = json.dumps({"test": "fragmented"}).encode("utf-8")
+        stream = (
+            self._frame(0x01, message[:5], b"abcd")  # FIN=0, text
+            + self._frame(0x00, message[5:10], b"efgh")  # FIN=0, continuation
+            + self._frame(0x80, message[10:], b"ijkl")  # FIN=1, continuation
+        )
+
+        result = websocket_util.read_ws_frame(self._stream(stream))
+        assert result == {"test": "fragmented"}
+
+    def test_read_fragmented_message_with_interleaved_control_frame(
+        self, websocket_util
+    ):
+        message = json.dumps({"test": "ping"}).encode("utf-8")
+        stream = (
+            self._frame(0x01, message[:4])
+            + self._frame(0x89, b"hi")  # Ping between fragments
+            + self._frame(0x80, message[4:])
+        )
+
+        result = websocket_util.read_ws_frame(self._stream(stream))
+        assert result == {"test": "ping"}
 
-    result = websocket_util.read_ws_frame(mock_conn)
-    assert result is None
+    def test_read_reports_ping_and_pong_frames(self, websocket_util):
+        stream = (
+            self._frame(0x89, b"hi", b"abcd")  # Masked ping
+            + self._frame(0x8A, b"")  # Pong
+            + self._frame(0x81, b'{"a": 1}')
+        )
+        control = []
+
+        result = websocket_util.read_ws_frame(
+            self._stream(stream), on_control=lambda *frame: control.append(frame)
+        )
+        assert result == {"a": 1}
+        assert control == [
+            (WebSocketUtil.WS_OPCODE_PING, b"hi"),
+            (WebSocketUtil.WS_OPCODE_PONG, b""),
+        ]
+
+    def test_build_control_frame(self, websocket_util):
+        frame = websocket_util.build_control_frame(WebSocketUtil.WS_OPCODE_PONG, b"hi")
+        assert frame == b"\x8a\x02hi"
+        with pytest.raises(ValueError):
+            websocket_util.build_control_frame(WebSocketUtil.WS_OPCODE_PING, b"x" * 126)
+
+    def test_read_unexpected_continuation(self, websocket_util):
+        stream = self._frame(0x80, b"{}")
+
+        with pytest.raises(WebSocketError) as error:
+            websocket_util.read_ws_frame(self._stream(stream))
+        assert error.value.code == WS_CLOSE_PROTOCOL_ERROR
+
+    def test_read_message_too_large(self):
+        ws_util = WebSocketUtil(mode="json", max_message_size=8)
+        message = json.dumps({"test": "too large"}).encode("utf-8")
+        stream = self._frame(0x01, message[:6]) + self._frame(0x80, message[6:])
+
+        with pytest.raises(WebSocketError, match="exceeds max size") as error:
+            ws_util.read_message(self._stream(stream))
+        assert error.value.code == WS_CLOSE_TOO_BIG
+
+    def test_read_binary_message_is_unsupported(self, websocket_util):
+        with pytest.raises(WebSocketError) as error:
+            websocket_util.read_message(self._stream(self._frame(0x82, b"\x00")))
+        assert error.value.code == WS_CLOSE_UNSUPPORTED_DATA
+
+    def test_send_fragmented_message(self, mock_conn):
+        ws_util = WebSocketUtil(mode="json", max_fragment_size=10)
+        message = {"data": "x" * 30}
+        payload = json.dumps(message).encode("utf-8")
+
+        ws_util.send_ws_frame(mock_conn, message)
+
+        # All fragments go out as one header/payload vector
+        mock_conn.sendmsg.assert_called_once()
+        buffers = [bytes(b) for b in mock_conn.sendmsg.call_args[0][0]]
+        frames = [h + p for h, p in zip(buffers[::2], buffers[1::2])]
+        assert len(frames) == -(-len(payload) // 10)
+        assert frames[0][0] == WebSocketUtil.WS_OPCODE_TEXT  # FIN=0, text
+        assert all(f[0] == WebSocketUtil.WS_OPCODE_CONTINUATION for f in frames[1:-1])
+        assert frames[-1][0] == WebSocketUtil.WS_FIN_BIT  # FIN=1, continuation
+        assert b"".join(f[2:] for f in frames) == payload
+
+        # The receiving side reassembles what was sent
+        assert ws_util.read_ws_frame(self._stream(b"".join(frames))) == message
+
+
+class TestClose:
+    def test_close_frame_is_reported_with_its_status(self, websocket_util):
+        payload = struct.pack("!H", WS_CLOSE_GOING_AWAY) + b"bye"
+        frame = bytes([0x88, WebSocketUtil.WS_MASK_BIT | len(payload)]) + b"abcd"
+        frame += bytes(b ^ b"abcd"[i % 4] for i, b in enumerate(payload))
+        control = []
+
+        conn = Mock()
+        conn.recv.side_effect = [frame[:2], frame[2:6], frame[6:]]
+        assert websocket_util.read_message(conn, lambda *f: control.append(f)) is None
+        assert control == [(WebSocketUtil.WS_OPCODE_CLOSE, payload)]
+        assert websocket_util.parse_close_payload(payload) == (WS_CLOSE_GOING_AWAY, "bye")
+
+    @pytest.mark.parametrize(
+        "payload, code",
+        [
+            (b"\x03", WS_CLOSE_PROTOCOL_ERROR),
+            (struct.pack("!H", 1005), WS_CLOSE_PROTOCOL_ERROR),
+            (struct.pack("!H", 999), WS_CLOSE_PROTOCOL_ERROR),
+            (struct.pack("!H", 1000) + b"\xff", WS_CLOSE_INVALID_PAYLOAD),
+        ],
+    )
+    def test_invalid_close_payload(self, websocket_util, payload, code):
+        with pytest.raises(WebSocketError) as error:
+            websocket_util.parse_close_payload(payload)
+        assert error.value.code == code
+
+    def test_build_close_frame(self, websocket_util):
+        assert websocket_util.build_close_frame(WS_CLOSE_NO_STATUS) == b"\x88\x00"
+        frame = websocket_util.build_close_frame(WS_CLOSE_PROTOCOL_ERROR, "é" * 100)
+        assert len(frame) <= 127
+        code, reason = websocket_util.parse_close_payload(frame[2:])
+        assert code == WS_CLOSE_PROTOCOL_ERROR and set(reason) == {"é"}
+
+    def test_close_connection_waits_for_peer(self, websocket_util):
+        server, client = socket.socketpair()
+        client.sendall(b"unread")
+        client.shutdown(socket.SHUT_WR)
+
+        websocket_util.close_connection(server, WS_CLOSE_GOING_AWAY, "restart")
+        assert server.fileno() == -1
+        # The close frame arrives intact, followed by end of stream
+        frame = client.recv(64)
+        assert websocket_util.parse_close_payload(frame[2:]) == (WS_CLOSE_GOING_AWAY, "restart")
+        assert client.recv(64) == b""
+        client.close()
+
+
+class TestScatterGatherSend:
+    def test_header_and_payload_sent_as_separate_buffers(
+        self, websocket_util, mock_conn
+    ):
+        payload = b"y" * 300
+
+        websocket_util.send_payload(mock_conn, payload)
+
+        header, body = mock_conn.sendmsg.call_args[0][0]
+        assert bytes(header) == bytes(
+            [WebSocketUtil.WS_FIN_TEXT_FRAME, WebSocketUtil.WS_PAYLOAD_LEN_16BIT]
+        ) + struct.pack(">H", 300)
+        # The payload is passed through as a view, not copied into the frame
+        assert isinstance(body, memoryview)
+        assert body.obj is payload
+
+    def test_partial_writes_are_resumed(self, websocket_util):
+        conn = Mock()
+        conn.sendmsg.side_effect = lambda buffers: min(7, sum(len(b) for b in buffers))
+        payload = json.dumps({"data": "z" * 50}).encode("utf-8")
+
+        websocket_util.send_payload(conn, payload)
+
+        assert conn.sendmsg.call_count > 1
+        frame = b""
+        for c in conn.sendmsg.call_args_list:
+            frame += b"".join(bytes(b) for b in c[0][0])[:7]
+        assert frame == bytes([WebSocketUtil.WS_FIN_TEXT_FRAME, len(payload)]) + payload
+
+    def test_fallback_without_sendmsg(self, websocket_util):
+        conn = Mock(spec=["sendall"])
+
+        websocket_util.send_payload(conn, b"abc")
+
+        sent = b"".join(bytes(c[0][0]) for c in conn.sendall.call_args_list)
+        assert sent == bytes([WebSocketUtil.WS_FIN_TEXT_FRAME, 3]) + b"abc"
+
+    def test_shared_payload_for_many_connections(self, websocket_util):
+        payload = websocket_util.encode_payload({"action": "echo", "message": "hi"})
+        conns = []
+        for _ in range(3):
+            conn = Mock()
+            conn.sendmsg.side_effect = lambda buffers: sum(len(b) for b in buffers)
+            websocket_util.send_payload(conn, payload)
+            conns.append(conn)
+
+        for conn in conns:
+            assert conn.sendmsg.call_args[0][0][1].obj is payload
+
+    def test_concurrent_sends_do_not_interleave(self, websocket_util):
+        stream = bytearray()
+
+        def sendmsg(buffers):
+            # Short writes, yielding in between, as a busy socket would
+            written = b"".join(bytes(b) for b in buffers)[:7]
+            stream.extend(written)
+            time.sleep(0)
+            return len(written)
+
+        conn = Mock()
+        conn.sendmsg.side_effect = sendmsg
+
+        def send_many(char):
+            for _ in range(20):
+                websocket_util.send_payload(conn, char * 200)
+
+        threads = [threading.Thread(target=send_many, args=(c,)) for c in (b"a", b"b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        offset, frames = 0, 0
+        while offset < len(stream):
+            assert stream[offset : offset + 4] == b"\x81\x7e" + struct.pack(">H", 200)
+            payload = bytes(stream[offset + 4 : offset + 204])
+            assert payload in (b"a" * 200, b"b" * 200)
+            offset += 204
+            frames += 1
+        assert frames == 40
+
+
+class TestPreparedFrame:
+    def test_prepare_once_send_many(self, websocket_util):
+        message = {"action": "received_message", "message": "hello all"}
+        with patch.object(
+            websocket_util, "encode_payload", wraps=websocket_util.encode_payload
+        ) as spy_encode:
+            frame = websocket_util.prepare_frame(message)
+            conns = []
+            for _ in range(5):
+                conn = Mock()
+                conn.sendmsg.side_effect = lambda buffers: sum(len(b) for b in buffers)
+                websocket_util.send_prepared(conn, frame)
+                conns.append(conn)
+
+        spy_encode.assert_called_once()
+        payload = json.dumps(message).encode("utf-8")
+        assert len(frame) == 2 + len(payload)
+        for conn in conns:
+            assert sent_bytes(conn) == bytes([0x81, len(payload)]) + payload
+
+    def test_send_prepared_raises_on_socket_error(self, websocket_util):
+        conn = Mock()
+        conn.sendmsg.side_effect = BrokenPipeError("gone")
+        frame = websocket_util.prepare_frame({"action": "echo"})
+
+        with pytest.raises(BrokenPipeError):
+            websocket_util.send_prepared(conn, frame)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import metrics
+from workers import WorkerPool
+
+
+def test_strands_keep_order_and_pool_bounds_concurrency():
+    pool = WorkerPool(size=3, max_pending=4)
+    lock = threading.Lock()
+    running = [0, 0]  # current, peak
+    results = {name: [] for name in "abcde"}
+
+    def task(name, index):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.001)
+        results[name].append(index)
+        with lock:
+            running[0] -= 1
+
+    strands = {name: pool.strand() for name in results}
+    tasks_before = metrics.get("workers.tasks")
+    for index in range(20):
+        for name, strand in strands.items():
+            strand.submit(task, name, index)
+    for strand in strands.values():
+        strand.join()
+
+    assert all(indexes == list(range(20)) for indexes in results.values())
+    assert 1 < running[1] <= 3
+    assert metrics.get("workers.tasks") == tasks_before + 100
+    assert metrics.get("workers.queue_depth") == 0
+    pool.shutdown()
+
+
+def test_submit_blocks_when_strand_is_full():
+    pool = WorkerPool(size=1, max_pending=2)
+    release = threading.Event()
+    strand = pool.strand()
+    strand.submit(release.wait)  # Occupies the only worker
+    strand.submit(lambda: None)
+    strand.submit(lambda: None)
+
+    submitted = threading.Event()
+    threading.Thread(
+        target=lambda: (strand.submit(lambda: None), submitted.set()), daemon=True
+    ).start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    strand.join()
+    pool.shutdown()
+
+
+def test_failing_task_does_not_stop_the_strand():
+    pool = WorkerPool(size=1)
+    strand = pool.strand()
+    done = []
+    strand.submit(lambda: 1 / 0)
+    strand.submit(done.append, True)
+    strand.join()
+    assert done == [True]
+    pool.shutdown()
+
+
+def test_size_zero_runs_inline():
+    pool = WorkerPool(size=0)
+    caller = []
+    pool.strand().submit(lambda: caller.append(threading.current_thread()))
+    assert caller == [threading.current_thread()]
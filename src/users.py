@@ -1,9 +1,6 @@
 # users.py
-import sqlite3
 import hashlib
-from database import initialize_database
-
-DB_FILE = "chat_app.db"
+from storage import create_user, get_password_hash, delete_user
 
 
 def hash_password(password: str) -> str:
@@ -30,40 +27,18 @@ def register_user(username: str, password: str) -> tuple[bool, str]:
     Returns:
         tuple[bool, str]: A tuple containing success (bool) and message (str).
     """
+    if not username or not password:
+        return False, "Registration failed: username and password are required."
     try:
-        # Connect to the database
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        # Check if the username already exists
-        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            # If it does, return False with an appropriate message
+        # Store the user with a hash of their password
+        if not create_user(username, hash_password(password)):
             return False, "Username already exists."
-
-        # Hash the password
-        hashed_pw = hash_password(password)
-
-        # Insert new user into the database
-        cursor.execute(
-            """
-            INSERT INTO users (username, password_hash)
-            VALUES (?, ?)
-        """,
-            (username, hashed_pw),
-        )
-
-        # Commit the changes
-        conn.commit()
         # Return True with a success message
         return True, "Registration successful. You can now log in."
     except Exception as e:
         # If an error occurs, print the error and return False with an appropriate message
         print(f"[-] Error registering user: {e}")
         return False, "Registration failed due to server error."
-    finally:
-        # Close the database connection
-        conn.close()
 
 
 def authenticate_user(username: str, password: str) -> bool:
@@ -78,28 +53,18 @@ def authenticate_user(username: str, password: str) -> bool:
         bool: True if the credentials are valid, False otherwise.
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT password_hash FROM users WHERE username = ?", (username,)
-        )
-        row = cursor.fetchone()
-        if not row:
+        stored_hash = get_password_hash(username)
+        if stored_hash is None:
             return False
-
-        stored_hash = row[0]
         return stored_hash == hash_password(password)
     except Exception as e:
         print(f"[-] Error authenticating user: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def delete_account(username: str) -> bool:
     """
-    Deletes a user and their messages from the database.
+    Deletes a user and their messages.
 
     Args:
         username (str): The username to delete.
@@ -108,19 +73,7 @@ def delete_account(username: str) -> bool:
         bool: True if successful, False otherwise.
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        # Delete the user's messages first (to maintain foreign key constraints)
-        cursor.execute("DELETE FROM messages WHERE sender = ?", (username,))
-
-        # Delete the user account
-        cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-
-        conn.commit()
-        return True
+        return delete_user(username)
     except Exception as e:
         print(f"[-] Error deleting user {username}: {e}")
         return False
-    finally:
-        conn.close()
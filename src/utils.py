@@ -1,15 +1,16 @@
 # utils.py
-import sys
 import hashlib
 import base64
 import struct
 import json  # Added import for json
 import logging
 import custom_protocol
-import traceback
 import os
 import socket
-from typing import Dict, Any, Optional, Union
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Any, List, Optional, Union
 
 MAGIC_STRING = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 WS_FIN_TEXT_FRAME = 0x81  # FIN=1, Opcode=1 (text frame)
@@ -30,14 +31,191 @@ WS_PAYLOAD_LEN_MASK = 0x7F  # Mask to extract payload length (0111 1111)
 WS_OPCODE_MASK = 0x0F  # Mask to extract opcode (0000 1111)
 
 WS_OPCODE_CLOSE = 0x8  # Opcode for Close Frame
+WS_OPCODE_PING = 0x9  # Opcode for Ping Frame
+WS_OPCODE_PONG = 0xA  # Opcode for Pong Frame
 WS_OPCODE_TEXT = 0x1  # Opcode for Text Frame
+WS_OPCODE_CONTINUATION = 0x0  # Opcode for Continuation Frame
+WS_FIN_BIT = 0x80  # FIN flag (1000 0000)
+WS_CONTROL_OPCODE_MIN = 0x8  # Opcodes >= 0x8 are control frames
+
+# Close frame status codes (RFC 6455, section 7.4.1)
+WS_CLOSE_NORMAL = 1000  # The purpose of the connection was fulfilled
+WS_CLOSE_GOING_AWAY = 1001  # The server is shutting down or restarting
+WS_CLOSE_PROTOCOL_ERROR = 1002  # The peer broke the framing rules
+WS_CLOSE_UNSUPPORTED_DATA = 1003  # A message type we do not accept, e.g. binary
+WS_CLOSE_NO_STATUS = 1005  # Never sent: the close frame carried no status code
+WS_CLOSE_INVALID_PAYLOAD = 1007  # A message that cannot be decoded
+WS_CLOSE_TOO_BIG = 1009  # A message over max_message_size
+WS_CLOSE_INTERNAL_ERROR = 1011  # The server failed handling the connection
+# Seconds to wait for the peer's side of a close before closing anyway
+WS_CLOSE_TIMEOUT = 2.0
+
+# Fragmentation limits, overridable with WS_MAX_FRAGMENT_SIZE / WS_MAX_MESSAGE_SIZE
+DEFAULT_MAX_FRAGMENT_SIZE = WS_PAYLOAD_LEN_16BIT_MAX  # Keeps headers at 4 bytes
+DEFAULT_MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # Reassembled message cap (16 MiB)
+RECV_CHUNK_SIZE = 64 * 1024  # Upper bound for a single recv() call
+MAX_HANDSHAKE_SIZE = 8 * 1024  # Bytes of HTTP request or response head accepted
+# Max buffers per sendmsg() call; POSIX guarantees at least 16, Linux allows 1024
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+
+class WebSocketError(ValueError):
+    """
+    A protocol violation by the peer. The connection must be closed with
+    code as its close status.
+    """
+
+    def __init__(self, message: str, code: int = WS_CLOSE_PROTOCOL_ERROR) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def apply_mask(data: Union[bytes, bytearray, memoryview], masking_key: bytes) -> bytes:
+    """
+    XORs data with a 4-byte WebSocket masking key.
+
+    The XOR is done on two big integers instead of byte by byte, which keeps
+    unmasking of large fragments out of the Python-level loop.
+
+    Args:
+        data (bytes): The masked (or unmasked) payload.
+        masking_key (bytes): The 4-byte masking key.
+
+    Returns:
+        bytes: The payload XORed with the repeated key.
+    """
+    length = len(data)
+    key_stream = (masking_key * (length // 4 + 1))[:length]
+    return (
+        int.from_bytes(data, "big") ^ int.from_bytes(key_stream, "big")
+    ).to_bytes(length, "big")
+
+
+def read_http_head(
+    conn: socket.socket,
+    max_size: int = MAX_HANDSHAKE_SIZE,
+    timeout: Optional[float] = None,
+) -> bytes:
+    """
+    Reads an HTTP request or response head, up to and including the blank
+    line, however the peer split it into segments.
+
+    Incoming bytes are peeked at before being read, and only the head is
+    read: whatever the peer sent after it, e.g. its first frames, stays in
+    the socket for the frame reader.
+
+    Args:
+        conn (socket.socket): The socket connection to read from.
+        max_size (int): Most bytes the head may take.
+        timeout (Optional[float]): Seconds the whole head may take to
+            arrive; None leaves only the socket's own timeout per read.
+
+    Returns:
+        bytes: The head, ending with b"\\r\\n\\r\\n".
+
+    Raises:
+        ValueError: If the head is longer than max_size.
+        ConnectionError: If the peer closes before the head is complete.
+        socket.timeout: If it takes longer than timeout.
+    """
+    head = bytearray()
+    previous_timeout = conn.gettimeout() if timeout is not None else None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("Timed out reading the HTTP head.")
+                conn.settimeout(remaining)
+            peeked = conn.recv(max_size + 1 - len(head), socket.MSG_PEEK)
+            if not peeked:
+                raise ConnectionError("Connection closed during the handshake.")
+            # The blank line may straddle bytes already read and peeked ones
+            tail = bytes(head[-3:])
+            end = (tail + peeked).find(b"\r\n\r\n")
+            take = len(peeked) if end < 0 else end + 4 - len(tail)
+            head += WebSocketUtil._recv_exact(conn, take)
+            if len(head) > max_size:
+                raise ValueError(f"HTTP head exceeds {max_size} bytes.")
+            if end >= 0:
+                return bytes(head)
+    finally:
+        if deadline is not None:
+            conn.settimeout(previous_timeout)
+
+
+def parse_http_head(head: bytes) -> tuple:
+    """
+    Splits an HTTP head into its first line and headers.
+
+    Args:
+        head (bytes): The head, as returned by read_http_head.
+
+    Returns:
+        tuple: (start line, headers); header names are lowercased, and
+        repeated headers are joined with ", ".
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        name, value = name.strip().lower(), value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return lines[0], headers
+
+
+def _header_tokens(headers: Dict[str, str], name: str) -> set:
+    return {token.strip().lower() for token in headers.get(name, "").split(",")}
+
+
+def _upgrade_request_error(request_line: str, headers: Dict[str, str]) -> Optional[str]:
+    """
+    Checks an upgrade request against RFC 6455, section 4.2.1.
+
+    Returns:
+        Optional[str]: What is wrong with it, or None if it is valid.
+    """
+    parts = request_line.split(" ")
+    if len(parts) != 3 or parts[0] != "GET" or parts[2] != "HTTP/1.1":
+        return f"Not a GET request over HTTP/1.1: {request_line!r}"
+    if "host" not in headers:
+        return "Host header missing."
+    if "websocket" not in _header_tokens(headers, "upgrade"):
+        return "Upgrade header does not name websocket."
+    if "upgrade" not in _header_tokens(headers, "connection"):
+        return "Connection header does not name upgrade."
+    ws_key = headers.get("sec-websocket-key")
+    if not ws_key:
+        return "WebSocket key not found."
+    try:
+        if len(base64.b64decode(ws_key, validate=True)) != 16:
+            return "WebSocket key is not 16 bytes long."
+    except ValueError:
+        return "WebSocket key is not base64."
+    return None
+
+
+def _http_error_response(status: str, headers: str = "") -> bytes:
+    return (
+        f"HTTP/1.1 {status}\r\n{headers}Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ).encode("ascii")
 
 
 def perform_handshake(conn: socket.socket) -> bool:
     """
-    Reads the client's HTTP handshake request, parses out the Sec-WebSocket-Key,
-    and responds with the appropriate 101 Switching Protocols and
-    Sec-WebSocket-Accept header.
+    Reads the client's HTTP handshake request, validates it, and responds
+    with 101 Switching Protocols and the Sec-WebSocket-Accept header, or
+    with an HTTP error. Frames the client sent along with the request are
+    left in the socket for the frame reader.
+
+    The socket's timeout, if any, bounds the whole request, so a client
+    trickling it in byte by byte cannot hold the connection longer.
 
     Args:
         conn (socket.socket): The socket connection to the client.
@@ -46,32 +224,52 @@ def perform_handshake(conn: socket.socket) -> bool:
         bool: True if the handshake was successful, False otherwise.
     """
     try:
-        request = conn.recv(1024).decode("utf-8", errors="ignore")
-        headers = {}
-        lines = request.split("\r\n")
-        for line in lines[1:]:
-            if ": " in line:
-                key, value = line.split(": ", 1)
-                headers[key.lower()] = value
-
-        ws_key = headers.get("sec-websocket-key")
-        if not ws_key:
-            print("[-] WebSocket key not found.")
-            return False
-
-        accept_val = generate_accept_key(ws_key)
-        response = (
-            "HTTP/1.1 101 Switching Protocols\r\n"
-            "Upgrade: websocket\r\n"
-            "Connection: Upgrade\r\n"
-            f"Sec-WebSocket-Accept: {accept_val}\r\n"
-            "\r\n"
+        head = read_http_head(conn, timeout=conn.gettimeout())
+    except ValueError as e:
+        logging.warning(f"Handshake failed: {e}")
+        _send_quietly(conn, _http_error_response("431 Request Header Fields Too Large"))
+        return False
+    except OSError as e:
+        logging.info(f"Handshake failed: {e}")
+        return False
+
+    request_line, headers = parse_http_head(head)
+    error = _upgrade_request_error(request_line, headers)
+    if error is None and headers.get("sec-websocket-version") != "13":
+        logging.warning(
+            f"Unsupported WebSocket version: {headers.get('sec-websocket-version')}"
+        )
+        _send_quietly(
+            conn,
+            _http_error_response("426 Upgrade Required", "Sec-WebSocket-Version: 13\r\n"),
         )
+        return False
+    if error is not None:
+        logging.warning(f"Handshake failed: {error}")
+        _send_quietly(conn, _http_error_response("400 Bad Request"))
+        return False
+
+    accept_val = generate_accept_key(headers["sec-websocket-key"])
+    response = (
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept_val}\r\n"
+        "\r\n"
+    )
+    try:
         conn.sendall(response.encode("utf-8"))
-        return True
-    except Exception as e:
-        print(f"[-] Handshake failed: {e}")
+    except OSError as e:
+        logging.info(f"Handshake failed: {e}")
         return False
+    return True
+
+
+def _send_quietly(conn: socket.socket, data: bytes) -> None:
+    try:
+        conn.sendall(data)
+    except OSError:
+        pass  # The client is gone; it would not read the error anyway
 
 
 def generate_accept_key(key: str) -> str:
@@ -89,6 +287,28 @@ def generate_accept_key(key: str) -> str:
     return base64.b64encode(sha1).decode("utf-8")
 
 
+class PreparedFrame:
+    """
+    A message that has been encoded and framed once so it can be written to
+    any number of connections without re-serializing it.
+    """
+
+    def __init__(self, payload: bytes, buffers: List[Any]) -> None:
+        """
+        Initializes the PreparedFrame object.
+
+        :param payload: The encoded message payload.
+        :type payload: bytes
+        :param buffers: The header/payload buffer vector built from the payload.
+        :type buffers: List[Any]
+        """
+        self.payload = payload
+        self.buffers = buffers
+
+    def __len__(self) -> int:
+        return sum(len(buf) for buf in self.buffers)
+
+
 class WebSocketUtil:
     """
     Utility class for working with WebSockets.
@@ -111,13 +331,44 @@ class WebSocketUtil:
     WS_OPCODE_MASK = 0x0F  # Mask to extract opcode (0000 1111)
 
     WS_OPCODE_CLOSE = 0x8  # Opcode for Close Frame
+    WS_OPCODE_PING = 0x9  # Opcode for Ping Frame
+    WS_OPCODE_PONG = 0xA  # Opcode for Pong Frame
     WS_OPCODE_TEXT = 0x1  # Opcode for Text Frame
-
-    def __init__(self, mode=None):
+    WS_OPCODE_CONTINUATION = 0x0  # Opcode for Continuation Frame
+    WS_FIN_BIT = 0x80  # FIN flag (1000 0000)
+    WS_CONTROL_OPCODE_MIN = 0x8  # Opcodes >= 0x8 are control frames
+    WS_OPCODE_BINARY = 0x2  # Opcode for Binary Frame
+    # Control frames carry at most 125 bytes, 2 of them the close status code
+    WS_CLOSE_REASON_MAX = 123
+
+    def __init__(
+        self,
+        mode=None,
+        max_fragment_size: Optional[int] = None,
+        max_message_size: Optional[int] = None,
+        lazy_decoding: bool = False,
+    ):
         self.mode = mode
+        # Custom-protocol messages are decoded on access, see Decoder.decode_view
+        self.lazy_decoding = lazy_decoding
         if not mode:
             self.mode = os.environ.get("MODE", "json")
             logging.warning(f"Using mode: {self.mode}")
+        if max_fragment_size is None:
+            max_fragment_size = int(
+                os.environ.get("WS_MAX_FRAGMENT_SIZE", DEFAULT_MAX_FRAGMENT_SIZE)
+            )
+        if max_message_size is None:
+            max_message_size = int(
+                os.environ.get("WS_MAX_MESSAGE_SIZE", DEFAULT_MAX_MESSAGE_SIZE)
+            )
+        if max_fragment_size <= 0:
+            raise ValueError("max_fragment_size must be positive.")
+        self.max_fragment_size = max_fragment_size
+        self.max_message_size = max_message_size
+        # One lock per connection, held for each whole frame written to it
+        self._send_locks = weakref.WeakKeyDictionary()
+        self._send_locks_guard = threading.Lock()
         if mode != "json":
             self.encoder = custom_protocol.Encoder(custom_protocol.load_protocols())
             self.decoder = custom_protocol.Decoder(custom_protocol.load_protocols())
@@ -142,85 +393,539 @@ class WebSocketUtil:
         conn.sendall(response.encode("utf-8"))
         return True
 
-    def read_ws_frame(self, conn: socket.socket) -> Dict[str, Any]:
+    @staticmethod
+    def _recv_exact(conn: socket.socket, n: int) -> bytes:
         """
-        Reads a single WebSocket frame and returns the decoded payload as a dictionary.
-        Returns None if connection is closed or on error.
+        Reads exactly n bytes from the socket.
 
         Args:
-            conn (socket.socket): The socket connection to the client.
+            conn (socket.socket): The socket connection to read from.
+            n (int): The number of bytes to read.
 
         Returns:
-            Dict[str, Any] or None: The decoded payload as a dictionary, or None if connection is closed or on error.
+            bytes: The bytes read.
+
+        Raises:
+            ConnectionError: If the peer closes the connection before n bytes arrive.
         """
-        try:
-            # Read the first two bytes of the frame
-            header = conn.recv(self.WS_HEADER_SIZE)
-            if len(header) < self.WS_HEADER_SIZE:
+        data = conn.recv(n)
+        if len(data) == n:
+            return data
+        chunks = [data]
+        received = len(data)
+        while received < n:
+            if not data:
+                raise ConnectionError("Connection closed mid-frame.")
+            data = conn.recv(n - received)
+            chunks.append(data)
+            received += len(data)
+        return b"".join(chunks)
+
+    def _recv_into(
+        self, conn: socket.socket, buffer: bytearray, offset: int, n: int
+    ) -> None:
+        """
+        Reads exactly n bytes from the socket into buffer[offset:offset + n].
+
+        Args:
+            conn (socket.socket): The socket connection to read from.
+            buffer (bytearray): The preallocated destination buffer.
+            offset (int): Where in the buffer to start writing.
+            n (int): The number of bytes to read.
+
+        Raises:
+            ConnectionError: If the peer closes the connection before n bytes arrive.
+        """
+        view = memoryview(buffer)
+        end = offset + n
+        while offset < end:
+            chunk = conn.recv(min(end - offset, RECV_CHUNK_SIZE))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-frame.")
+            view[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+    def _read_frame_header(self, conn: socket.socket) -> Optional[tuple]:
+        """
+        Reads a frame header, including the extended length and masking key.
+
+        Args:
+            conn (socket.socket): The socket connection to read from.
+
+        Returns:
+            Optional[tuple]: (fin, opcode, payload_len, masking_key), or None if the
+            connection was closed before a full header arrived. masking_key is
+            None for unmasked frames.
+        """
+        header = conn.recv(self.WS_HEADER_SIZE)
+        if len(header) == 1:
+            header += conn.recv(1)
+        if len(header) < self.WS_HEADER_SIZE:
+            return None
+
+        b1, b2 = header
+        fin = (b1 >> 7) & 1
+        opcode = b1 & self.WS_OPCODE_MASK
+        masked = (b2 >> 7) & 1
+        payload_len = b2 & self.WS_PAYLOAD_LEN_MASK
+
+        if payload_len == self.WS_PAYLOAD_LEN_16BIT:
+            extended_payload = self._recv_exact(conn, 2)
+            payload_len = struct.unpack(self.WS_16BIT_LEN_FORMAT, extended_payload)[0]
+        elif payload_len == self.WS_PAYLOAD_LEN_64BIT:
+            extended_payload = self._recv_exact(conn, 8)
+            payload_len = struct.unpack(self.WS_64BIT_LEN_FORMAT, extended_payload)[0]
+
+        masking_key = self._recv_exact(conn, 4) if masked else None
+        return fin, opcode, payload_len, masking_key
+
+    def read_message(
+        self,
+        conn: socket.socket,
+        on_control: Optional[Callable[[int, bytes], None]] = None,
+    ) -> Optional[bytearray]:
+        """
+        Reads one complete WebSocket message, reassembling continuation frames.
+
+        Fragments are received straight into a single buffer that is allocated
+        up front for unfragmented messages and grown geometrically otherwise,
+        so no per-fragment copies are concatenated. Control frames may be
+        interleaved between fragments.
+
+        Args:
+            conn (socket.socket): The socket connection to read from.
+            on_control (Optional[Callable[[int, bytes], None]]): Called with the
+                opcode and unmasked payload of each ping or pong frame.
+
+        Returns:
+            Optional[bytearray]: The unmasked text payload, or None if the
+            connection was closed. A close frame from the peer is passed to
+            on_control first, so the caller can answer it.
+
+        Raises:
+            WebSocketError: On protocol violations, binary messages or if the
+                message exceeds max_message_size; its code is the status to
+                close the connection with.
+            ConnectionError: If the connection drops mid-frame.
+        """
+        buffer = bytearray()
+        length = 0
+        message_opcode = None
+
+        while True:
+            frame_header = self._read_frame_header(conn)
+            if frame_header is None:
                 return None
+            fin, opcode, payload_len, masking_key = frame_header
+
+            if opcode >= self.WS_CONTROL_OPCODE_MIN:
+                # Control frames are never fragmented and may arrive mid-message
+                if opcode not in (self.WS_OPCODE_CLOSE, self.WS_OPCODE_PING, self.WS_OPCODE_PONG):
+                    raise WebSocketError(f"Unknown control opcode {opcode:#x}.")
+                if not fin:
+                    raise WebSocketError("Fragmented control frame.")
+                if payload_len > self.WS_PAYLOAD_LEN_8BIT_MAX:
+                    raise WebSocketError("Control frame payload too long.")
+                control_payload = self._recv_exact(conn, payload_len) if payload_len else b""
+                if masking_key is not None and control_payload:
+                    control_payload = apply_mask(control_payload, masking_key)
+                if opcode == self.WS_OPCODE_CLOSE:
+                    self.parse_close_payload(control_payload)  # Validates it
+                    if on_control is not None:
+                        on_control(opcode, control_payload)
+                    return None
+                if on_control is not None:
+                    on_control(opcode, control_payload)
+                continue
+
+            if opcode == self.WS_OPCODE_CONTINUATION:
+                if message_opcode is None:
+                    raise WebSocketError("Continuation frame without a message start.")
+            elif opcode not in (self.WS_OPCODE_TEXT, self.WS_OPCODE_BINARY):
+                raise WebSocketError(f"Unknown data opcode {opcode:#x}.")
+            elif message_opcode is not None:
+                raise WebSocketError("New message started before previous one finished.")
+            else:
+                message_opcode = opcode
 
-            b1, b2 = header
-            fin = (b1 >> 7) & 1
-            opcode = b1 & self.WS_OPCODE_MASK
-            masked = (b2 >> 7) & 1
-            payload_len = b2 & self.WS_PAYLOAD_LEN_MASK
-
-            if payload_len == self.WS_PAYLOAD_LEN_16BIT:
-                extended_payload = conn.recv(2)
-                payload_len = struct.unpack(self.WS_16BIT_LEN_FORMAT, extended_payload)[
-                    0
-                ]
-            elif payload_len == self.WS_PAYLOAD_LEN_64BIT:
-                extended_payload = conn.recv(8)
-                payload_len = struct.unpack(self.WS_64BIT_LEN_FORMAT, extended_payload)[
-                    0
-                ]
-
-            if masked:
-                masking_key = conn.recv(4)
-            logging.warning(f"\n\nPayload Length: {payload_len}")
-            payload_data = b""
-            remaining = payload_len
-            while remaining > 0:
-                chunk = conn.recv(remaining)
-                if not chunk:
-                    break
-                payload_data += chunk
-                remaining -= len(chunk)
-
-            if masked:
-                payload_data = bytes(
-                    b ^ masking_key[i % 4] for i, b in enumerate(payload_data)
+            if length + payload_len > self.max_message_size:
+                raise WebSocketError(
+                    f"Message exceeds max size of {self.max_message_size} bytes.",
+                    WS_CLOSE_TOO_BIG,
                 )
 
-            if opcode == self.WS_OPCODE_CLOSE:
-                # Close frame
-                return None
-            elif opcode == self.WS_OPCODE_TEXT:
-                # Text frame
-                if self.mode == "json":
-                    message = payload_data.decode("utf-8", errors="ignore")
-                    data = json.loads(message)
-                else:
-                    decoder = custom_protocol.Decoder(custom_protocol.load_protocols())
-                    logging.warning(f"READ PAYLOAD DATA: {payload_data}")
-                    data = decoder.decode_message(payload_data)
-                    logging.warning(f"READ DATA: {data}")
+            needed = length + payload_len
+            if needed > len(buffer):
+                capacity = needed
+                if not fin:
+                    # More fragments follow; leave headroom for them
+                    capacity = min(max(needed, 2 * len(buffer)), self.max_message_size)
+                buffer.extend(bytes(capacity - len(buffer)))
+
+            self._recv_into(conn, buffer, length, payload_len)
+            if masking_key is not None and payload_len:
+                buffer[length:needed] = apply_mask(
+                    memoryview(buffer)[length:needed], masking_key
+                )
+            length = needed
 
-                return data
+            if fin:
+                break
 
-            else:
-                # For simplicity, ignore other opcodes
-                return None
+        if message_opcode != self.WS_OPCODE_TEXT:
+            raise WebSocketError("Binary messages are not supported.", WS_CLOSE_UNSUPPORTED_DATA)
 
-        except Exception as e:
-            print(traceback.format_exc())
-            print(f"[-] Error reading frame: {e}")
+        del buffer[length:]
+        return buffer
+
+    def decode_payload(self, payload: Union[bytes, bytearray]) -> Dict[str, Any]:
+        """
+        Decodes a text payload using the configured codec.
+
+        Args:
+            payload (bytes): The reassembled message payload.
+
+        Returns:
+            Dict[str, Any]: The decoded message; a read-only MessageView
+            over payload with lazy_decoding in custom mode.
+        """
+        if self.mode == "json":
+            message = payload.decode("utf-8", errors="ignore")
+            return json.loads(message)
+        # Formatted only when enabled: printing a view would decode all of it
+        logging.debug("READ PAYLOAD DATA: %s", payload)
+        if self.lazy_decoding:
+            data = self.decoder.decode_view(payload)
+        else:
+            data = self.decoder.decode_message(payload)
+        logging.debug("READ DATA: %s", data)
+        return data
+
+    def read_ws_frame(
+        self,
+        conn: socket.socket,
+        on_control: Optional[Callable[[int, bytes], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Reads a single WebSocket message and returns the decoded payload as a dictionary.
+        Fragmented messages are reassembled before decoding.
+        Returns None if the connection is closed; errors are raised instead.
+
+        Args:
+            conn (socket.socket): The socket connection to the client.
+            on_control (Optional[Callable[[int, bytes], None]]): Called for each
+                ping, pong or close frame read on the way, see read_message.
+
+        Returns:
+            Dict[str, Any] or None: The decoded payload as a dictionary, or None if connection is closed.
+
+        Raises:
+            WebSocketError: If the peer broke the protocol or sent an
+                undecodable message; close the connection with its code.
+            OSError: If the connection failed, e.g. ConnectionError when it
+                drops mid-frame.
+        """
+        payload_data = self.read_message(conn, on_control)
+        if payload_data is None:
             return None
+        logging.warning(f"\n\nPayload Length: {len(payload_data)}")
+        try:
+            return self.decode_payload(payload_data)
+        except Exception as e:
+            raise WebSocketError(f"Undecodable message: {e}", WS_CLOSE_INVALID_PAYLOAD) from e
+
+    @staticmethod
+    def parse_close_payload(payload: bytes) -> tuple:
+        """
+        Reads the status code and reason of a close frame.
+
+        Args:
+            payload (bytes): The unmasked close frame payload.
+
+        Returns:
+            tuple: (code, reason); code is WS_CLOSE_NO_STATUS if there was none.
+
+        Raises:
+            WebSocketError: If the code may not be sent on the wire or the
+                reason is not UTF-8.
+        """
+        if not payload:
+            return WS_CLOSE_NO_STATUS, ""
+        if len(payload) == 1:
+            raise WebSocketError("Truncated close status code.")
+        code = struct.unpack("!H", payload[:2])[0]
+        if code < 1000 or 1004 <= code <= 1006 or 1015 <= code < 3000 or code >= 5000:
+            raise WebSocketError(f"Invalid close status code {code}.")
+        try:
+            reason = bytes(payload[2:]).decode("utf-8")
+        except UnicodeDecodeError:
+            raise WebSocketError("Close reason is not UTF-8.", WS_CLOSE_INVALID_PAYLOAD)
+        return code, reason
+
+    def build_frame_header(self, opcode: int, fin: bool, payload_len: int) -> bytes:
+        """
+        Builds the 2-10 byte header of an unmasked frame.
+
+        Args:
+            opcode (int): The frame opcode.
+            fin (bool): Whether this is the final fragment of the message.
+            payload_len (int): The length of this frame's payload.
+
+        Returns:
+            bytes: The encoded frame header.
+        """
+        first_byte = (self.WS_FIN_BIT if fin else 0) | opcode
+        if payload_len <= self.WS_PAYLOAD_LEN_8BIT_MAX:
+            return bytes((first_byte, payload_len))
+        elif payload_len <= self.WS_PAYLOAD_LEN_16BIT_MAX:
+            return bytes((first_byte, self.WS_PAYLOAD_LEN_16BIT)) + struct.pack(
+                self.WS_16BIT_LEN_FORMAT, payload_len
+            )
+        return bytes((first_byte, self.WS_PAYLOAD_LEN_64BIT)) + struct.pack(
+            self.WS_64BIT_LEN_FORMAT, payload_len
+        )
+
+    def build_control_frame(self, opcode: int, payload: bytes = b"") -> bytes:
+        """
+        Builds a complete unmasked control frame, such as a ping or pong.
+
+        Args:
+            opcode (int): The control opcode.
+            payload (bytes): Application data of at most 125 bytes.
+
+        Returns:
+            bytes: The frame, header included.
+
+        Raises:
+            ValueError: If the payload is too long for a control frame.
+        """
+        if len(payload) > self.WS_PAYLOAD_LEN_8BIT_MAX:
+            raise ValueError("Control frame payload too long.")
+        return self.build_frame_header(opcode, True, len(payload)) + payload
+
+    def build_close_frame(self, code: int, reason: str = "") -> bytes:
+        """
+        Builds a close frame carrying a status code and an optional reason.
+
+        Args:
+            code (int): The status code, e.g. WS_CLOSE_GOING_AWAY; for
+                WS_CLOSE_NO_STATUS the frame carries no payload at all.
+            reason (str): A short human-readable reason, cut to fit the frame.
+
+        Returns:
+            bytes: The frame, header included.
+        """
+        if code == WS_CLOSE_NO_STATUS:
+            return self.build_control_frame(self.WS_OPCODE_CLOSE)
+        reason_bytes = reason.encode("utf-8")[: self.WS_CLOSE_REASON_MAX]
+        # Cutting may split a character; drop its remains
+        reason_bytes = reason_bytes.decode("utf-8", errors="ignore").encode("utf-8")
+        return self.build_control_frame(
+            self.WS_OPCODE_CLOSE, struct.pack("!H", code) + reason_bytes
+        )
+
+    def send_lock(self, conn: socket.socket) -> threading.Lock:
+        """
+        Returns the lock that serializes writes to a connection. Frames sent
+        from several threads, e.g. replies, pushes, pongs and pings, would
+        otherwise interleave and corrupt the stream. The send methods take
+        it themselves; hold it around any other write to the socket.
+
+        Args:
+            conn (socket.socket): The connection.
+
+        Returns:
+            threading.Lock: Its send lock, created on first use.
+        """
+        with self._send_locks_guard:
+            lock = self._send_locks.get(conn)
+            if lock is None:
+                lock = self._send_locks[conn] = threading.Lock()
+            return lock
+
+    def close_connection(
+        self,
+        conn: socket.socket,
+        code: Optional[int] = WS_CLOSE_NORMAL,
+        reason: str = "",
+        linger: float = WS_CLOSE_TIMEOUT,
+    ) -> None:
+        """
+        Closes a connection in order: sends a close frame, shuts down the
+        write side so the peer reads end of stream right after it, then
+        reads until the peer closes its side before closing the socket.
+
+        Closing with unread data would reset the connection, and the peer
+        might lose the close frame; waiting for its side also lets it free
+        the connection at once instead of lingering in CLOSE_WAIT.
+
+        Args:
+            conn (socket.socket): The connection to close.
+            code (Optional[int]): The close status; None sends no close
+                frame, for connections that already failed.
+            reason (str): A short human-readable reason.
+            linger (float): Most seconds to wait for the peer's side; 0
+                closes right away, e.g. once the peer's close frame was read.
+        """
+        try:
+            with self.send_lock(conn):
+                if code is not None:
+                    conn.sendall(self.build_close_frame(code, reason))
+                conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            linger = 0  # Nothing more will arrive on a broken connection
+        if linger > 0:
+            deadline = time.monotonic() + linger
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    conn.settimeout(remaining)
+                    if not conn.recv(RECV_CHUNK_SIZE):
+                        break
+            except OSError:
+                pass  # Timed out or reset; close anyway
+        conn.close()
+
+    def iter_fragments(self, payload: bytes):
+        """
+        Splits a payload into frames of at most max_fragment_size bytes.
+
+        Args:
+            payload (bytes): The encoded message payload.
+
+        Yields:
+            tuple: (header, chunk) pairs; chunks are memoryview slices of payload.
+        """
+        view = memoryview(payload)
+        total = len(view)
+        step = self.max_fragment_size
+        offset = 0
+        opcode = self.WS_OPCODE_TEXT
+        while True:
+            chunk = view[offset : offset + step]
+            offset += len(chunk)
+            fin = offset >= total
+            yield self.build_frame_header(opcode, fin, len(chunk)), chunk
+            if fin:
+                break
+            opcode = self.WS_OPCODE_CONTINUATION
+
+    def encode_payload(self, message: Union[dict, str]) -> bytes:
+        """
+        Encodes a message with the configured codec.
+
+        Args:
+            message (Union[dict, str]): The message to encode.
+
+        Returns:
+            bytes: The encoded payload, ready to be framed.
+        """
+        if self.mode == "json":
+            if isinstance(message, dict):
+                return json.dumps(message).encode("utf-8")
+            return str(message).encode("utf-8")
+        payload = self.encoder.encode_message(message)
+        logging.debug("WRITE PAYLOAD DATA: %s", payload)
+        return payload
+
+    @staticmethod
+    def send_buffers(conn: socket.socket, buffers: List[Any]) -> None:
+        """
+        Writes a sequence of buffers to the socket with vectored I/O.
+
+        The buffers are handed to socket.sendmsg without being joined, and
+        partial writes are resumed from the first unsent byte. Platforms
+        without sendmsg (e.g. Windows) fall back to one sendall per buffer.
+
+        Args:
+            conn (socket.socket): The socket connection to write to.
+            buffers (List[bytes]): The buffers to send, in order.
+        """
+        if not hasattr(conn, "sendmsg"):
+            for buf in buffers:
+                conn.sendall(buf)
+            return
+
+        pending = [memoryview(buf) for buf in buffers if len(buf)]
+        index = 0
+        while index < len(pending):
+            sent = conn.sendmsg(pending[index : index + IOV_MAX])
+            while sent > 0:
+                buf_len = len(pending[index])
+                if sent >= buf_len:
+                    sent -= buf_len
+                    index += 1
+                else:
+                    pending[index] = pending[index][sent:]
+                    sent = 0
+
+    def frame_buffers(self, payload: bytes) -> List[Any]:
+        """
+        Builds the header/payload buffer vector for a payload.
+
+        Only the 2-10 byte headers are allocated; payload chunks are
+        memoryview slices, so the same payload can be framed for any number
+        of connections without being copied.
+
+        Args:
+            payload (bytes): The encoded message payload.
+
+        Returns:
+            List[Any]: Alternating header and payload buffers.
+        """
+        buffers = []
+        for header, chunk in self.iter_fragments(payload):
+            buffers.append(header)
+            buffers.append(chunk)
+        return buffers
+
+    def send_payload(self, conn: socket.socket, payload: bytes) -> None:
+        """
+        Frames and sends an already encoded payload.
+
+        Args:
+            conn (socket.socket): The socket connection to send the frame over.
+            payload (bytes): The encoded message payload.
+        """
+        logging.warning("\n\nPayload Length: " + str(len(payload)))
+        # Server-to-client frames are not masked
+        buffers = self.frame_buffers(payload)
+        with self.send_lock(conn):
+            self.send_buffers(conn, buffers)
+
+    def prepare_frame(self, message: Union[dict, str]) -> PreparedFrame:
+        """
+        Encodes and frames a message once for delivery to several connections.
+
+        Args:
+            message (Union[dict, str]): The message to encode.
+
+        Returns:
+            PreparedFrame: The encoded payload together with its frame headers.
+        """
+        payload = self.encode_payload(message)
+        return PreparedFrame(payload, self.frame_buffers(payload))
+
+    def send_prepared(self, conn: socket.socket, frame: PreparedFrame) -> None:
+        """
+        Writes a prepared frame to a connection.
+
+        Unlike send_ws_frame, socket errors are raised so that fan-out callers
+        can account for each receiver separately.
+
+        Args:
+            conn (socket.socket): The socket connection to send the frame over.
+            frame (PreparedFrame): A frame built by prepare_frame.
+        """
+        with self.send_lock(conn):
+            self.send_buffers(conn, frame.buffers)
 
     def send_ws_frame(self, conn: socket.socket, message: Union[dict, str]) -> None:
         """
-        Sends a JSON-encoded text frame to the client.
+        Sends a JSON-encoded text message to the client. Payloads larger than
+        max_fragment_size are split into continuation frames.
 
         :param conn: The socket connection to send the frame over
         :param message: The message to encode and send, either a dictionary or a string
@@ -228,46 +933,7 @@ class WebSocketUtil:
         """
         try:
             logging.warning(f"Sending message: {message}")
-            if self.mode == "json":
-                if isinstance(message, dict):
-                    payload = json.dumps(message).encode("utf-8")
-                else:
-                    payload = str(message).encode("utf-8")
-            else:
-                encoder = custom_protocol.Encoder(custom_protocol.load_protocols())
-                payload = encoder.encode_message(message)
-                logging.warning(f"WRITE PAYLOAD DATA: {payload}")
-
-            logging.warning(f"Sending frame: {payload}")
-            payload_len = len(payload)
-            logging.warning("\n\nPayload Length: " + str(payload_len))
-            frame = bytearray()
-
-            # First byte: FIN=1 and opcode=1 (text)
-            frame.append(self.WS_FIN_TEXT_FRAME)
-
-            # Determine payload length
-            if payload_len < self.WS_PAYLOAD_LEN_8BIT_MAX:
-                frame.append(payload_len)
-            elif payload_len <= self.WS_PAYLOAD_LEN_16BIT_MAX:
-                #
-                frame.append(self.WS_PAYLOAD_LEN_16BIT)
-                frame.extend(struct.pack(self.WS_16BIT_LEN_FORMAT, payload_len))
-            else:
-                frame.append(self.WS_PAYLOAD_LEN_64BIT)
-                frame.extend(struct.pack(self.WS_64BIT_LEN_FORMAT, payload_len))
-
-            # Server-to-client frames are not masked
-            frame.extend(payload)
-            # get size in bytes of frame
-
-            print(f"Size of frame: {sys.getsizeof(frame)}")
-            # append it to a file
-            with open("frame_size.txt", "a") as f:
-                f.write(f"{sys.getsizeof(frame)}\n")
-            with open("frame_size.txt", "w") as f:
-                f.write(str(sys.getsizeof(frame)))
-
-            conn.sendall(frame)
+            payload = self.encode_payload(message)
+            self.send_payload(conn, payload)
         except Exception as e:
             print(f"[-] Error sending frame: {e}")
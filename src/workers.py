@@ -0,0 +1,176 @@
+# workers.py
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+import metrics
+
+# Threads running handlers, which bounds concurrent storage operations;
+# 0 runs handlers inline on each connection's own thread
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "8"))
+# Requests of one connection queued before its reader stops reading, which
+# pushes back on the client through TCP flow control
+MAX_PENDING_PER_CONNECTION = int(os.environ.get("MAX_PENDING_PER_CONNECTION", "32"))
+
+
+class Strand:
+    """
+    The tasks of one connection. They run on the pool one at a time and in
+    submission order, though not always on the same worker thread.
+    """
+
+    def __init__(self, pool: "WorkerPool", max_pending: int) -> None:
+        self._pool = pool
+        self._max_pending = max_pending
+        self._tasks: Deque[Tuple[float, Callable[..., Any], tuple]] = deque()
+        # True while the strand is queued on the pool or running a task
+        self._scheduled = False
+        self._cond = threading.Condition()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        """
+        Queues fn(*args) after the strand's earlier tasks, blocking while
+        max_pending tasks are already waiting.
+
+        Args:
+            fn (Callable[..., Any]): The task.
+            *args (Any): Its arguments.
+        """
+        if self._pool.size <= 0:
+            self._pool._run(fn, args)
+            return
+        with self._cond:
+            while len(self._tasks) >= self._max_pending:
+                self._cond.wait()
+            self._tasks.append((time.monotonic(), fn, args))
+            schedule = not self._scheduled
+            self._scheduled = True
+        self._pool._enqueued(self if schedule else None)
+
+    def join(self) -> None:
+        """
+        Waits until every submitted task has run.
+        """
+        with self._cond:
+            while self._scheduled:
+                self._cond.wait()
+
+    def _run_next(self) -> None:
+        """
+        Runs the oldest task, then puts the strand back in line if more are
+        waiting, so one busy connection cannot hold a worker.
+        """
+        with self._cond:
+            enqueued_at, fn, args = self._tasks.popleft()
+            self._cond.notify_all()
+        self._pool._started(time.monotonic() - enqueued_at)
+        self._pool._run(fn, args)
+        with self._cond:
+            more = bool(self._tasks)
+            if not more:
+                self._scheduled = False
+                self._cond.notify_all()
+        if more:
+            self._pool._ready.put(self)
+
+
+class WorkerPool:
+    """
+    Fixed-size pool running connection tasks. Connections read frames on
+    their own threads and submit the handler calls here through a Strand,
+    which keeps each connection's requests in order.
+
+    Metrics: "workers.queue_depth" and "workers.busy" gauges, and
+    "workers.tasks" and "workers.wait_seconds" counters, whose ratio is
+    the mean queueing delay; "workers.last_wait_seconds" is the latest.
+    """
+
+    def __init__(
+        self,
+        size: int = WORKER_THREADS,
+        max_pending: int = MAX_PENDING_PER_CONNECTION,
+    ) -> None:
+        """
+        Initializes the WorkerPool object. Threads start on first use.
+
+        :param size: Worker threads; 0 runs tasks inline on the submitter.
+        :param max_pending: Queued tasks per strand before submit blocks.
+        """
+        self.size = size
+        self.max_pending = max_pending
+        self._ready: "queue.Queue[Optional[Strand]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._busy = 0
+
+    def strand(self) -> Strand:
+        """
+        Returns a new strand for one connection's tasks.
+        """
+        return Strand(self, self.max_pending)
+
+    def _enqueued(self, strand: Optional[Strand]) -> None:
+        """
+        Counts a queued task and hands its strand to the workers if it was idle.
+        """
+        with self._lock:
+            self._depth += 1
+            metrics.set_gauge("workers.queue_depth", self._depth)
+            if not self._threads:
+                self._start()
+        if strand:
+            self._ready.put(strand)
+
+    def _started(self, waited: float) -> None:
+        with self._lock:
+            self._depth -= 1
+            self._busy += 1
+            metrics.set_gauge("workers.queue_depth", self._depth)
+            metrics.set_gauge("workers.busy", self._busy)
+        metrics.increment("workers.tasks")
+        metrics.increment("workers.wait_seconds", waited)
+        metrics.set_gauge("workers.last_wait_seconds", waited)
+
+    def _run(self, fn: Callable[..., Any], args: tuple) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            logging.error(f"Worker task failed: {e}", exc_info=True)
+        finally:
+            if self.size > 0:
+                with self._lock:
+                    self._busy -= 1
+                    metrics.set_gauge("workers.busy", self._busy)
+
+    def _start(self) -> None:
+        """
+        Starts the worker threads. Caller holds the lock.
+        """
+        for index in range(self.size):
+            thread = threading.Thread(target=self._work, name=f"worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            strand = self._ready.get()
+            if strand is None:
+                return
+            strand._run_next()
+
+    def shutdown(self) -> None:
+        """
+        Stops the workers after the tasks queued so far have started; join
+        the strands first for all of their tasks to run.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._ready.put(None)
+        for thread in threads:
+            thread.join()